@@ -7,4 +7,7 @@ setup(
     description='Performance evaluation of Terapixel rendering in Cloud (Super)computing',
     author='Ammar Hasan',
     license='MIT',
+    entry_points={
+        'console_scripts': ['make-dataset=src.data.make_dataset:cli'],
+    },
 )
@@ -0,0 +1,317 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the data preparation
+benchmark. Synthetic traces (see src.data.synthetic) are generated for every
+requested case, then the stages of the process (timestamp_conv,
+merge_check_task, START/STOP pairing, the interval join, the groupby
+aggregation and the csv write) are timed over a few repeats and memory
+profiled with tracemalloc in one more run. The report is a json file named
+after the git commit so runs of two commits can be compared.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data.interval_join import interval_sums, aggregate_intervals
+from src.data.synthetic import generate_traces
+
+BENCHMARK_DIR = 'reports/benchmarks'
+"""
+str: directory benchmark reports are written to
+"""
+
+STAGES = ['timestamp_conv', 'merge_check_task', 'pair_check_task',
+          'interval_join', 'aggregate', 'csv_write']
+"""
+list: benchmarked stages, in pipeline order
+"""
+
+class StageTimer(object):
+    """ Records the wall time, and with trace the peak traced memory, of
+    named stages (use as timer(name) context manager)
+
+    Parameters
+    ----------
+    trace
+        measure the peak memory allocated inside every stage (tracemalloc
+        must be running)
+    """
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.seconds = {}
+        self.peak_bytes = {}
+
+    def __call__(self, name):
+        self.name = name
+        return(self)
+
+    def __enter__(self):
+        if self.trace:
+            tracemalloc.reset_peak()
+            self.base = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return(self)
+
+    def __exit__(self, *exc_info):
+        self.seconds[self.name] = time.perf_counter() - self.start
+        if self.trace:
+            self.peak_bytes[self.name] = (tracemalloc.get_traced_memory()[1] -
+                                          self.base)
+        return(False)
+
+def run_stages(raw, output_file, timer):
+    """ Runs the data preparation stages once over raw dataframes
+
+    Parameters
+    ----------
+    raw
+        (gpu, checkpoints, tasks) raw dataframes, left unchanged
+    output_file
+        csv file the final dataset is written to
+    timer
+        StageTimer
+
+    Returns
+    -------
+    int
+        final dataset row count
+    """
+    gpu_df, checkpoints_df, tasks_df = (df.copy() for df in raw)
+
+    with timer('timestamp_conv'):
+        gpu_df['timestamp'] = md.timestamp_conv(gpu_df['timestamp'])
+        checkpoints_df['timestamp'] = md.timestamp_conv(
+                checkpoints_df['timestamp'])
+    gpu_df = gpu_df.drop(columns='gpuSerial')
+
+    with timer('merge_check_task'):
+        check_task_df = md.merge_check_task(checkpoints_df, tasks_df)
+    check_task_df = check_task_df.drop(columns=['jobId', 'taskId'],
+                                       errors='ignore')
+
+    # Pairing and the gpu time range filter, as merge_check_task_gpu
+
+    with timer('pair_check_task'):
+        intervals_df = md.task_intervals(gpu_df, check_task_df)
+
+    with timer('interval_join'):
+        sums, counts, first = interval_sums(gpu_df, intervals_df)
+
+    with timer('aggregate'):
+        uuids = gpu_df['gpuUUID'].to_numpy()[np.maximum(first, 0)]
+        final_df = aggregate_intervals(intervals_df, sums, counts, first,
+                                       uuids)
+
+    with timer('csv_write'):
+        md.save_processed(final_df, output_file, 'csv')
+
+    return(len(final_df))
+
+def benchmark_case(repeat=3, **kwargs):
+    """ Benchmarks the stages over one synthetic dataset
+
+    Parameters
+    ----------
+    repeat
+        timed runs, the fastest one is reported
+    kwargs
+        generate_traces arguments
+
+    Returns
+    -------
+    dict
+        case parameters, row counts and per stage seconds (fastest, all
+        runs) and peak traced bytes
+    """
+    raw = generate_traces(**kwargs)
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = os.path.join(directory, 'processed.csv')
+        for _ in range(repeat):
+            timer = StageTimer()
+            final_rows = run_stages(raw, output_file, timer)
+            runs.append(timer.seconds)
+
+        # Separate traced run, tracemalloc slows allocations down
+
+        timer = StageTimer(trace=True)
+        tracemalloc.start()
+        try:
+            run_stages(raw, output_file, timer)
+        finally:
+            tracemalloc.stop()
+
+    return({'params': kwargs,
+            'rows': {'gpu': len(raw[0]), 'checkpoints': len(raw[1]),
+                     'tasks': len(raw[2]), 'final': final_rows},
+            'stages': {stage: {'seconds': min(run[stage] for run in runs),
+                               'runs': [run[stage] for run in runs],
+                               'peak_bytes': timer.peak_bytes[stage]}
+                       for stage in STAGES}})
+
+def git_commit():
+    """ Gives the current git commit, marked dirty with local changes
+
+    Returns
+    -------
+    str
+        short commit hash, 'unknown' outside a git checkout
+    """
+    try:
+        commit = subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(
+                ['git', 'status', '--porcelain', '--untracked-files=no'],
+                stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return('unknown')
+    return(commit + ('-dirty' if dirty else ''))
+
+def run_benchmark(cases, repeat=3):
+    """ Benchmarks every case
+
+    Parameters
+    ----------
+    cases
+        list of generate_traces keyword argument dicts
+    repeat
+        timed runs per case
+
+    Returns
+    -------
+    dict
+        report with the commit, environment and case results
+    """
+    logger = logging.getLogger(__name__)
+    results = []
+    for case in cases:
+        logger.info('benchmarking %s', case)
+        results.append(benchmark_case(repeat=repeat, **case))
+    return({'commit': git_commit(),
+            'environment': {'python': platform.python_version(),
+                            'numpy': np.__version__,
+                            'pandas': pd.__version__,
+                            'machine': platform.machine(),
+                            'cpus': os.cpu_count()},
+            'repeat': repeat,
+            'cases': results})
+
+def compare_reports(old_report, new_report):
+    """ Compares the stage times of two reports, cases are matched by their
+    parameters
+
+    Parameters
+    ----------
+    old_report
+        baseline report
+    new_report
+        report to compare with the baseline
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        one row per case and stage with both times and the speedup
+        (old / new, above 1 is faster)
+    """
+    def case_times(report):
+        return({(json.dumps(case['params'], sort_keys=True), stage):
+                case['stages'][stage]['seconds']
+                for case in report['cases'] for stage in case['stages']})
+
+    old_times, new_times = case_times(old_report), case_times(new_report)
+    rows = [(case, stage, old_times[(case, stage)], new_times[(case, stage)])
+            for case, stage in new_times if (case, stage) in old_times]
+    df = pd.DataFrame(rows, columns=['case', 'stage', 'old_seconds',
+                                     'new_seconds'])
+    df['speedup'] = df['old_seconds'] / df['new_seconds']
+    return(df)
+
+def main(hosts=(4,), durations=(600,), levels=(12,), repeat=3,
+         output_dir=BENCHMARK_DIR, seed=0):
+    """ Benchmarks every host count and duration combination and writes
+    the report to output_dir/<commit>.json
+
+    Parameters
+    ----------
+    hosts
+        host counts
+    durations
+        run durations in seconds
+    levels
+        tile levels rendered
+    repeat
+        timed runs per case
+    output_dir
+        report directory
+    seed
+        synthetic trace seed
+
+    Returns
+    -------
+    str
+        report file location
+    """
+    logger = logging.getLogger(__name__)
+    cases = [{'hosts': host_count, 'duration': duration,
+              'levels': list(levels), 'seed': seed}
+             for host_count in hosts for duration in durations]
+    report = run_benchmark(cases, repeat)
+
+    os.makedirs(output_dir, exist_ok=True)
+    report_file = os.path.join(output_dir, report['commit'] + '.json')
+    with open(report_file, 'w') as json_file:
+        json.dump(report, json_file, indent=1, sort_keys=True)
+
+    for case in report['cases']:
+        logger.info('%s: %s', case['params'], ', '.join(
+                '{} {:.3f}s'.format(stage, case['stages'][stage]['seconds'])
+                for stage in STAGES))
+    logger.info('report written to %s', report_file)
+    return(report_file)
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    parser = argparse.ArgumentParser(description=__doc__.split('Code')[0])
+    parser.add_argument('--hosts', type=int, nargs='+', default=[4],
+                        help='host counts (default 4)')
+    parser.add_argument('--durations', type=int, nargs='+', default=[600],
+                        help='run durations in seconds (default 600)')
+    parser.add_argument('--levels', type=int, nargs='+', default=[12],
+                        help='tile levels rendered (default 12)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per case (default 3)')
+    parser.add_argument('--output-dir', default=BENCHMARK_DIR,
+                        help='report directory (default {})'
+                        .format(BENCHMARK_DIR))
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two reports instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        reports = []
+        for report_file in args.compare:
+            with open(report_file) as json_file:
+                reports.append(json.load(json_file))
+        print(compare_reports(*reports).to_string(index=False))
+    else:
+        main(hosts=args.hosts, durations=args.durations, levels=args.levels,
+             repeat=args.repeat, output_dir=args.output_dir)
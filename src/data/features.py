@@ -0,0 +1,200 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the per task feature table
+built beside the final dataset. Every task gets its total duration, number of
+attempts and gpu samples, energy (powerDrawWatt integrated over its
+intervals) and the min, max and 95th percentile of each gpu metric, all
+computed once with array operations over the samples located by the sorted
+interval join (see src.data.interval_join, the bounds it found are reused
+when the table is built with the final dataset) so analyses no longer
+recompute them per group.
+
+Energy integrates power with the trapezoidal rule between the samples of an
+interval that have a power reading, the first and last readings are held up
+to the interval bounds. Samples without a reading are skipped rather than
+counted as 0 W, an attempt without any reading adds nothing to its task and
+a task without any has a nan energy. Percentiles interpolate linearly like
+numpy.percentile, missing readings are skipped.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import numpy as np
+from src.data.instrumentation import instrumented
+from src.data.interval_join import (GPU_METRICS, TASK_KEYS, to_epoch_ns,
+                                    expand_bounds, interval_bounds)
+
+PERCENTILE = 95
+"""
+int: percentile of every gpu metric kept in the feature table
+"""
+
+FEATURE_COLUMNS = (['duration', 'attempts', 'samples', 'energy'] +
+                   [metric + suffix for metric in GPU_METRICS
+                    for suffix in ['_min', '_max', '_p' + str(PERCENTILE)]])
+"""
+list: feature columns, duration in seconds and energy in joules
+"""
+
+def interval_energy(times, power, lo, hi, starts, stops):
+    """ Integrates power over every interval (see module introduction)
+
+    Parameters
+    ----------
+    times
+        float seconds of the samples, sorted within every host block
+    power
+        float power readings of the samples, in the same order
+    lo
+        position of the first sample of each interval
+    hi
+        position after the last sample of each interval
+    starts
+        float seconds of each interval start
+    stops
+        float seconds of each interval stop
+
+    Returns
+    -------
+    numpy.ndarray
+        energy of each interval over its samples with a power reading (nan
+        when there is none)
+    """
+
+    # Samples without a reading are dropped, bounds move to the readings
+
+    present = ~np.isnan(power)
+    present_cs = np.concatenate([[0], np.cumsum(present)])
+    times, power = times[present], power[present]
+    lo, hi = present_cs[lo], present_cs[hi]
+
+    pieces = np.diff(times) * (power[1:] + power[:-1]) / 2
+    pieces_cs = np.concatenate([[0], np.cumsum(pieces)])
+
+    matched = hi > lo
+    first = lo[matched]
+    last = hi[matched] - 1
+
+    energy = np.full(len(lo), np.nan)
+    energy[matched] = (pieces_cs[last] - pieces_cs[first] +
+                       power[first] * (times[first] - starts[matched]) +
+                       power[last] * (stops[matched] - times[last]))
+    return(energy)
+
+def segment_stats(values, segments, n_segments):
+    """ Min, max and PERCENTILE of values within every segment
+
+    Parameters
+    ----------
+    values
+        float values, missing ones as nan
+    segments
+        non decreasing segment of every value
+    n_segments
+        number of segments
+
+    Returns
+    -------
+    tuple
+        (min, max, percentile) arrays, nan for segments without values
+    """
+
+    # Sort values within segments, nan sort last so valid ones lead
+
+    values = values[np.lexsort((values, segments))]
+    sizes = np.bincount(segments, minlength=n_segments)
+    counts = np.bincount(segments, weights=~np.isnan(values),
+                         minlength=n_segments).astype(np.int64)
+    begin = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+    has = counts > 0
+    lows = np.full(n_segments, np.nan)
+    highs = np.full(n_segments, np.nan)
+    percentiles = np.full(n_segments, np.nan)
+
+    begin, counts = begin[has], counts[has]
+    rank = (counts - 1) * PERCENTILE / 100.0
+    below = np.floor(rank).astype(np.int64)
+    above = np.minimum(below + 1, counts - 1)
+
+    lows[has] = values[begin]
+    highs[has] = values[begin + counts - 1]
+    percentiles[has] = values[begin + below] + (rank - below) * (
+            values[begin + above] - values[begin + below])
+    return(lows, highs, percentiles)
+
+@instrumented
+def task_features(gpu_df, intervals_df, bounds=None):
+    """ Builds the per task feature table, intervals sharing the same task
+    keys are pooled together like in the final dataset
+
+    Parameters
+    ----------
+    gpu_df
+        cleaned gpu dataframe
+    intervals_df
+        paired start/stop checkpoint and task dataframe
+    bounds
+        (order, lo, hi) sample bounds of the interval join (see
+        interval_join.interval_bounds), searched for if None
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        TASK_KEYS, first start_time and stop_time and FEATURE_COLUMNS for
+        every task with gpu samples, in the final dataset row order
+    """
+    order, lo, hi = bounds or interval_bounds(gpu_df, intervals_df)
+
+    # Inner join semantics, tasks ordered by first sample like the final
+    # dataset (tasks with missing keys are left out by its groupby too)
+
+    keep = (hi > lo) & intervals_df[TASK_KEYS].notnull().all(axis=1).values
+    keep = np.flatnonzero(keep)
+    keep = keep[np.argsort(order[lo[keep]], kind='mergesort')]
+    intervals_df = intervals_df.iloc[keep].reset_index(drop=True)
+    lo, hi = lo[keep], hi[keep]
+
+    tasks = intervals_df.groupby(TASK_KEYS, sort=False,
+                                 observed=True).ngroup().values
+    n_tasks = tasks.max() + 1 if len(tasks) else 0
+    firsts = np.unique(tasks, return_index=True)[1]
+
+    starts = to_epoch_ns(intervals_df['start_time']) / 1e9
+    stops = to_epoch_ns(intervals_df['stop_time']) / 1e9
+    times = to_epoch_ns(gpu_df['timestamp'])[order] / 1e9
+    values = gpu_df[GPU_METRICS].to_numpy(dtype=np.float64)
+
+    features_df = intervals_df.loc[
+            firsts, TASK_KEYS + ['start_time', 'stop_time']].reset_index(
+                    drop=True)
+    features_df['duration'] = np.bincount(tasks, weights=stops - starts,
+                                          minlength=n_tasks)
+    features_df['attempts'] = np.bincount(tasks, minlength=n_tasks)
+    features_df['samples'] = np.bincount(tasks, minlength=n_tasks,
+                                         weights=hi - lo).astype(np.int64)
+    energy = interval_energy(times, values[order, 0], lo, hi, starts, stops)
+    measured = ~np.isnan(energy)
+    features_df['energy'] = np.where(
+            np.bincount(tasks[measured], minlength=n_tasks) > 0,
+            np.bincount(tasks[measured], weights=energy[measured],
+                        minlength=n_tasks), np.nan)
+
+    # Gather the samples of every task, attempts of a task side by side
+
+    by_task = np.argsort(tasks, kind='mergesort')
+    positions, owners = expand_bounds(lo[by_task], hi[by_task])
+    rows = order[positions]
+    segments = tasks[by_task][owners]
+
+    for column, metric in enumerate(GPU_METRICS):
+        stats = segment_stats(values[rows, column], segments, n_tasks)
+        for suffix, stat in zip(['_min', '_max', '_p' + str(PERCENTILE)],
+                                stats):
+            features_df[metric + suffix] = stat
+
+    return(features_df)
@@ -0,0 +1,482 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the follow (live) data
+preparation process, used to watch a render while it runs. gpu.csv,
+application-checkpoints.csv and task-x-y.csv are tailed as they grow (named
+pipes work too) by one reader thread each. START/STOP checkpoints are paired
+as they arrive (like src.data.pairing, one interval per attempt), recent gpu
+samples of every host are held in a bounded ring buffer and every interval
+is averaged and written out as soon as its host has been sampled past its
+stop time. Checkpoints read before their task record wait, indexed by
+taskId, and are dropped once the newest checkpoint is more than a set time
+past them.
+
+Rows have the final dataset columns, one per attempt (retries are not
+pooled since later attempts may never come).
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import csv
+import logging
+import os
+import queue
+import threading
+import time
+import numpy as np
+import pandas as pd
+from src.data.interval_join import GPU_METRICS, TASK_KEYS
+from src.data.pairing import ISSUES
+
+FOLLOW_POLL_SECONDS = 0.5
+"""
+float: seconds waited for new lines once a followed file is drained
+"""
+
+RING_BUFFER_SAMPLES = 4096
+"""
+int: gpu samples kept per host (a bit over 2 hours at one sample every 2s)
+"""
+
+WAITING_CHECKPOINT_SECONDS = 3600.0
+"""
+float: checkpoint time a checkpoint waits for its task record before being
+dropped
+"""
+
+def parse_time(text):
+    """ Parses a raw timestamp
+
+    Parameters
+    ----------
+    text
+        ISO 8601 timestamp, optionally ending with Z
+
+    Returns
+    -------
+    int
+        nanoseconds since epoch
+    """
+    return(int(np.datetime64(text.rstrip('Z'), 'ns').astype(np.int64)))
+
+def parse_number(text):
+    """ Parses a raw metric reading
+
+    Parameters
+    ----------
+    text
+        number, empty when missing
+
+    Returns
+    -------
+    float
+        reading, nan when missing
+    """
+    return(float(text) if text else np.nan)
+
+def tail_lines(path, lines, stop, poll_seconds=FOLLOW_POLL_SECONDS):
+    """ Puts every complete line of a growing file on a queue until stopped
+    (reader thread target), waits for the file to appear
+
+    Parameters
+    ----------
+    path
+        file or named pipe location
+    lines
+        queue.Queue receiving lines
+    stop
+        threading.Event ending the thread
+    poll_seconds
+        seconds waited when no new line is there
+    """
+    while not os.path.exists(path):
+        if stop.wait(poll_seconds):
+            return
+    with open(path) as raw_file:
+        partial = ''
+        while not stop.is_set():
+            line = raw_file.readline()
+            if not line:
+                stop.wait(poll_seconds)
+                continue
+
+            # A line still being written is kept until its end arrives
+
+            partial += line
+            if partial.endswith('\n'):
+                lines.put(partial)
+                partial = ''
+
+class SampleRing(object):
+    """ Ring buffer of the latest gpu samples of one host
+
+    Parameters
+    ----------
+    capacity
+        samples kept, the oldest are overwritten
+    """
+
+    def __init__(self, capacity=RING_BUFFER_SAMPLES):
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.values = np.full((capacity, len(GPU_METRICS)), np.nan)
+        self.uuids = np.empty(capacity, dtype=object)
+        self.count = 0
+        self.last_time = None
+
+    def append(self, sample_time, uuid, values):
+        """ Adds a sample, overwriting the oldest one when full
+
+        Parameters
+        ----------
+        sample_time
+            nanoseconds since epoch
+        uuid
+            gpuUUID
+        values
+            readings of GPU_METRICS
+        """
+        slot = self.count % len(self.times)
+        self.times[slot] = sample_time
+        self.values[slot] = values
+        self.uuids[slot] = uuid
+        self.count += 1
+        if self.last_time is None or sample_time > self.last_time:
+            self.last_time = sample_time
+
+    def covers(self, start):
+        """ Tells if no sample from start on was overwritten yet
+
+        Parameters
+        ----------
+        start
+            nanoseconds since epoch
+
+        Returns
+        -------
+        bool
+            True when every sample after start is still held
+        """
+        return(self.count <= len(self.times) or self.times.min() < start)
+
+    def window(self, start, stop):
+        """ Gives the held samples between two times (both inclusive)
+
+        Parameters
+        ----------
+        start
+            nanoseconds since epoch
+        stop
+            nanoseconds since epoch
+
+        Returns
+        -------
+        tuple
+            (values, uuids) of the samples, in time order
+        """
+        times = self.times[:min(self.count, len(self.times))]
+        inside = np.flatnonzero((times >= start) & (times <= stop))
+        inside = inside[np.argsort(times[inside], kind='mergesort')]
+        return(self.values[inside], self.uuids[inside])
+
+class LiveJoin(object):
+    """ Incremental pairing and gpu join of followed records (see module
+    introduction)
+
+    Parameters
+    ----------
+    capacity
+        gpu samples kept per host
+    max_wait
+        seconds of checkpoint time a checkpoint waits for its task record
+    """
+
+    def __init__(self, capacity=RING_BUFFER_SAMPLES,
+                 max_wait=WAITING_CHECKPOINT_SECONDS):
+        self.capacity = capacity
+        self.max_wait = int(max_wait * 1e9)
+        self.rings = {}
+        self.tiles = {}
+        self.waiting = {}
+        self.latest_checkpoint = None
+        self.taskless = 0
+        self.starts = {}
+        self.closed = []
+        self.issues = dict.fromkeys(ISSUES, 0)
+        self.truncated = 0
+        self.time_range = None
+
+    def add_task(self, record):
+        """ Adds a task-x-y.csv record, then the checkpoints waiting for it
+
+        Parameters
+        ----------
+        record
+            dict of the csv row
+        """
+        self.tiles[record['taskId']] = (int(record['x']), int(record['y']),
+                                        int(record['level']))
+        for _, waiting in self.waiting.pop(record['taskId'], []):
+            self.add_checkpoint(waiting)
+
+    def add_sample(self, record):
+        """ Adds a gpu.csv record to its host ring buffer
+
+        Parameters
+        ----------
+        record
+            dict of the csv row
+        """
+        ring = self.rings.get(record['hostname'])
+        if ring is None:
+            ring = self.rings[record['hostname']] = SampleRing(self.capacity)
+        sample_time = parse_time(record['timestamp'])
+        ring.append(sample_time, record['gpuUUID'],
+                    [parse_number(record[metric]) for metric in GPU_METRICS])
+        if self.time_range is None:
+            self.time_range = (sample_time, sample_time)
+        self.time_range = (min(self.time_range[0], sample_time),
+                           max(self.time_range[1], sample_time))
+
+    def add_checkpoint(self, record):
+        """ Adds an application-checkpoints.csv record, pairing a STOP with
+        the open START of the same task (records of tasks not read yet wait)
+
+        Parameters
+        ----------
+        record
+            dict of the csv row
+        """
+        event_time = parse_time(record['timestamp'])
+        if (self.latest_checkpoint is None or
+                event_time > self.latest_checkpoint):
+            self.latest_checkpoint = event_time
+            self.expire_waiting()
+
+        tile = self.tiles.get(record['taskId'])
+        if tile is None:
+            self.waiting.setdefault(record['taskId'], []).append(
+                    (event_time, record))
+            return
+        key = (record['hostname'], record['eventName']) + tile
+
+        if record['eventType'] == 'START':
+            if key in self.starts:
+                self.issues['overlapping_start'] += 1
+            self.starts[key] = event_time
+        elif record['eventType'] == 'STOP':
+            start = self.starts.pop(key, None)
+            if start is None:
+                self.issues['unmatched_stop'] += 1
+            else:
+                self.closed.append((key, start, event_time))
+
+    def expire_waiting(self):
+        """ Drops the waiting checkpoints of tasks whose first one is more
+        than max_wait before the newest checkpoint (tasks are kept in the
+        order they started waiting, so only the oldest are looked at)
+        """
+        horizon = self.latest_checkpoint - self.max_wait
+        while self.waiting:
+            task_id = next(iter(self.waiting))
+            if self.waiting[task_id][0][0] >= horizon:
+                break
+            self.taskless += len(self.waiting.pop(task_id))
+
+    def emit(self, final=False):
+        """ Averages the closed intervals whose host was sampled past their
+        stop time, intervals outside the gpu samples times are left out
+        like in the final dataset
+
+        Parameters
+        ----------
+        final
+            emit every closed interval (no more samples are coming)
+
+        Returns
+        -------
+        pandas.core.frame.DataFrame
+            final dataset rows, one per interval with samples
+        """
+        rows, pending = [], []
+        for key, start, stop in self.closed:
+            ring = self.rings.get(key[0])
+            if not final and (ring is None or ring.last_time is None or
+                              ring.last_time < stop):
+                pending.append((key, start, stop))
+                continue
+            if ring is None or not (self.time_range[0] <= start and
+                                    stop <= self.time_range[1]):
+                continue
+            if not ring.covers(start):
+                self.truncated += 1
+            values, uuids = ring.window(start, stop)
+            if not len(values):
+                continue
+            counts = (~np.isnan(values)).sum(axis=0)
+            means = np.nansum(values, axis=0) / np.where(counts > 0, counts,
+                                                         np.nan)
+            rows.append(list(key) + list(means) + [start, stop, uuids[0]])
+        self.closed = pending
+
+        tasks_df = pd.DataFrame(rows, columns=TASK_KEYS + GPU_METRICS + [
+                'start_time', 'stop_time', 'gpuUUID'])
+        for col in ['start_time', 'stop_time']:
+            tasks_df[col] = tasks_df[col].astype(np.int64).astype(
+                    'datetime64[ns]')
+        return(tasks_df)
+
+    def finish(self):
+        """ Emits every closed interval and counts the STARTs never stopped
+        and the checkpoints still waiting for their task
+
+        Returns
+        -------
+        pandas.core.frame.DataFrame
+            final dataset rows left
+        """
+        self.issues['unmatched_start'] += len(self.starts)
+        self.starts = {}
+        self.taskless += sum(map(len, self.waiting.values()))
+        self.waiting = {}
+        return(self.emit(final=True))
+
+def drain(lines, header):
+    """ Takes every queued line of a followed csv file
+
+    Parameters
+    ----------
+    lines
+        queue.Queue of lines
+    header
+        list holding the column names once the first line is read
+
+    Returns
+    -------
+    list
+        dict records of the data lines
+    """
+    records = []
+    while True:
+        try:
+            line = lines.get_nowait()
+        except queue.Empty:
+            return(records)
+        values = next(csv.reader([line]))
+        if not header:
+            header.extend(values)
+        elif values:
+            records.append(dict(zip(header, values)))
+
+def follow_dataset(gpu_csv_file, check_csv_file, task_csv_file, output_file,
+                   poll_seconds=FOLLOW_POLL_SECONDS, idle_seconds=None,
+                   capacity=RING_BUFFER_SAMPLES,
+                   max_wait=WAITING_CHECKPOINT_SECONDS):
+    """ Follows the raw files and appends finished task rows to a csv file
+    until no line arrives for idle_seconds (or until interrupted)
+
+    Parameters
+    ----------
+    gpu_csv_file
+        gpu.csv file (or named pipe) location
+    check_csv_file
+        application-checkpoints.csv file (or named pipe) location
+    task_csv_file
+        task-x-y.csv file (or named pipe) location
+    output_file
+        live csv file location, rewritten from the start
+    poll_seconds
+        seconds between two polls of the files
+    idle_seconds
+        stop after this many seconds without a new line, never if None
+    capacity
+        gpu samples kept per host
+    max_wait
+        seconds of checkpoint time a checkpoint waits for its task record
+
+    Returns
+    -------
+    int
+        number of task rows written
+    """
+    logger = logging.getLogger(__name__)
+    stop = threading.Event()
+    sources = []
+    for path in [task_csv_file, check_csv_file, gpu_csv_file]:
+        lines = queue.Queue()
+        thread = threading.Thread(target=tail_lines, daemon=True,
+                                  args=(path, lines, stop, poll_seconds))
+        thread.start()
+        sources.append((lines, []))
+    tasks, checkpoints, samples = sources
+
+    join = LiveJoin(capacity, max_wait)
+    written = 0
+    last_line = time.time()
+    try:
+        while idle_seconds is None or time.time() - last_line < idle_seconds:
+            task_records = drain(*tasks)
+            check_records = drain(*checkpoints)
+            gpu_records = drain(*samples)
+            if task_records or check_records or gpu_records:
+                last_line = time.time()
+
+            for record in task_records:
+                join.add_task(record)
+            for record in gpu_records:
+                join.add_sample(record)
+            for record in check_records:
+                join.add_checkpoint(record)
+
+            written = write_live(join.emit(), output_file, written)
+            time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        logger.info('follow interrupted')
+    finally:
+        stop.set()
+
+    written = write_live(join.finish(), output_file, written)
+    logger.info('followed %d tasks, left out checkpoints: %s, checkpoints '
+                'without a task: %d, intervals past the ring buffer: %d',
+                written, join.issues, join.taskless, join.truncated)
+    return(written)
+
+def write_live(tasks_df, output_file, written):
+    """ Appends task rows to the live csv file and logs the slowest task and
+    hottest gpu of the batch
+
+    Parameters
+    ----------
+    tasks_df
+        final dataset rows
+    output_file
+        live csv file location
+    written
+        rows written so far (the file is rewritten when 0)
+
+    Returns
+    -------
+    int
+        rows written so far
+    """
+    if written == 0 or len(tasks_df):
+
+        # Continue the row index across batches like a single to_csv
+
+        tasks_df.index = pd.RangeIndex(written, written + len(tasks_df))
+        tasks_df.to_csv(output_file, mode='w' if written == 0 else 'a',
+                        header=written == 0)
+    if len(tasks_df) and tasks_df['gpuTempC'].notnull().any():
+        durations = (tasks_df['stop_time'] -
+                     tasks_df['start_time']).dt.total_seconds()
+        slowest = tasks_df.loc[durations.idxmax()]
+        hottest = tasks_df.loc[tasks_df['gpuTempC'].idxmax()]
+        logging.getLogger(__name__).info(
+                '%d tasks done, slowest %s %s (%d, %d) %.1fs, hottest %s '
+                '%.1fC', len(tasks_df), slowest['hostname'],
+                slowest['eventName'], slowest['x'], slowest['y'],
+                durations.max(), hottest['gpuUUID'], hottest['gpuTempC'])
+    return(written + len(tasks_df))
@@ -0,0 +1,136 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the stage graph runner of the
+data preparation process. A build is described as a dependency graph of
+stages (the gpu branch, reading and cleaning gpu.csv, does not depend on the
+checkpoints/tasks branch until they are merged) and every stage is started
+on an asyncio event loop as soon as the stages it reads are done, so
+independent branches run side by side and a build takes about as long as
+its longest branch.
+
+Stages run on a thread pool by default: pandas releases the GIL while
+parsing csv files and numpy while sorting and searching, and outputs are
+shared instead of copied back. Any concurrent.futures executor can be given
+instead (a process pool needs picklable stage functions and outputs).
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+def graph_order(graph, targets=None):
+    """ Orders the stages needed for the targets so every stage comes
+    after the stages it reads
+
+    Parameters
+    ----------
+    graph
+        stage name to (function, list of stage names read), see run_graph
+    targets
+        stage names wanted, every stage if None
+
+    Returns
+    -------
+    list
+        stage names in dependency order
+    """
+    order, done, running = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name not in graph:
+            raise ValueError("Unknown stage: {}".format(name))
+        if name in running:
+            raise ValueError("Stage graph cycle through: {}".format(name))
+        running.add(name)
+        for dependency in graph[name][1]:
+            visit(dependency)
+        running.discard(name)
+        done.add(name)
+        order.append(name)
+
+    for name in (graph if targets is None else targets):
+        visit(name)
+    return(order)
+
+async def run_stages(graph, order, executor):
+    """ Starts every stage once the stages it reads are done (see
+    run_graph)
+
+    Parameters
+    ----------
+    graph
+        stage name to (function, list of stage names read)
+    order
+        stage names in dependency order (see graph_order)
+    executor
+        concurrent.futures executor running the stage functions
+
+    Returns
+    -------
+    dict
+        stage name to output
+    """
+    loop = asyncio.get_running_loop()
+    logger = logging.getLogger(__name__)
+    futures = {}
+
+    async def run_stage(name):
+        func, dependencies = graph[name]
+        args = [await futures[dependency] for dependency in dependencies]
+        logger.debug('stage %s started', name)
+        return(await loop.run_in_executor(executor,
+                                          functools.partial(func, *args)))
+
+    for name in order:
+        futures[name] = asyncio.ensure_future(run_stage(name))
+
+    # The first failure cancels the stages not started yet
+
+    try:
+        await asyncio.gather(*futures.values())
+    except BaseException:
+        for future in futures.values():
+            future.cancel()
+        raise
+    return({name: future.result() for name, future in futures.items()})
+
+def run_graph(graph, targets=None, executor=None):
+    """ Runs a stage graph, independent stages concurrently (see module
+    introduction)
+
+    Parameters
+    ----------
+    graph
+        stage name to (function, list of stage names read), the outputs of
+        the stages read are passed to the function as positional arguments
+        in that order (bind other arguments with functools.partial)
+    targets
+        stage names wanted, only they and the stages they read run, every
+        stage if None
+    executor
+        concurrent.futures executor running the stage functions, a thread
+        pool with a thread per stage if None
+
+    Returns
+    -------
+    dict
+        stage name to output of every stage run
+    """
+    order = graph_order(graph, targets)
+    loop = asyncio.new_event_loop()
+    pool = executor or ThreadPoolExecutor(max_workers=max(len(order), 1))
+    try:
+        return(loop.run_until_complete(run_stages(graph, order, pool)))
+    finally:
+        loop.close()
+        if executor is None:
+            pool.shutdown()
@@ -0,0 +1,537 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the incremental data
+preparation process. A watermark file written next to the final dataset
+records the raw file fingerprints, the last gpu timestamp of every host and
+where in gpu.csv the tasks still open at the end of the build start. When
+new render logs are only appended to the raw csv files, the next build reads
+gpu.csv from that point on, recomputes the open and new tasks and merges
+them into the final dataset. Any other change to the raw files falls back
+to a full rebuild.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data.ingest import (COMPRESSION_SUFFIXES, raw_parts, read_gpu,
+                             read_checkpoints, read_tasks)
+from src.data.pairing import pair_events
+from src.data.interval_join import TASK_KEYS, to_epoch_ns, join_aggregate
+
+FINGERPRINT_BYTES = 1 << 22
+"""
+int: bytes per hashed block of a raw file fingerprint
+"""
+
+WATERMARK_VERSION = 2
+"""
+int: watermark file layout version, other versions force a full rebuild
+"""
+
+def watermark_file(output_file):
+    """ Gives the watermark file location of a final dataset
+
+    Parameters
+    ----------
+    output_file
+        final dataset file location
+
+    Returns
+    -------
+    str
+        watermark json file location
+    """
+    return(str(output_file) + '.watermark.json')
+
+def block_hashes(path, begin, end):
+    """ Hashes the FINGERPRINT_BYTES blocks of a byte range of a file, the
+    last block may be shorter
+
+    Parameters
+    ----------
+    path
+        file location
+    begin
+        first byte of the range
+    end
+        byte after the last one of the range
+
+    Returns
+    -------
+    list
+        sha1 hex digest of every block
+    """
+    hashes = []
+    with open(path, 'rb') as raw_file:
+        raw_file.seek(begin)
+        while begin < end:
+            block = raw_file.read(min(end - begin, FINGERPRINT_BYTES))
+            if not block:
+                break
+            hashes.append(hashlib.sha1(block).hexdigest())
+            begin += len(block)
+    return(hashes)
+
+def fingerprint(path, size=None):
+    """ Fingerprints the first size bytes of a file by its size and the
+    hash of every FINGERPRINT_BYTES block, so a change anywhere is seen
+
+    Parameters
+    ----------
+    path
+        file location
+    size
+        bytes to fingerprint, whole file if None
+
+    Returns
+    -------
+    dict
+        size and block hashes
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    return({'size': size, 'blocks': block_hashes(path, 0, size)})
+
+def appended_only(path, old_fingerprint, new_fingerprint=None):
+    """ Checks if a file only grew since it was fingerprinted
+
+    Parameters
+    ----------
+    path
+        file location
+    old_fingerprint
+        fingerprint recorded by the previous build
+    new_fingerprint
+        fingerprint of the file now, computed if None
+
+    Returns
+    -------
+    bool
+        True if the first old size bytes are unchanged
+    """
+    if not os.path.exists(path):
+        return(False)
+    new_fingerprint = new_fingerprint or fingerprint(path)
+    old_size = old_fingerprint['size']
+    if new_fingerprint['size'] < old_size:
+        return(False)
+
+    # Whole old blocks are compared, a shorter last one is hashed again
+
+    whole = old_size // FINGERPRINT_BYTES
+    if new_fingerprint['blocks'][:whole] != old_fingerprint['blocks'][:whole]:
+        return(False)
+    return(block_hashes(path, whole * FINGERPRINT_BYTES, old_size) ==
+           old_fingerprint['blocks'][whole:])
+
+def row_offset(path, row):
+    """ Finds the byte offset of a csv data row (0 is the row after the
+    header), rows are assumed to be single lines
+
+    Parameters
+    ----------
+    path
+        csv file location
+    row
+        data row number
+
+    Returns
+    -------
+    int
+        byte offset of the row start (file size past the last row)
+    """
+    lines = row + 1
+    offset = 0
+    with open(path, 'rb') as raw_file:
+        for block in iter(lambda: raw_file.read(FINGERPRINT_BYTES), b''):
+            newlines = np.flatnonzero(np.frombuffer(block, np.uint8) == 10)
+            if len(newlines) >= lines:
+                return(offset + int(newlines[lines - 1]) + 1)
+            lines -= len(newlines)
+            offset += len(block)
+    return(offset)
+
+def read_csv_from(path, offset):
+    """ Reads the gpu.csv rows starting at a byte offset, with the header of
+    the file (typed, see ingest.read_gpu)
+
+    Parameters
+    ----------
+    path
+        csv file location
+    offset
+        byte offset of the first row to read
+
+    Returns
+    -------
+    tuple
+        (dataframe, numpy array of each row byte offset in the file)
+    """
+    with open(path, 'rb') as raw_file:
+        header = raw_file.readline()
+        offset = max(offset, len(header))
+        raw_file.seek(offset)
+        body = raw_file.read()
+    newlines = np.flatnonzero(np.frombuffer(body, np.uint8) == 10)
+    starts = np.concatenate([[0], newlines + 1])
+    starts = offset + starts[starts < len(body)]
+    return(read_gpu(io.BytesIO(header + body)), starts)
+
+def open_start(intervals_df, check_task_df, host_last, last_time):
+    """ Finds the earliest start of the tasks that new raw rows could still
+    change: intervals stopping after their host's last gpu sample (and every
+    interval pooled with them) and START events not paired yet
+
+    Parameters
+    ----------
+    intervals_df
+        paired start/stop checkpoint and task dataframe
+    check_task_df
+        cleaned application checkpoints and tasks dataframe
+    host_last
+        hostname to last gpu timestamp (ns)
+    last_time
+        last gpu timestamp of the dataset (ns)
+
+    Returns
+    -------
+    int
+        earliest open start time (ns)
+    """
+    starts = [last_time]
+
+    affected = affected_intervals(intervals_df, host_last)
+    if affected.any():
+        starts.append(to_epoch_ns(
+                intervals_df.loc[affected, 'start_time']).min())
+
+    # Unpaired START events (their STOP is still to come)
+
+    issues_df = pair_events(check_task_df)[1]
+    unpaired = (issues_df['issue'] == 'unmatched_start').values
+    if unpaired.any():
+        starts.append(to_epoch_ns(issues_df.loc[unpaired, 'timestamp']).min())
+
+    return(int(min(starts)))
+
+def affected_intervals(intervals_df, host_last, new_keys=None):
+    """ Flags intervals stopping after the last gpu sample of their host or
+    built from new checkpoint rows, and every interval sharing task keys
+    with them
+
+    Parameters
+    ----------
+    intervals_df
+        paired start/stop checkpoint and task dataframe
+    host_last
+        hostname to last gpu timestamp (ns)
+    new_keys
+        task keys of checkpoint rows added since the last build
+
+    Returns
+    -------
+    numpy.ndarray
+        boolean mask of intervals to recompute
+    """
+    last = intervals_df['hostname'].astype(object).map(host_last).fillna(
+            np.iinfo(np.int64).min).values.astype(np.int64)
+    open_mask = to_epoch_ns(intervals_df['stop_time']) > last
+    keys = pd.MultiIndex.from_frame(intervals_df[TASK_KEYS])
+    affected = keys.isin(keys[open_mask])
+    if new_keys is not None:
+        affected |= keys.isin(new_keys)
+    return(np.asarray(affected))
+
+def build_watermark(gpu_df, gpu_offsets, check_task_df, intervals_df,
+                    files, rows, first_time, host_last, resume=None,
+                    fingerprints=None):
+    """ Builds the watermark written next to the final dataset
+
+    Parameters
+    ----------
+    gpu_df
+        cleaned gpu rows read by this build
+    gpu_offsets
+        byte offset of every gpu row (None to scan gpu.csv for it)
+    check_task_df
+        cleaned application checkpoints and tasks dataframe
+    intervals_df
+        paired start/stop checkpoint and task dataframe
+    files
+        dict of raw file locations (gpu, check, task)
+    rows
+        dict of application checkpoints and tasks row counts
+    first_time
+        first gpu timestamp of the dataset (ns)
+    host_last
+        hostname to last gpu timestamp (ns)
+    resume
+        (time, offset) resume point of the previous build, kept when the
+        open tasks start before the gpu rows read by this build
+    fingerprints
+        dict of raw file fingerprints taken before the build, taken again if
+        None
+
+    Returns
+    -------
+    dict
+        watermark
+    """
+    times = to_epoch_ns(gpu_df['timestamp'])
+    last_time = int(max(host_last.values()))
+    resume_time = open_start(intervals_df, check_task_df, host_last,
+                             last_time)
+
+    # Resume offset, only valid when gpu.csv is in time order
+
+    if gpu_offsets is not None and len(times) and resume_time < times[0]:
+
+        # Rows before the ones read are not at hand, keep the old point
+
+        resume_time, offset = resume
+    elif len(times) and np.all(np.diff(times) >= 0):
+        row = int(np.searchsorted(times, resume_time, side='left'))
+        if gpu_offsets is not None:
+            offset = int(gpu_offsets[row]) if row < len(gpu_offsets) else (
+                    os.path.getsize(files['gpu']))
+        else:
+            offset = row_offset(files['gpu'], row)
+    else:
+        resume_time, offset = resume or (first_time, 0)
+
+    return({'version': WATERMARK_VERSION,
+            'files': fingerprints or {name: fingerprint(path)
+                                      for name, path in files.items()},
+            'rows': rows,
+            'first_time': int(first_time),
+            'last_time': last_time,
+            'host_last_time': {host: int(last)
+                               for host, last in host_last.items()},
+            'resume_time': int(resume_time),
+            'resume_offset': int(offset)})
+
+def read_check_task(files, rows=None):
+    """ Reads, merges and cleans application checkpoints and tasks, and
+    finds the task keys of the rows added since the last build
+
+    Parameters
+    ----------
+    files
+        dict of raw file locations (gpu, check, task)
+    rows
+        dict of application checkpoints and tasks row counts of the last
+        build, None when there is none
+
+    Returns
+    -------
+    tuple
+        (cleaned application checkpoints and tasks dataframe, new task
+        keys or None, dict of row counts)
+    """
+    checkpoints_df = read_checkpoints(files['check'])
+    tasks_df = read_tasks(files['task'])
+    counts = {'check': len(checkpoints_df), 'task': len(tasks_df)}
+    check_task_df = md.merge_check_task(checkpoints_df, tasks_df)
+
+    # New checkpoint rows, or old ones whose task row was only just added
+
+    new_keys = None
+    if rows is not None:
+        new_rows = np.arange(len(check_task_df)) >= rows['check']
+        new_rows |= check_task_df['taskId'].isin(
+                tasks_df['taskId'].iloc[rows['task']:]).values
+        new_keys = pd.MultiIndex.from_frame(check_task_df.loc[
+                new_rows, TASK_KEYS])
+
+    return(md.clean_check_task(check_task_df), new_keys, counts)
+
+def full_build(files, output_file, output_format, fingerprints=None):
+    """ Builds the final dataset from scratch and records its watermark
+
+    Parameters
+    ----------
+    files
+        dict of raw file locations (gpu, check, task)
+    output_file
+        final dataset file location
+    output_format
+        csv, parquet or feather
+    fingerprints
+        dict of raw file fingerprints taken before the build
+
+    Returns
+    -------
+    dict
+        watermark
+    """
+    gpu_df = md.clean_gpu(read_gpu(files['gpu']))
+    check_task_df, _, rows = read_check_task(files)
+    final_df = md.merge_check_task_gpu(gpu_df, check_task_df.copy())
+    md.save_processed(final_df, output_file, output_format)
+
+    host_last = gpu_df.groupby('hostname')['timestamp'].max()
+    host_last = dict(zip(host_last.index, to_epoch_ns(host_last)))
+    return(build_watermark(
+            gpu_df, None, check_task_df, md.pair_check_task(check_task_df),
+            files, rows, int(to_epoch_ns(gpu_df['timestamp']).min()),
+            host_last, fingerprints=fingerprints))
+
+def incremental_build(files, output_file, output_format, watermark,
+                      fingerprints=None):
+    """ Recomputes the tasks touched by appended raw rows and merges them
+    into the final dataset
+
+    Parameters
+    ----------
+    files
+        dict of raw file locations (gpu, check, task)
+    output_file
+        final dataset file location
+    output_format
+        csv, parquet or feather
+    watermark
+        watermark of the previous build
+    fingerprints
+        dict of raw file fingerprints taken before the build
+
+    Returns
+    -------
+    dict
+        new watermark, None if a full rebuild is needed instead
+    """
+    from src.data.load_dataset import load_processed
+
+    check_task_df, new_keys, rows = read_check_task(files, watermark['rows'])
+    all_intervals_df = md.pair_check_task(check_task_df)
+    host_last = watermark['host_last_time']
+    intervals_df = all_intervals_df[affected_intervals(
+            all_intervals_df, host_last, new_keys)]
+    affected_keys = pd.MultiIndex.from_frame(intervals_df[TASK_KEYS])
+
+    # Tasks needing gpu rows before the resume point need a full rebuild
+
+    if (len(intervals_df) and to_epoch_ns(intervals_df['start_time']).min()
+            < watermark['resume_time']):
+        return(None)
+
+    gpu_df, gpu_offsets = read_csv_from(files['gpu'],
+                                        watermark['resume_offset'])
+    if len(gpu_df) == 0:
+        return(None)
+    gpu_df = md.clean_gpu(gpu_df)
+
+    # Same first/last filter as a full build
+
+    first_time = watermark['first_time']
+    last_time = max(watermark['last_time'],
+                    int(to_epoch_ns(gpu_df['timestamp']).max()))
+    intervals_df = intervals_df[
+            (to_epoch_ns(intervals_df['start_time']) >= first_time) &
+            (to_epoch_ns(intervals_df['stop_time']) <= last_time)]
+    new_df = join_aggregate(gpu_df, intervals_df)
+
+    # Replace open tasks of the old dataset, append new ones
+
+    old_df = load_processed(output_file)
+    old_keys = pd.MultiIndex.from_frame(old_df[TASK_KEYS].astype(object))
+    final_df = pd.concat([old_df[~old_keys.isin(affected_keys)], new_df],
+                         ignore_index=True)
+    if len(new_df):
+        final_df = final_df.astype(new_df.dtypes[['x', 'y', 'level']]
+                                   .to_dict())
+    md.save_processed(final_df, output_file, output_format)
+
+    tail_last = gpu_df.groupby('hostname')['timestamp'].max()
+    host_last = dict(host_last)
+    for host, last in zip(tail_last.index, to_epoch_ns(tail_last)):
+        host_last[host] = max(int(last), host_last.get(host, int(last)))
+    return(build_watermark(
+            gpu_df, gpu_offsets, check_task_df, all_intervals_df, files,
+            rows, first_time, host_last,
+            resume=(watermark['resume_time'], watermark['resume_offset']),
+            fingerprints=fingerprints))
+
+def incremental_dataset(gpu_csv_file, check_csv_file, task_csv_file,
+                        output_file, output_format='csv'):
+    """ Updates the final dataset from appended raw rows when possible,
+    rebuilds it from scratch otherwise
+
+    Parameters
+    ----------
+    gpu_csv_file
+        gpu.csv file location
+    check_csv_file
+        application-checkpoints.csv file location
+    task_csv_file
+        task-x-y.csv file location
+    output_file
+        final dataset file location
+    output_format
+        csv, parquet or feather
+
+    Returns
+    -------
+    str
+        'full', 'incremental' or 'unchanged'
+    """
+    logger = logging.getLogger(__name__)
+    files = {'gpu': gpu_csv_file, 'check': check_csv_file,
+             'task': task_csv_file}
+
+    # Byte offsets only make sense in a single plain file
+
+    for path in files.values():
+        if (raw_parts(path) != [str(path)] or
+                os.path.splitext(str(path))[1] in COMPRESSION_SUFFIXES):
+            raise ValueError("Incremental builds need plain csv files, "
+                             "not compressed or multi-part: {}".format(path))
+
+    watermark = None
+    if os.path.exists(watermark_file(output_file)) and (
+            os.path.exists(output_file)):
+        with open(watermark_file(output_file)) as json_file:
+            watermark = json.load(json_file)
+
+    # Every raw file is hashed once, whole, so any earlier change is seen
+
+    fingerprints = {name: fingerprint(path) for name, path in files.items()}
+
+    mode = 'full'
+    if (watermark is not None and
+            watermark.get('version') == WATERMARK_VERSION and
+            set(watermark['files']) == set(files) and
+            watermark.get('output_format') == output_format and
+            all(appended_only(files[name], watermark['files'][name],
+                              fingerprints[name]) for name in files)):
+        if fingerprints == watermark['files']:
+            logger.info('raw data unchanged, nothing to do')
+            return('unchanged')
+        new_watermark = incremental_build(files, output_file, output_format,
+                                          watermark, fingerprints)
+        if new_watermark is not None:
+            watermark = new_watermark
+            mode = 'incremental'
+
+    if mode == 'full':
+        logger.info('no usable watermark or earlier raw data changed, '
+                    'rebuilding from scratch')
+        watermark = full_build(files, output_file, output_format,
+                               fingerprints)
+
+    watermark['output_format'] = output_format
+    with open(watermark_file(output_file), 'w') as json_file:
+        json.dump(watermark, json_file, indent=1, sort_keys=True)
+    logger.info('%s build, resuming next time from byte %d of gpu.csv',
+                mode, watermark['resume_offset'])
+    return(mode)
@@ -0,0 +1,384 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the typed ingestion of the raw
+csv files. Every raw schema lists the columns kept (dropped ones such as
+gpuSerial are never read) and their dtypes: categoricals for the repeated
+strings, narrow integers and float32 for the metrics and tile coordinates.
+Files are read in chunks and timestamps are parsed chunk by chunk, so the
+text timestamp column of the whole file never sits in memory.
+
+Raw files may be compressed (gz, bz2, xz or zst, decompressed on the fly
+while parsing, no uncompressed copy is written) and split in parts: a glob
+pattern, or a missing file name such as data/raw/gpu.csv found as
+gpu.csv.zst or as gpu-*.csv.gz parts, reads every part (each with its own
+header) in natural order. Parts are decompressed and parsed side by side on
+threads (zlib, zstd and the csv parser release the GIL).
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import bz2
+import contextlib
+import errno
+import glob
+import gzip
+import io
+import logging
+import lzma
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from src.data import make_dataset as md
+from src.data.instrumentation import instrumented
+try:
+    import zstandard
+except ImportError:  # only needed for .zst raw files
+    zstandard = None
+
+READ_CHUNK_ROWS = 500000
+"""
+int: rows read (and timestamps parsed) at a time
+"""
+
+READ_WORKERS = os.cpu_count() or 1
+"""
+int: threads decompressing and parsing the parts of a raw file
+"""
+
+COMPRESSION_SUFFIXES = ['.gz', '.bz2', '.xz', '.zst']
+"""
+list: raw file suffixes decompressed on the fly
+"""
+
+TIMESTAMP = 'timestamp'
+"""
+str: schema dtype of columns parsed with make_dataset.timestamp_conv
+"""
+
+GPU_SCHEMA = {'timestamp': TIMESTAMP,
+              'hostname': 'category',
+              'gpuUUID': 'category',
+              'powerDrawWatt': 'float32',
+              'gpuTempC': 'uint8',
+              'gpuUtilPerc': 'uint8',
+              'gpuMemUtilPerc': 'uint8'}
+"""
+dict: gpu.csv columns read and their dtypes (gpuSerial is skipped)
+"""
+
+CHECK_SCHEMA = {'timestamp': TIMESTAMP,
+                'hostname': 'category',
+                'eventName': 'category',
+                'eventType': 'category',
+                'jobId': 'category',
+                'taskId': 'category'}
+"""
+dict: application-checkpoints.csv columns read and their dtypes
+"""
+
+TASK_SCHEMA = {'taskId': 'object',
+               'jobId': 'category',
+               'x': 'uint16',
+               'y': 'uint16',
+               'level': 'uint8'}
+"""
+dict: task-x-y.csv columns read and their dtypes
+"""
+
+def widen_integers(schema):
+    """ Replaces the integer dtypes of a schema by float32, used when an
+    integer column has missing values
+
+    Parameters
+    ----------
+    schema
+        column to dtype dict
+
+    Returns
+    -------
+    dict
+        schema without integer dtypes
+    """
+    return({column: 'float32' if dtype.startswith(('int', 'uint'))
+            else dtype for column, dtype in schema.items()})
+
+def concat_chunks(chunks):
+    """ Concatenates typed chunks, categorical columns are unioned so they
+    stay categorical even when chunks saw different categories
+
+    Parameters
+    ----------
+    chunks
+        list of dataframes with the same columns
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        concatenated dataframe with a fresh range index
+    """
+    if len(chunks) == 1:
+        return(chunks[0].reset_index(drop=True))
+    columns = {}
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype,
+                      pd.api.types.CategoricalDtype):
+            columns[column] = union_categoricals(
+                    [chunk[column] for chunk in chunks])
+        else:
+            columns[column] = np.concatenate(
+                    [chunk[column].to_numpy() for chunk in chunks])
+    return(pd.DataFrame(columns))
+
+def natural_key(path):
+    """ Sort key ordering numbered parts naturally (gpu-2 before gpu-10)
+
+    Parameters
+    ----------
+    path
+        file location
+
+    Returns
+    -------
+    list
+        text and integer pieces of the location
+    """
+    return([int(piece) if piece.isdigit() else piece
+            for piece in re.split(r'(\d+)', path)])
+
+def raw_parts(source):
+    """ Finds the files of a raw csv file (see module introduction)
+
+    Parameters
+    ----------
+    source
+        file location, compressed file location or glob pattern
+
+    Returns
+    -------
+    list
+        part locations in natural order
+    """
+    source = str(source)
+    if any(char in source for char in '*?['):
+        parts = glob.glob(source)
+    elif os.path.exists(source):
+        parts = [source]
+    else:
+
+        # gpu.csv stands for gpu.csv.<compression> then gpu-*.csv parts
+
+        stem, extension = os.path.splitext(source)
+        candidates = [[source + suffix] for suffix in COMPRESSION_SUFFIXES]
+        candidates += [glob.glob(glob.escape(stem) + '-*' + extension +
+                                 suffix)
+                       for suffix in [''] + COMPRESSION_SUFFIXES]
+        parts = next((found for found in candidates
+                      if found and all(map(os.path.exists, found))), [])
+    if not parts:
+        raise FileNotFoundError(errno.ENOENT, "No raw file or parts",
+                                source)
+    return(sorted(parts, key=natural_key))
+
+@contextlib.contextmanager
+def open_raw(path):
+    """ Opens a raw file part for parsing, decompressed on the fly
+
+    Parameters
+    ----------
+    path
+        part location or file object
+
+    Yields
+    ------
+    str or file object
+        the location or file object itself for plain files (read by
+        pandas), a text file object for compressed ones
+    """
+    suffix = '' if hasattr(path, 'read') else os.path.splitext(path)[1]
+    if suffix not in COMPRESSION_SUFFIXES:
+        yield(path)
+    elif suffix == '.zst':
+        if zstandard is None:
+            raise ImportError("zstandard is needed to read .zst files "
+                              "(pip install zstandard)")
+        with open(path, 'rb') as compressed:
+            reader = zstandard.ZstdDecompressor().stream_reader(compressed)
+            yield(io.TextIOWrapper(io.BufferedReader(reader)))
+    else:
+        opener = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+        with opener[suffix](path, 'rt') as text_file:
+            yield(text_file)
+
+def read_chunks(source, schema, chunksize=READ_CHUNK_ROWS):
+    """ Reads typed chunks of a raw csv file, timestamps already parsed,
+    parts are read one after another
+
+    Parameters
+    ----------
+    source
+        csv file location (see raw_parts) or file object
+    schema
+        column to dtype dict (GPU_SCHEMA, CHECK_SCHEMA or TASK_SCHEMA)
+    chunksize
+        rows per chunk
+
+    Yields
+    ------
+    pandas.core.frame.DataFrame
+        typed chunk
+    """
+    dtypes = {column: (str if dtype == TIMESTAMP else dtype)
+              for column, dtype in schema.items()}
+    timestamps = [column for column, dtype in schema.items()
+                  if dtype == TIMESTAMP]
+    parts = [source] if hasattr(source, 'read') else raw_parts(source)
+    for part in parts:
+        with open_raw(part) as part_source:
+            for chunk in pd.read_csv(part_source, usecols=list(schema),
+                                     dtype=dtypes, chunksize=chunksize):
+                for column in timestamps:
+                    chunk[column] = md.timestamp_conv(chunk[column])
+                yield(chunk)
+
+def read_widened(source, schema, chunksize, error):
+    """ Reads a raw csv file whose integer columns failed to parse with
+    them as float32, then gives back their integer dtype to the columns
+    without missing values
+
+    Parameters
+    ----------
+    source
+        csv file location or file object (at its start)
+    schema
+        column to dtype dict
+    chunksize
+        rows per chunk
+    error
+        ValueError of the typed read, raised again when no integer column
+        has missing values or one has fractional values
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        typed dataframe, integer columns with missing values as float32
+    """
+    widened = widen_integers(schema)
+    df = concat_chunks(list(read_chunks(source, widened, chunksize)))
+    integers = [column for column in schema
+                if widened[column] != schema[column]]
+    missing = [column for column in integers if df[column].isna().any()]
+    complete = [column for column in integers if column not in missing]
+    if not missing or (df[complete] % 1 != 0).any().any():
+        raise error
+
+    logging.getLogger(__name__).warning(
+            'missing values in integer columns %s, reading them as float32',
+            ', '.join(missing))
+    return(df.astype({column: schema[column] for column in complete}))
+
+def read_typed(source, schema, chunksize=READ_CHUNK_ROWS,
+               workers=READ_WORKERS):
+    """ Reads a whole raw csv file with a schema (see read_chunks), integer
+    columns with missing values are read again as float32 (see
+    read_widened)
+
+    Parameters
+    ----------
+    source
+        csv file location (see raw_parts) or file object (seekable)
+    schema
+        column to dtype dict
+    chunksize
+        rows per chunk
+    workers
+        threads reading the parts of a multi-part file
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        typed dataframe, parts concatenated in order
+    """
+    parts = [source] if hasattr(source, 'read') else raw_parts(source)
+    if len(parts) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers,
+                                                len(parts))) as executor:
+            part_dfs = list(executor.map(partial(
+                    read_typed, schema=schema, chunksize=chunksize), parts))
+        return(concat_chunks(part_dfs))
+
+    try:
+        chunks = list(read_chunks(source, schema, chunksize))
+    except ValueError as error:
+        if widen_integers(schema) == schema:
+            raise
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return(read_widened(source, schema, chunksize, error))
+    if not chunks:
+        return(pd.DataFrame({column: pd.Series(dtype=(
+                'datetime64[ns]' if dtype == TIMESTAMP else dtype))
+                for column, dtype in schema.items()}))
+    return(concat_chunks(chunks))
+
+@instrumented
+def read_gpu(source, chunksize=READ_CHUNK_ROWS):
+    """ Reads gpu.csv with GPU_SCHEMA
+
+    Parameters
+    ----------
+    source
+        gpu.csv file location (see raw_parts) or file object
+    chunksize
+        rows per chunk
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        typed gpu dataframe (no gpuSerial, timestamps parsed)
+    """
+    return(read_typed(source, GPU_SCHEMA, chunksize))
+
+@instrumented
+def read_checkpoints(source, chunksize=READ_CHUNK_ROWS):
+    """ Reads application-checkpoints.csv with CHECK_SCHEMA
+
+    Parameters
+    ----------
+    source
+        application-checkpoints.csv file location (see raw_parts) or file
+        object
+    chunksize
+        rows per chunk
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        typed application checkpoints dataframe (timestamps parsed)
+    """
+    return(read_typed(source, CHECK_SCHEMA, chunksize))
+
+@instrumented
+def read_tasks(source, chunksize=READ_CHUNK_ROWS):
+    """ Reads task-x-y.csv with TASK_SCHEMA
+
+    Parameters
+    ----------
+    source
+        task-x-y.csv file location (see raw_parts) or file object
+    chunksize
+        rows per chunk
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        typed tasks dataframe
+    """
+    return(read_typed(source, TASK_SCHEMA, chunksize))
@@ -0,0 +1,238 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the instrumentation of the
+data preparation process. Pipeline functions decorated with instrumented
+record their wall time, peak resident memory, traced memory (when
+tracemalloc runs) and rows in/out. Every call is logged as a structured
+record (the measures are in the record's stage_metrics attribute), and while
+a RunReport is active the calls are summed per stage into a json run report.
+Calls are nested per thread, stages run side by side (see src.data.graph)
+are all top level stages and their traced peaks overlap.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import functools
+import json
+import logging
+import threading
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+ACTIVE_REPORTS = []
+"""
+list: run reports collecting stage records, innermost last
+"""
+
+CALL_STACKS = threading.local()
+"""
+threading.local: running instrumented calls of every thread (stack
+attribute), used for nesting and traced peaks
+"""
+
+REPORT_LOCK = threading.Lock()
+"""
+threading.Lock: serialises run report updates of stages run by threads
+"""
+
+def call_stack():
+    """ Gives the running instrumented calls of the current thread
+
+    Returns
+    -------
+    list
+        call frames, innermost last
+    """
+    if not hasattr(CALL_STACKS, 'stack'):
+        CALL_STACKS.stack = []
+    return(CALL_STACKS.stack)
+
+def peak_rss_bytes():
+    """ Gives the peak resident memory of the process so far
+
+    Returns
+    -------
+    int or None
+        bytes, None where the resource module is missing
+    """
+    if resource is None:
+        return(None)
+    return(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+def count_rows(value):
+    """ Counts the rows of a stage input or output
+
+    Parameters
+    ----------
+    value
+        dataframe, series, array, or a tuple of them (first one counted)
+
+    Returns
+    -------
+    int or None
+        row count, None for other values
+    """
+    if isinstance(value, (tuple, list)) and value:
+        return(count_rows(value[0]))
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return(len(value))
+    return(None)
+
+def instrumented(func):
+    """ Decorator recording the measures of every call of a pipeline
+    function (see module introduction)
+
+    Parameters
+    ----------
+    func
+        pipeline function
+
+    Returns
+    -------
+    function
+        wrapped function
+    """
+    logger = logging.getLogger(func.__module__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        tracing = tracemalloc.is_tracing()
+        stack = call_stack()
+        frame = {'traced_peak': 0}
+        if tracing:
+            # Keep the parent's peak before resetting it for this call
+
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                parent = stack[-1]
+                parent['traced_peak'] = max(parent['traced_peak'], peak)
+            tracemalloc.reset_peak()
+            frame['traced_base'] = current
+        stack.append(frame)
+        rss_before = peak_rss_bytes()
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+
+        rows_in = [count_rows(arg) for arg in args]
+        metrics = {'stage': func.__name__,
+                   'seconds': seconds,
+                   'depth': len(stack),
+                   'rows_in': sum(rows for rows in rows_in if rows),
+                   'rows_out': count_rows(result),
+                   'peak_rss_bytes': peak_rss_bytes()}
+        if rss_before is not None:
+            metrics['peak_rss_growth_bytes'] = (metrics['peak_rss_bytes'] -
+                                                rss_before)
+        if tracing:
+            peak = max(frame['traced_peak'],
+                       tracemalloc.get_traced_memory()[1])
+            metrics['traced_peak_bytes'] = peak - frame['traced_base']
+            if stack:
+                stack[-1]['traced_peak'] = max(
+                        stack[-1]['traced_peak'], peak)
+
+        level = logging.INFO if (ACTIVE_REPORTS and
+                                 not metrics['depth']) else logging.DEBUG
+        logger.log(level, '%s took %.3fs, %s rows in, %s rows out',
+                   func.__name__, seconds, metrics['rows_in'],
+                   metrics['rows_out'], extra={'stage_metrics': metrics})
+        with REPORT_LOCK:
+            for report in ACTIVE_REPORTS:
+                report.add(metrics)
+        return(result)
+
+    return(wrapper)
+
+class RunReport(object):
+    """ Collects the instrumented calls made inside a with block and sums
+    them per stage
+
+    Parameters
+    ----------
+    trace_memory
+        run tracemalloc inside the block to measure traced memory (slows
+        allocations down)
+    options
+        run options recorded in the report
+    """
+
+    def __init__(self, trace_memory=False, **options):
+        self.trace_memory = trace_memory
+        self.options = options
+        self.stages = {}
+
+    def __enter__(self):
+        self.started = tracemalloc.is_tracing()
+        if self.trace_memory and not self.started:
+            tracemalloc.start()
+        self.start = time.perf_counter()
+        ACTIVE_REPORTS.append(self)
+        return(self)
+
+    def __exit__(self, *exc_info):
+        ACTIVE_REPORTS.remove(self)
+        self.seconds = time.perf_counter() - self.start
+        if self.trace_memory and not self.started:
+            tracemalloc.stop()
+        return(False)
+
+    def add(self, metrics):
+        """ Adds the measures of one call to its stage summary
+
+        Parameters
+        ----------
+        metrics
+            measures of the call (see instrumented)
+        """
+        stage = self.stages.setdefault(metrics['stage'], {
+                'calls': 0, 'seconds': 0.0, 'rows_in': 0, 'rows_out': 0,
+                'depth': metrics['depth']})
+        stage['calls'] += 1
+        stage['seconds'] += metrics['seconds']
+        stage['depth'] = min(stage['depth'], metrics['depth'])
+        stage['rows_in'] += metrics['rows_in']
+        stage['rows_out'] += metrics['rows_out'] or 0
+        for key in ['peak_rss_bytes', 'peak_rss_growth_bytes',
+                    'traced_peak_bytes']:
+            if metrics.get(key) is not None:
+                stage[key] = max(stage.get(key, 0), metrics[key])
+
+    def to_dict(self):
+        """ Gives the run report
+
+        Returns
+        -------
+        dict
+            options, total seconds, process peak memory and per stage
+            summaries (in first call order)
+        """
+        return({'options': self.options,
+                'seconds': self.seconds,
+                'peak_rss_bytes': peak_rss_bytes(),
+                'stages': self.stages})
+
+    def write(self, path):
+        """ Writes the run report as json
+
+        Parameters
+        ----------
+        path
+            report file location
+        """
+        with open(path, 'w') as json_file:
+            json.dump(self.to_dict(), json_file, indent=1)
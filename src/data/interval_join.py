@@ -0,0 +1,354 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the sorted interval join used
+to match gpu samples with application checkpoint (task) intervals. The gpu
+samples of every host are sorted by time once and each interval is located
+with two binary searches (searchsorted), the metrics are then summed through
+prefix (cumulative) sums so no joined frame is ever built.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from src.data.instrumentation import instrumented
+
+GPU_METRICS = ['powerDrawWatt', 'gpuTempC', 'gpuUtilPerc', 'gpuMemUtilPerc']
+"""
+list: gpu metric columns averaged for every task
+"""
+
+TASK_KEYS = ['hostname', 'eventName', 'x', 'y', 'level']
+"""
+list: columns identifying a task event in the final dataset
+"""
+
+def to_epoch_ns(series):
+    """ Converts a timestamp series to int64 nanoseconds since epoch
+
+    Parameters
+    ----------
+    series
+        timestamps as datetime64 values, python datetimes or strings
+
+    Returns
+    -------
+    numpy.ndarray
+        int64 nanoseconds since epoch
+    """
+    values = pd.to_datetime(series).values.astype('datetime64[ns]')
+    return(values.astype(np.int64))
+
+def host_positions(hostnames):
+    """ Groups row positions by hostname
+
+    Parameters
+    ----------
+    hostnames
+        hostname column
+
+    Returns
+    -------
+    dict
+        hostname to numpy array of row positions
+    """
+    positions = pd.Series(np.arange(len(hostnames)))
+    return(positions.groupby(np.asarray(hostnames), sort=False).indices)
+
+def host_blocks(gpu_df, intervals_df):
+    """ Sorts the gpu samples of every interval host by time, lays the host
+    blocks end to end and locates every [start_time, stop_time] interval
+    in its host block with two binary searches (both ends inclusive)
+
+    Parameters
+    ----------
+    gpu_df
+        cleaned gpu dataframe
+    intervals_df
+        dataframe with hostname, start_time and stop_time columns
+
+    Returns
+    -------
+    tuple
+        (order, lo, hi, blocks) where order holds gpu row positions sorted
+        by host then time, order[lo:hi] are the samples of each interval
+        (lo == hi when empty) and blocks lists the (interval positions,
+        begin, end) of every host block
+    """
+    n_intervals = len(intervals_df)
+    lo = np.zeros(n_intervals, dtype=np.int64)
+    hi = np.zeros(n_intervals, dtype=np.int64)
+    orders = []
+    blocks = []
+    offset = 0
+
+    gpu_times = to_epoch_ns(gpu_df['timestamp'])
+    starts = to_epoch_ns(intervals_df['start_time'])
+    stops = to_epoch_ns(intervals_df['stop_time'])
+
+    gpu_hosts = host_positions(gpu_df['hostname'])
+
+    for host, pos in host_positions(intervals_df['hostname']).items():
+        gpu_pos = gpu_hosts.get(host)
+        if gpu_pos is None:
+            continue
+
+        # Sort host samples by time (stable so ties keep file order), stop
+        # is inclusive
+
+        order = gpu_pos[np.argsort(gpu_times[gpu_pos], kind='mergesort')]
+        times = gpu_times[order]
+        lo[pos] = offset + np.searchsorted(times, starts[pos], side='left')
+        hi[pos] = offset + np.searchsorted(times, stops[pos], side='right')
+        orders.append(order)
+        blocks.append((pos, offset, offset + len(order)))
+        offset += len(order)
+
+    order = np.concatenate(orders) if orders else np.zeros(0, dtype=np.int64)
+    return(order, lo, hi, blocks)
+
+def interval_bounds(gpu_df, intervals_df):
+    """ Locates the gpu samples of every [start_time, stop_time] interval on
+    the same host (both ends inclusive) as interval_sums does, for stages
+    needing the samples themselves
+
+    Parameters
+    ----------
+    gpu_df
+        cleaned gpu dataframe
+    intervals_df
+        dataframe with hostname, start_time and stop_time columns
+
+    Returns
+    -------
+    tuple
+        (order, lo, hi) where order holds gpu row positions sorted by host
+        then time, and order[lo:hi] are the samples of each interval (lo ==
+        hi when empty)
+    """
+    return(host_blocks(gpu_df, intervals_df)[:3])
+
+def prefix_sums(host_values, lo, hi):
+    """ Sums samples over [lo, hi) ranges with prefix (cumulative) sums
+
+    Parameters
+    ----------
+    host_values
+        (samples, metrics) array of metric values
+    lo
+        first sample of each range
+    hi
+        sample after the last one of each range
+
+    Returns
+    -------
+    tuple
+        (sums, counts) (ranges, metrics) arrays of non null metric sums and
+        counts
+    """
+
+    # Prefix sums of metrics (nulls skipped like pandas mean)
+
+    host_values = np.asarray(host_values, dtype=np.float64)
+    valid = ~np.isnan(host_values)
+    zero = np.zeros((1, host_values.shape[1]))
+    value_cs = np.vstack(
+            [zero, np.cumsum(np.where(valid, host_values, 0), axis=0)])
+    count_cs = np.vstack(
+            [zero.astype(np.int64), np.cumsum(valid, axis=0)])
+
+    return(value_cs[hi] - value_cs[lo], count_cs[hi] - count_cs[lo])
+
+def expand_bounds(lo, hi):
+    """ Lists every position of a set of [lo, hi) ranges
+
+    Parameters
+    ----------
+    lo
+        first position of each range
+    hi
+        position after the last one of each range
+
+    Returns
+    -------
+    tuple
+        (positions, owners) where owners gives the range of each position,
+        ranges in order
+    """
+    sizes = hi - lo
+    ends = np.cumsum(sizes)
+    positions = (np.arange(ends[-1] if len(ends) else 0) +
+                 np.repeat(lo - (ends - sizes), sizes))
+    return(positions, np.repeat(np.arange(len(lo)), sizes))
+
+@instrumented
+def interval_sums(gpu_df, intervals_df, keep_bounds=False):
+    """ Sums gpu metrics over every [start_time, stop_time] interval on the
+    same host (both ends inclusive, like the previous SQL BETWEEN join)
+
+    Parameters
+    ----------
+    gpu_df
+        cleaned gpu dataframe
+    intervals_df
+        dataframe with hostname, start_time and stop_time columns
+    keep_bounds
+        also give the sample bounds found by the binary searches
+
+    Returns
+    -------
+    tuple
+        (sums, counts, first) where sums and counts are (intervals, metrics)
+        arrays of non null metric sums and counts, and first is the gpu row
+        position of the first sample in each interval (-1 when empty), then
+        the (order, lo, hi) bounds of interval_bounds when keep_bounds is
+        set
+    """
+    n_intervals = len(intervals_df)
+    sums = np.zeros((n_intervals, len(GPU_METRICS)))
+    counts = np.zeros((n_intervals, len(GPU_METRICS)), dtype=np.int64)
+    first = np.full(n_intervals, -1, dtype=np.int64)
+
+    order, lo, hi, blocks = host_blocks(gpu_df, intervals_df)
+    values = gpu_df[GPU_METRICS].to_numpy(dtype=np.float64)
+
+    # Prefix sums are taken host by host, the sums of an interval only
+    # depend on the samples of its host
+
+    for pos, begin, end in blocks:
+        sums[pos], counts[pos] = prefix_sums(values[order[begin:end]],
+                                             lo[pos] - begin, hi[pos] - begin)
+    matched = hi > lo
+    first[matched] = order[lo[matched]]
+
+    if not keep_bounds:
+        return(sums, counts, first)
+    return(sums, counts, first, (order, lo, hi))
+
+@instrumented
+def aggregate_intervals(intervals_df, sums, counts, first, uuids):
+    """ Pools interval metric sums into per task averages, intervals sharing
+    the same task keys are pooled together
+
+    Parameters
+    ----------
+    intervals_df
+        paired start/stop checkpoint and task dataframe
+    sums
+        (intervals, metrics) array of metric sums
+    counts
+        (intervals, metrics) array of non null metric counts
+    first
+        position of the first gpu sample of each interval (-1 when empty),
+        used to order tasks
+    uuids
+        gpuUUID of the first gpu sample of each interval
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        per task averages with first start_time, stop_time and gpuUUID,
+        ordered by the first gpu sample matched by each task
+    """
+
+    # Inner join semantics, only keep intervals with gpu samples
+
+    matched = first >= 0
+    sum_cols = [metric + '_sum' for metric in GPU_METRICS]
+    count_cols = [metric + '_count' for metric in GPU_METRICS]
+
+    tasks_df = intervals_df.loc[
+            matched, TASK_KEYS + ['start_time', 'stop_time']].reset_index(
+                    drop=True)
+    tasks_df['gpuUUID'] = np.asarray(uuids)[matched]
+    tasks_df[sum_cols] = sums[matched]
+    tasks_df[count_cols] = counts[matched]
+
+    # Order tasks by first sample seen (as the row by row join did)
+
+    tasks_df = tasks_df.iloc[
+            np.argsort(first[matched], kind='mergesort')]
+
+    functions = dict.fromkeys(sum_cols + count_cols, 'sum')
+    functions.update({
+        'start_time': 'first', 'stop_time': 'first', 'gpuUUID': 'first'})
+
+    grouped_df = tasks_df.groupby(
+        TASK_KEYS, as_index=False, sort=False, observed=True
+    ).agg(functions)
+
+    # Pooled averages
+
+    for metric, sum_col, count_col in zip(GPU_METRICS, sum_cols, count_cols):
+        grouped_df[metric] = (grouped_df[sum_col] /
+                              grouped_df[count_col].where(
+                                      grouped_df[count_col] > 0))
+
+    return(grouped_df[TASK_KEYS + GPU_METRICS +
+                      ['start_time', 'stop_time', 'gpuUUID']])
+
+def join_aggregate(gpu_df, intervals_df, keep_bounds=False):
+    """ Averages gpu metrics for every task interval using the sorted
+    interval join
+
+    Parameters
+    ----------
+    gpu_df
+        cleaned gpu dataframe
+    intervals_df
+        paired start/stop checkpoint and task dataframe
+    keep_bounds
+        also give the sample bounds of the join, so later stages do not
+        search for them again
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame or tuple
+        per task averages (see aggregate_intervals), or (per task averages,
+        (order, lo, hi) bounds, see interval_bounds) when keep_bounds is set
+    """
+    joined = interval_sums(gpu_df, intervals_df, keep_bounds=keep_bounds)
+    sums, counts, first = joined[:3]
+    uuids = gpu_df['gpuUUID'].to_numpy()[np.maximum(first, 0)]
+    aggregates_df = aggregate_intervals(intervals_df, sums, counts, first,
+                                        uuids)
+    if keep_bounds:
+        return(aggregates_df, joined[3])
+    return(aggregates_df)
+
+@instrumented
+def joined_rows(gpu_df, intervals_df, bounds=None):
+    """ Builds the raw joined rows, every gpu sample repeated for each task
+    interval it falls in (only for inspection, the aggregates never need
+    them)
+
+    Parameters
+    ----------
+    gpu_df
+        cleaned gpu dataframe
+    intervals_df
+        paired start/stop checkpoint and task dataframe
+    bounds
+        (order, lo, hi) sample bounds of the join (see interval_bounds),
+        searched for if None
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        gpu columns then the task columns of the interval, in gpu row order
+    """
+    order, lo, hi = bounds or interval_bounds(gpu_df, intervals_df)
+    positions, interval_rows = expand_bounds(lo, hi)
+    gpu_rows = order[positions]
+
+    # Gpu rows first, intervals in their order for a shared sample
+
+    by_gpu = np.lexsort((interval_rows, gpu_rows))
+    joined_df = gpu_df.iloc[gpu_rows[by_gpu]].reset_index(drop=True)
+    task_df = intervals_df.drop(columns='hostname').iloc[
+            interval_rows[by_gpu]].reset_index(drop=True)
+    return(pd.concat([joined_df, task_df], axis=1))
@@ -0,0 +1,129 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code used to load the final (processed)
+dataset for analysis. Columnar files (parquet, feather) are read without any
+text parsing and only for the columns asked for, csv files are still
+supported and get the same types.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import os
+import pandas as pd
+from src.data import make_dataset as md
+
+def processed_format(path):
+    """ Guesses the final dataset format from its file extension
+
+    Parameters
+    ----------
+    path
+        final dataset file location
+
+    Returns
+    -------
+    str
+        one of csv, parquet or feather
+    """
+    extension = os.path.splitext(str(path))[1].lstrip('.').lower()
+    if extension not in md.PROCESSED_FILES:
+        raise ValueError("Unrecognized final dataset format: {}".format(
+                extension))
+    return(extension)
+
+def built_file(files):
+    """ Picks the file the last build wrote among the locations of every
+    output format
+
+    Parameters
+    ----------
+    files
+        dict of output format to file location (for instance
+        make_dataset.PROCESSED_FILES)
+
+    Returns
+    -------
+    str
+        most recently written existing file, the csv one (default build
+        format) when there is none
+    """
+    existing = [path for path in files.values() if os.path.exists(path)]
+    if not existing:
+        return(files['csv'])
+    return(max(existing, key=os.path.getmtime))
+
+def load_processed(path=None, columns=None):
+    """ Loads the final dataset with timestamp start_time/stop_time and
+    categorical hostname/eventName/gpuUUID columns
+
+    Parameters
+    ----------
+    path
+        final dataset file location (csv, parquet or feather), the one the
+        last build wrote if None (see built_file)
+    columns
+        list of columns to read, all columns if None
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        typed final dataframe
+    """
+    path = path or built_file(md.PROCESSED_FILES)
+    output_format = processed_format(path)
+
+    if output_format == 'parquet':
+        df = pd.read_parquet(path, columns=columns)
+    elif output_format == 'feather':
+        df = pd.read_feather(path, columns=columns)
+    else:
+        df = pd.read_csv(path, index_col=0)
+        if columns is not None:
+            df = df[columns]
+
+    # Streamed parquet stores plain strings, categories are (re)set here
+
+    return(md.typed_processed(df))
+
+def load_features(path=None, columns=None):
+    """ Loads the per task feature table (see src.data.features) with the
+    same types as the final dataset
+
+    Parameters
+    ----------
+    path
+        feature table file location (csv, parquet or feather), the one the
+        last build wrote if None
+    columns
+        list of columns to read, all columns if None
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        typed per task feature table
+    """
+    return(load_processed(path or built_file(md.FEATURES_FILES), columns))
+
+def load_stragglers(path=None, columns=None):
+    """ Loads the stragglers table (see src.data.stragglers) with the same
+    types as the final dataset
+
+    Parameters
+    ----------
+    path
+        stragglers table file location (csv, parquet or feather), the one
+        the last build wrote if None
+    columns
+        list of columns to read, all columns if None
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        typed stragglers table
+    """
+    return(load_processed(path or built_file(md.STRAGGLERS_FILES),
+                          columns))
@@ -10,11 +10,18 @@ Code
 
 """
 # -*- coding: utf-8 -*-
+import argparse
 import logging
+import os
+import warnings
 import pandas as pd
+from functools import partial
 from pathlib import Path
-from datetime import datetime
 import sqlite3
+from src.data.graph import run_graph
+from src.data.interval_join import join_aggregate, joined_rows
+from src.data.features import task_features
+from src.data.instrumentation import instrumented, RunReport
 
 BASE_RAW_DATA_DIR = 'data/raw'
 """
@@ -46,26 +53,206 @@ PROCESSED_CSV_FILE = BASE_PROCESSED_DATA_DIR + '/processed.csv'
 str: processed.csv final dataset file location 
 """
 
+PROCESSED_PARQUET_FILE = BASE_PROCESSED_DATA_DIR + '/processed.parquet'
+"""
+str: processed.parquet typed columnar final dataset file location
+"""
+
+PROCESSED_FEATHER_FILE = BASE_PROCESSED_DATA_DIR + '/processed.feather'
+"""
+str: processed.feather typed columnar final dataset file location
+"""
+
+PROCESSED_FILES = {'csv': PROCESSED_CSV_FILE,
+                   'parquet': PROCESSED_PARQUET_FILE,
+                   'feather': PROCESSED_FEATHER_FILE}
+"""
+dict: final dataset file location for every output format
+"""
+
+FEATURES_FILES = {output_format: BASE_PROCESSED_DATA_DIR + '/features.' +
+                  output_format for output_format in PROCESSED_FILES}
+"""
+dict: per task feature table file location for every output format (see
+src.data.features)
+"""
+
+STRAGGLERS_FILES = {output_format: BASE_PROCESSED_DATA_DIR + '/stragglers.' +
+                    output_format for output_format in PROCESSED_FILES}
+"""
+dict: stragglers table file location for every output format (see
+src.data.stragglers)
+"""
+
+JOINED_FILES = {output_format: BASE_PROCESSED_DATA_DIR + '/joined.' +
+                output_format for output_format in PROCESSED_FILES}
+"""
+dict: raw joined rows file location for every output format, only written
+when asked for (see merge_check_task_gpu)
+"""
+
+SAMPLE_STORE_DIR = BASE_PROCESSED_DATA_DIR + '/gpu_store'
+"""
+str: memory-mapped gpu sample store directory (see src.data.sample_store)
+"""
+
+ROLLUP_DIR = BASE_PROCESSED_DATA_DIR + '/rollups'
+"""
+str: multi resolution gpu rollups directory (see src.data.rollups)
+"""
+
+LIVE_CSV_FILE = BASE_PROCESSED_DATA_DIR + '/live.csv'
+"""
+str: live task rows file location (see src.data.follow)
+"""
+
+MEMORY_PER_RAW_BYTE = 5
+"""
+float: peak memory of an in memory build per raw csv byte (about 4.5 in run
+reports of synthetic traces)
+"""
+
+GPU_ROW_BYTES = 100
+"""
+int: average gpu.csv row size in bytes, used to size streaming chunks
+"""
+
+COMPRESSION_RATIO = 10
+"""
+float: assumed csv to compressed size ratio of compressed raw files
+"""
+
+MIN_STREAM_CHUNK_ROWS = 10000
+"""
+int: smallest streaming chunk chosen to fit a memory budget
+"""
+
+CATEGORICAL_COLUMNS = ['hostname', 'eventName', 'gpuUUID']
+"""
+list: final dataset columns stored as categoricals in columnar formats
+"""
+
+TIME_COLUMNS = ['start_time', 'stop_time']
+"""
+list: final dataset columns stored as timestamps in columnar formats
+"""
+
 TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
 """
 str: string used to format timestamp for datetime conversion
 """
 
-def timestamp_conv(df):
+MERGE_ENGINES = ('interval', 'sqlite')
+"""
+tuple: engines available to join gpu samples with task intervals, interval
+is the sorted searchsorted join and sqlite the original reference join
+"""
+
+MALFORMED_REPORT_ROWS = 5
+"""
+int: number of malformed timestamp rows quoted in the parsing error
+"""
+
+def fast_timestamp_conv(df):
+    """ Vectorized fast path for timestamps in the exact TIMESTAMP_FORMAT
+    shape, the strings are viewed as a character matrix to check the 'T',
+    '.' and 'Z' positions then numpy parses the ISO 8601 body
+
+    Parameters
+    ----------
+    df
+        timestamp strings
+
+    Returns
+    -------
+    numpy.ndarray or None
+        datetime64[ns] array, None if the column does not fit the fast path
+    """
+    if len(df) == 0 or df.isnull().any():
+        return(None)
+    try:
+        strings = df.to_numpy(dtype=str)
+    except (TypeError, ValueError):
+        return(None)
+    width = strings.dtype.itemsize // 4
+    if width < 21:
+        return(None)
+
+    # Fixed shape, every row uses the full width and ends with 'Z'
+
+    chars = strings.view('U1').reshape(len(strings), width)
+    if not ((chars[:, width - 1] == 'Z') & (chars[:, 10] == 'T') &
+            (chars[:, 19] == '.')).all():
+        return(None)
+    # numpy only warns on timezone suffixes, treat them as malformed too
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        try:
+            return(strings.astype('U{}'.format(width - 1))
+                   .astype('datetime64[ns]'))
+        except (ValueError, UserWarning):
+            return(None)
+
+@instrumented
+def timestamp_conv(df, as_pydatetime=False):
     """ Converts a timestamp to datetime
     
+    Timestamps are parsed in one vectorized pass with the fixed
+    TIMESTAMP_FORMAT into a native datetime64[ns] column. Columns of that
+    exact shape go through the numpy ISO 8601 parser (fast path), others
+    through pandas with the explicit format, and datetime64 columns are
+    returned as they are. pandas Timestamps subclass datetime, so
+    isinstance(x, datetime) checks keep working, set as_pydatetime to get
+    the old object column of python datetimes instead.
+
     Parameters
     ----------
     df
         dataframe to convert to datetime
+    as_pydatetime
+        compatibility switch, return object dtype python datetimes
+
+    Returns
     -------
-    float
+    pandas.core.series.Series
          converted timestamp
+
+    Raises
+    ------
+    ValueError
+        if any timestamp does not match TIMESTAMP_FORMAT, the error lists
+        the count and the first malformed rows
     """
-    df = df.apply(lambda x: (datetime.strptime(x, TIMESTAMP_FORMAT)))    
-    return(df)
+    fast = None
+    if not pd.api.types.is_datetime64_any_dtype(df):
+        fast = fast_timestamp_conv(df)
+
+    if pd.api.types.is_datetime64_any_dtype(df):
+        parsed = df
+    elif fast is not None:
+        parsed = pd.Series(fast, index=df.index, name=df.name)
+    else:
+        parsed = pd.to_datetime(df, format=TIMESTAMP_FORMAT, errors='coerce')
+
+        # Report rows that failed to parse (missing values stay NaT)
 
-def clean_gpu(gpu_df):
+        malformed = parsed.isnull() & df.notnull()
+        if malformed.any():
+            raise ValueError(
+                "{} malformed timestamps (expected format {}), first rows: {}"
+                .format(malformed.sum(), TIMESTAMP_FORMAT,
+                        df[malformed].head(MALFORMED_REPORT_ROWS).to_dict()))
+
+    parsed = parsed.astype('datetime64[ns]')
+
+    if as_pydatetime:
+        return(pd.Series(parsed.dt.to_pydatetime(), index=parsed.index,
+                         name=parsed.name, dtype=object))
+    return(parsed)
+
+@instrumented
+def clean_gpu(gpu_df, as_pydatetime=False):
     """Clean gpu dataframe by dropping uneeded serial number and
     fixes timestamp format to datetime
 
@@ -73,6 +260,8 @@ def clean_gpu(gpu_df):
     ----------
     gpu_df
         gpu dataframe to clean
+    as_pydatetime
+        keep python datetimes instead of datetime64 (see timestamp_conv)
 
     Returns
     -------
@@ -83,11 +272,12 @@ def clean_gpu(gpu_df):
 
     # Drop uneeded serial column
 
-    gpu_df.drop(columns='gpuSerial', inplace=True)
-    gpu_df['timestamp'] = timestamp_conv(gpu_df['timestamp'])
+    gpu_df.drop(columns='gpuSerial', inplace=True, errors='ignore')
+    gpu_df['timestamp'] = timestamp_conv(gpu_df['timestamp'], as_pydatetime)
     
     return(gpu_df)
 
+@instrumented
 def merge_check_task(checkpoints_df, tasks_df):
     """merge (left join) checkpoints with task df through job and task id
 
@@ -112,7 +302,8 @@ def merge_check_task(checkpoints_df, tasks_df):
                                      on=['taskId', 'jobId'], how='left')
     return (check_task_df)
 
-def clean_check_task(check_task_df):
+@instrumented
+def clean_check_task(check_task_df, as_pydatetime=False):
     """Removes uneeded ids and fixes timestamp format to datetime 
     for merged application checkpoints and tasks df
 
@@ -120,6 +311,8 @@ def clean_check_task(check_task_df):
     ----------
     check_task_df
          merged application checkpoints and tasks df to clean
+    as_pydatetime
+        keep python datetimes instead of datetime64 (see timestamp_conv)
 
     Returns
     -------
@@ -130,15 +323,83 @@ def clean_check_task(check_task_df):
 
     # Drop uneeded ids
 
-    check_task_df.drop(columns= ['jobId', 'taskId'], inplace=True)
+    check_task_df.drop(columns= ['jobId', 'taskId'], inplace=True,
+                       errors='ignore')
     
     # Fix date format
     
-    check_task_df['timestamp'] = timestamp_conv(check_task_df['timestamp'])
+    check_task_df['timestamp'] = timestamp_conv(check_task_df['timestamp'],
+                                                as_pydatetime)
+
+    return(check_task_df)
+
+@instrumented
+def pair_check_task(check_task_df):
+    """Pairs START and STOP checkpoints of the same task event into one row
+    with start_time and stop_time, each START is matched with the next STOP
+    of its task (see src.data.pairing) and the checkpoints left out are
+    logged as a warning
+
+    Parameters
+    ----------
+    check_task_df
+        cleaned application checkpoints and tasks dataframe
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        start/stop paired dataframe
+    """
+    from src.data.pairing import pair_events, issue_counts
+
+    check_task_df, issues_df = pair_events(check_task_df)
+    if len(issues_df):
+        counts = issue_counts(issues_df)
+        logging.getLogger(__name__).warning(
+                'checkpoints left out of pairing: %s', ', '.join(
+                        '{} {}'.format(count, issue)
+                        for issue, count in counts.items() if count),
+                extra={'pairing_issues': counts})
 
     return(check_task_df)
 
-def merge_check_task_gpu(gpu_df, check_task_df):
+def task_intervals(gpu_df, check_task_df, time_range=None):
+    """ Pairs start and stop checkpoints into task intervals and keeps the
+    ones within the gpu dataset times
+
+    Parameters
+    ----------
+    gpu_df
+        cleaned gpu dataframe
+    check_task_df
+        cleaned application checkpoints and tasks dataframe
+    time_range
+        (first, last) gpu timestamps bounding kept tasks, defaults to the
+        first and last times of gpu_df (set when gpu_df is a shard)
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        paired start/stop application checkpoints and tasks dataframe
+    """
+
+    # Pair start and stop checkpoints into task intervals
+
+    check_task_df = pair_check_task(check_task_df)
+   
+    # Remove any timestamps that occur out of the gpu dataset (which may
+    # not be sorted, so its first and last times are looked up)
+
+    if time_range is None:
+        time_range = (gpu_df['timestamp'].min(), gpu_df['timestamp'].max())
+   
+    return(check_task_df[
+            (check_task_df['start_time'] >= time_range[0]) &
+            (check_task_df['stop_time'] <= time_range[1])])
+
+@instrumented
+def merge_check_task_gpu(gpu_df, check_task_df, engine='interval',
+                         time_range=None, keep_joined=False, features=False):
     """merge (left join) gpu df with first merged df through host and timestamp
     
     Parameters
@@ -149,106 +410,896 @@ def merge_check_task_gpu(gpu_df, check_task_df):
     gpu_df
         gpu dataframe to merge
 
+    engine
+        join engine, one of MERGE_ENGINES (default interval)
+
+    time_range
+        (first, last) gpu timestamps bounding kept tasks, defaults to the
+        first and last times of gpu_df (set when gpu_df is a shard)
+
+    keep_joined
+        also return the raw joined rows (one per gpu sample and task
+        interval), only built when asked for
+
+    features
+        also return the per task feature table (see src.data.features),
+        built from the task intervals and sample bounds of the join
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame or tuple
+        per task averages, or (per task averages, joined rows if
+        keep_joined is set, feature table if features is set)
+    """
+
+    check_task_df = task_intervals(gpu_df, check_task_df, time_range)
+
+    bounds = None
+    if engine == 'interval' and (keep_joined or features):
+        merged_df, bounds = join_aggregate(gpu_df, check_task_df,
+                                           keep_bounds=True)
+    elif engine == 'interval':
+        merged_df = join_aggregate(gpu_df, check_task_df)
+    elif engine == 'sqlite':
+        merged_df = sqlite_join_aggregate(gpu_df, check_task_df)
+    else:
+        raise ValueError("Unrecognized merge engine: {}".format(engine))
+
+    outputs = (merged_df,)
+    if keep_joined:
+        outputs += (joined_rows(gpu_df, check_task_df, bounds),)
+    if features:
+        outputs += (task_features(gpu_df, check_task_df, bounds),)
+    return(outputs if len(outputs) > 1 else merged_df)
+
+@instrumented
+def check_task_features(gpu_df, check_task_df, time_range=None):
+    """ Builds the per task feature table (see src.data.features) from the
+    same task intervals as merge_check_task_gpu, on its own (builds writing
+    the final dataset too get it from merge_check_task_gpu)
+
+    Parameters
+    ----------
+    gpu_df
+        cleaned gpu dataframe
+    check_task_df
+        cleaned application checkpoints and tasks dataframe
+    time_range
+        (first, last) gpu timestamps bounding kept tasks (see task_intervals)
+
     Returns
     -------
     pandas.core.frame.DataFrame
-        Cleaned GPU dataframe
+        per task feature table
     """
-    
-    # Record start and stop times for events and drop old timestamps
+    intervals_df = task_intervals(gpu_df, check_task_df, time_range)
+    return(task_features(gpu_df, intervals_df))
 
-    check_task_df_start = check_task_df[
-    check_task_df['eventType'] == 'START']
-    check_task_df_stop = check_task_df[
-    check_task_df['eventType'] == 'STOP']
+def check_task_stragglers(check_task_gpu_df):
+    """ Builds the stragglers table (see src.data.stragglers) of the final
+    dataset
 
-    check_task_df_start.rename(
-            index=str, columns={"timestamp": "start_time"}, inplace = True)
-    check_task_df_stop.rename(
-            index=str, columns={"timestamp": "stop_time"}, inplace = True)
+    Parameters
+    ----------
+    check_task_gpu_df
+        final dataset, or (final dataset, joined rows) when the joined rows
+        are kept
 
-    check_task_df_stop.drop('eventType', axis = 1, inplace = True)
-    check_task_df_start.drop('eventType', axis = 1, inplace = True)
-   
-    # Make each field record start and stop combined
-   
-    check_task_df = pd.merge( check_task_df_start, check_task_df_stop, 
-                on=['hostname', 'eventName', 'x', 'y', 'level'])
-   
-    # Remove any timestamps that occur out of the gpu dataset
-   
-    check_task_df = check_task_df[
-            (check_task_df['start_time'] >= gpu_df['timestamp'][0]) &
-            (check_task_df['stop_time']
-            <= gpu_df['timestamp'][len(gpu_df)-1])]
-   
-    # Use sqllite to only combine with gpu if timestamp is between times
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        stragglers table
+    """
+    from src.data.stragglers import find_stragglers
+
+    if isinstance(check_task_gpu_df, tuple):
+        check_task_gpu_df = check_task_gpu_df[0]
+    return(find_stragglers(check_task_gpu_df))
+
+@instrumented
+def sqlite_join_aggregate(gpu_df, check_task_df):
+    """Reference join, averages gpu stats for every task by combining gpu
+    samples through sqlite if their timestamp is between task times
+
+    Parameters
+    ----------
+    gpu_df
+        gpu dataframe to merge
+
+    check_task_df
+        paired start/stop application checkpoints and tasks dataframe
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        per task averages dataframe
+    """
+
+    # Use sqllite to only combine with gpu if timestamp is between times,
+    # samples are averaged inside the join so joined rows never come back
 
     # connection to sql
     conn = sqlite3.connect(':memory:')
 
     # move dataframes to sql
+    check_task_df = check_task_df.reset_index(drop=True)
+    gpu_df = gpu_df.reset_index(drop=True)
     check_task_df.to_sql('CheckTask', conn, index=False)
     gpu_df.to_sql('Gpu', conn, index=False)
 
-    # SQL query
+    # SQL query, first_pair is the first (gpu row, task row) joined in
+    # scan order, giving the first start_time, stop_time and gpuUUID
+    n_tasks = max(len(check_task_df), 1)
     query = '''
-    SELECT *
+    SELECT CheckTask.hostname, CheckTask.eventName, CheckTask.x,
+        CheckTask.y, CheckTask.level,
+        AVG(Gpu.powerDrawWatt) AS powerDrawWatt,
+        AVG(Gpu.gpuTempC) AS gpuTempC,
+        AVG(Gpu.gpuUtilPerc) AS gpuUtilPerc,
+        AVG(Gpu.gpuMemUtilPerc) AS gpuMemUtilPerc,
+        MIN((Gpu.rowid - 1) * {n_tasks} + CheckTask.rowid - 1) AS first_pair
     FROM Gpu
-    LEFT JOIN CheckTask ON gpu.hostname = CheckTask.hostname
-    WHERE gpu.timestamp >= CheckTask.start_time 
-        AND gpu.timestamp <= CheckTask.stop_time
-    '''
-    # get new df
+    JOIN CheckTask ON Gpu.hostname = CheckTask.hostname
+    WHERE Gpu.timestamp >= CheckTask.start_time 
+        AND Gpu.timestamp <= CheckTask.stop_time
+        AND CheckTask.eventName IS NOT NULL AND CheckTask.x IS NOT NULL
+        AND CheckTask.y IS NOT NULL AND CheckTask.level IS NOT NULL
+    GROUP BY CheckTask.hostname, CheckTask.eventName, CheckTask.x,
+        CheckTask.y, CheckTask.level
+    ORDER BY first_pair
+    '''.format(n_tasks=n_tasks)
+    # get per task averages
     merged_df = pd.read_sql_query(query, conn)
-    
-    # drop duplicate hostname row (index 8)
-    merged_df = merged_df.loc[:,~merged_df.columns.duplicated()]
-    
-    # group for averages (average stats for every task)
-    
-    functions = {
-        'powerDrawWatt': 'mean', 'gpuTempC': 'mean',
-        'gpuUtilPerc': 'mean', 'gpuMemUtilPerc': 'mean',
-        'start_time': 'first', 'stop_time': 'first', 
-        'gpuUUID' : 'first'}
-    
-    merged_df = merged_df.groupby(
-        ['hostname', 'eventName', 'x', 'y', 'level'],
-        as_index=False, sort=False
-    ).agg(functions)
+    conn.close()
+
+    first_pair = merged_df.pop('first_pair').values
+    task_rows = check_task_df.iloc[first_pair % n_tasks]
+    merged_df['start_time'] = task_rows['start_time'].values
+    merged_df['stop_time'] = task_rows['stop_time'].values
+    merged_df['gpuUUID'] = gpu_df['gpuUUID'].values[first_pair // n_tasks]
 
     return(merged_df)
 
-def main():
+def typed_processed(df, categorical=True):
+    """ Gives the final dataset real timestamp columns and categorical
+    hostname, eventName and gpuUUID columns
+
+    Parameters
+    ----------
+    df
+        final (processed) dataframe, only the columns present are converted
+    categorical
+        convert CATEGORICAL_COLUMNS to categoricals (strings otherwise)
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        typed final dataframe
+    """
+    df = df.copy()
+    for col in TIME_COLUMNS:
+        if col in df.columns and (
+                pd.api.types.is_datetime64_any_dtype(df[col])):
+            df[col] = df[col].astype('datetime64[ns]')
+        elif col in df.columns:
+
+            # Text times (csv, sqlite engine) go through numpy's ISO parser
+
+            df[col] = df[col].values.astype(str).astype('datetime64[ns]')
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category' if categorical else str)
+    return(df)
+
+@instrumented
+def save_processed(df, path, output_format='csv'):
+    """ Saves the final dataset, columnar formats are typed first (see
+    typed_processed) and written without the row index
+
+    Parameters
+    ----------
+    df
+        final (processed) dataframe
+    path
+        file location
+    output_format
+        one of csv, parquet or feather (keys of PROCESSED_FILES)
+    """
+    if output_format == 'csv':
+        df.to_csv(path)
+    elif output_format == 'parquet':
+        typed_processed(df).reset_index(drop=True).to_parquet(path,
+                                                              index=False)
+    elif output_format == 'feather':
+        typed_processed(df).reset_index(drop=True).to_feather(path)
+    else:
+        raise ValueError("Unrecognized output format: {}".format(
+                output_format))
+
+def build_paths(output_format='csv', raw_dir=None, processed_dir=None,
+                interim_dir=None, gpu=None, checkpoints=None, tasks=None):
+    """ Gives the input and output locations of a build: the module
+    constants, or the same file names in the directories given
+
+    Parameters
+    ----------
+    output_format
+        final dataset format, picks the processed, features, stragglers and
+        joined files
+    raw_dir
+        raw files directory, BASE_RAW_DATA_DIR locations if None
+    processed_dir
+        outputs directory, BASE_PROCESSED_DATA_DIR locations if None
+    interim_dir
+        stage cache directory, src.data.stage_cache.BASE_INTERIM_DATA_DIR if
+        None
+    gpu
+        gpu.csv location or pattern (see src.data.ingest.raw_parts),
+        overrides raw_dir
+    checkpoints
+        application-checkpoints.csv location or pattern, overrides raw_dir
+    tasks
+        task-x-y.csv location or pattern, overrides raw_dir
+
+    Returns
+    -------
+    dict
+        gpu, check and task raw files, processed, features, stragglers,
+        joined and live files, rollups and sample_store directories and
+        interim directory
+    """
+    from src.data.stage_cache import BASE_INTERIM_DATA_DIR
+    paths = {'gpu': GPU_CSV_FILE, 'check': CHECK_CSV_FILE,
+             'task': TASK_CSV_FILE}
+    if raw_dir is not None:
+        paths = {key: os.path.join(str(raw_dir), os.path.basename(path))
+                 for key, path in paths.items()}
+
+    outputs = {'processed': PROCESSED_FILES[output_format],
+               'features': FEATURES_FILES[output_format],
+               'stragglers': STRAGGLERS_FILES[output_format],
+               'joined': JOINED_FILES[output_format],
+               'live': LIVE_CSV_FILE, 'rollups': ROLLUP_DIR,
+               'sample_store': SAMPLE_STORE_DIR}
+    if processed_dir is not None:
+        outputs = {key: os.path.join(str(processed_dir),
+                                     os.path.basename(path))
+                   for key, path in outputs.items()}
+    paths.update(outputs)
+    paths['interim'] = str(interim_dir or BASE_INTERIM_DATA_DIR)
+
+    for key, path in [('gpu', gpu), ('check', checkpoints), ('task', tasks)]:
+        if path is not None:
+            paths[key] = str(path)
+    return(paths)
+
+def raw_bytes(source):
+    """ Estimates the csv size of a raw file, compressed parts count
+    COMPRESSION_RATIO times their size
+
+    Parameters
+    ----------
+    source
+        raw file location or pattern (see src.data.ingest.raw_parts)
+
+    Returns
+    -------
+    int
+        estimated csv bytes
+    """
+    from src.data.ingest import COMPRESSION_SUFFIXES, raw_parts
+    return(int(sum(os.path.getsize(part) * (
+            COMPRESSION_RATIO if os.path.splitext(part)[1] in
+            COMPRESSION_SUFFIXES else 1) for part in raw_parts(source))))
+
+def plan_memory(paths, memory_budget):
+    """ Chooses an in memory build when the raw files fit a memory budget,
+    a streaming build with chunks fitting it otherwise (see
+    MEMORY_PER_RAW_BYTE)
+
+    Parameters
+    ----------
+    paths
+        build locations (see build_paths)
+    memory_budget
+        bytes
+
+    Returns
+    -------
+    tuple
+        (streaming, gpu rows per chunk), chunk rows is None in memory
+    """
+    from src.data.streaming import STREAM_CHUNK_ROWS
+    gpu_bytes = raw_bytes(paths['gpu'])
+    other_bytes = raw_bytes(paths['check']) + raw_bytes(paths['task'])
+    if (gpu_bytes + other_bytes) * MEMORY_PER_RAW_BYTE <= memory_budget:
+        return(False, None)
+
+    # Streaming keeps the checkpoints in memory, gpu chunks get the rest
+
+    left = memory_budget - other_bytes * MEMORY_PER_RAW_BYTE
+    chunk_rows = int(left / (MEMORY_PER_RAW_BYTE * GPU_ROW_BYTES))
+    if chunk_rows < MIN_STREAM_CHUNK_ROWS:
+        logging.getLogger(__name__).warning(
+                'the checkpoints alone may not fit %d bytes, streaming '
+                '%d rows at a time', memory_budget, MIN_STREAM_CHUNK_ROWS)
+    return(True, min(max(chunk_rows, MIN_STREAM_CHUNK_ROWS),
+                     STREAM_CHUNK_ROWS))
+
+def write_gpu_outputs(gpu_df, rollups, sample_store, paths=None):
+    """ Writes the outputs built from the gpu samples alone
+
+    Parameters
+    ----------
+    gpu_df
+        gpu dataframe (typed or cleaned)
+    rollups
+        write the gpu rollups (see src.data.rollups)
+    sample_store
+        write the gpu sample store (see src.data.sample_store)
+    paths
+        build locations (see build_paths), default ones if None
+    """
+    paths = paths or build_paths()
+    if rollups:
+        from src.data.rollups import build_rollups, write_rollups
+        write_rollups(build_rollups(gpu_df), paths['rollups'])
+    if sample_store:
+        from src.data.sample_store import write_store
+        write_store(gpu_df, paths['sample_store'])
+
+def build_cached(output_format, features, rollups, sample_store, paths=None,
+                 until=None, stragglers=False):
+    """ Turns the raw data into the final dataset and the asked for outputs
+    through the stage cache (see src.data.stage_cache)
+
+    Parameters
+    ----------
+    output_format
+        final dataset format
+    features
+        also write the per task feature table
+    rollups
+        also write the gpu rollups
+    sample_store
+        also write the gpu sample store
+    paths
+        build locations (see build_paths), default ones if None
+    until
+        only run the stages up to this one (see
+        src.data.stage_cache.CACHED_STAGES), kept in the stage cache
+    stragglers
+        also write the stragglers table
+    """
+    from src.data.stage_cache import StageCache, cached_stages, cached_rollups
+    paths = paths or build_paths(output_format)
+    cache = StageCache(paths['interim'])
+    raw_files = [paths['gpu'], paths['check'], paths['task']]
+
+    if until is not None:
+        cached_stages(*raw_files, cache=cache, stage=until)
+        logging.getLogger(__name__).info(
+                'stopped after %s, stage outputs kept in %s', until,
+                paths['interim'])
+        return
+
+    check_task_gpu_df = cached_stages(*raw_files, cache=cache,
+                                      features=features)
+    if features:
+        check_task_gpu_df, features_df = check_task_gpu_df
+        save_processed(features_df, paths['features'], output_format)
+    save_processed(check_task_gpu_df, paths['processed'], output_format)
+    if stragglers:
+        save_processed(check_task_stragglers(check_task_gpu_df),
+                       paths['stragglers'], output_format)
+    if rollups:
+        from src.data.rollups import write_rollups
+        write_rollups(cached_rollups(paths['gpu'], cache), paths['rollups'])
+    if sample_store:
+        write_gpu_outputs(cached_stages(*raw_files, cache=cache,
+                                        stage='clean_gpu'),
+                          False, True, paths)
+
+def processed_graph(workers=1, features=False, rollups=False,
+                    sample_store=False, keep_joined=False, paths=None,
+                    stragglers=False):
+    """ Describes the in memory build as a stage graph (see src.data.graph):
+    the gpu branch and the checkpoints/tasks branch are read and cleaned
+    side by side until merge_check_task_gpu
+
+    Parameters
+    ----------
+    workers
+        processes merging host shards (see src.data.parallel), 1 merges in
+        this process
+    features
+        merge_check_task_gpu also gives the per task feature table from
+        the same join, single process only
+    rollups
+        write the gpu rollups (see write_gpu_outputs)
+    sample_store
+        write the gpu sample store (see write_gpu_outputs)
+    keep_joined
+        merge_check_task_gpu also gives the raw joined rows, single process
+        only
+    paths
+        build locations (see build_paths), default ones if None
+    stragglers
+        add the check_task_stragglers stage
+
+    Returns
+    -------
+    dict
+        stage name to (function, list of stage names read)
+    """
+    from src.data.ingest import read_gpu, read_checkpoints, read_tasks
+    paths = paths or build_paths()
+
+    # Read datasets in (typed, see src.data.ingest)
+
+    graph = {
+        'read_gpu': (partial(read_gpu, paths['gpu']), []),
+        'read_checkpoints': (partial(read_checkpoints, paths['check']), []),
+        'read_tasks': (partial(read_tasks, paths['task']), []),
+        'merge_check_task': (merge_check_task,
+                             ['read_checkpoints', 'read_tasks'])}
+    gpu_outputs = partial(write_gpu_outputs, rollups=rollups,
+                          sample_store=sample_store, paths=paths)
+    if stragglers:
+        graph['check_task_stragglers'] = (check_task_stragglers,
+                                          ['merge_check_task_gpu'])
+
+    # Shards are cleaned in the worker processes
+
+    if workers > 1:
+        from src.data.parallel import parallel_merge
+        graph['merge_check_task_gpu'] = (
+                partial(parallel_merge, workers=workers),
+                ['read_gpu', 'merge_check_task'])
+        graph['write_gpu_outputs'] = (gpu_outputs, ['read_gpu'])
+        return(graph)
+
+    # Cleaning and merging process
+
+    graph['clean_gpu'] = (clean_gpu, ['read_gpu'])
+    graph['clean_check_task'] = (clean_check_task, ['merge_check_task'])
+    graph['merge_check_task_gpu'] = (
+            partial(merge_check_task_gpu, keep_joined=keep_joined,
+                    features=features),
+            ['clean_gpu', 'clean_check_task'])
+    graph['write_gpu_outputs'] = (gpu_outputs, ['clean_gpu'])
+    return(graph)
+
+def build_processed(streaming, output_format, workers, incremental, cache,
+                    features=False, rollups=False, sample_store=False,
+                    keep_joined=False, paths=None, until=None,
+                    chunksize=None, partitioned=False, stragglers=False):
+    """ Turns the raw data into the final dataset (see main)
+
+    Parameters
+    ----------
+    streaming
+        read gpu.csv in chunks with bounded memory
+    output_format
+        final dataset format
+    workers
+        processes merging host shards in parallel
+    incremental
+        only process raw rows appended since the last build when possible
+    cache
+        load unchanged stage outputs from the interim directory
+    features
+        also write the per task feature table (in memory single process
+        runs only)
+    rollups
+        also write the gpu rollups (in memory runs only)
+    sample_store
+        also write the gpu sample store (in memory runs only)
+    keep_joined
+        also write the raw joined rows (in memory single process runs
+        only, skips the cache)
+    paths
+        build locations (see build_paths), default ones if None
+    until
+        only run the stages up to this one through the cache (see
+        build_cached)
+    chunksize
+        gpu rows per streaming chunk, src.data.streaming default if None
+    partitioned
+        join gpu.csv partitions spilled to the interim directory
+    stragglers
+        also write the stragglers table (not streaming or incremental)
+    """
+    paths = paths or build_paths(output_format)
+    os.makedirs(os.path.dirname(paths['processed']) or '.', exist_ok=True)
+    raw_files = [paths['gpu'], paths['check'], paths['task']]
+
+    if incremental:
+        from src.data.incremental import incremental_dataset
+        incremental_dataset(*raw_files, paths['processed'], output_format)
+        return
+
+    if streaming:
+        from src.data.streaming import stream_dataset, STREAM_CHUNK_ROWS
+        stream_dataset(*raw_files, paths['processed'],
+                       chunksize=chunksize or STREAM_CHUNK_ROWS,
+                       output_format=output_format)
+        return
+
+    if partitioned:
+        from src.data.partitioned import partitioned_dataset
+        check_task_gpu_df = partitioned_dataset(*raw_files,
+                                                spill_dir=paths['interim'])
+        save_processed(check_task_gpu_df, paths['processed'], output_format)
+        if stragglers:
+            save_processed(check_task_stragglers(check_task_gpu_df),
+                           paths['stragglers'], output_format)
+        return
+
+    if until is not None or (cache and workers == 1 and not keep_joined):
+        build_cached(output_format, features, rollups, sample_store, paths,
+                     until, stragglers)
+        return
+
+    outputs = run_graph(processed_graph(workers, features, rollups,
+                                        sample_store, keep_joined, paths,
+                                        stragglers))
+    merged = outputs['merge_check_task_gpu']
+    check_task_gpu_df = merged[0] if isinstance(merged, tuple) else merged
+    if keep_joined:
+        save_processed(merged[1], paths['joined'], output_format)
+    if features and workers == 1:
+        save_processed(merged[-1], paths['features'], output_format)
+    if 'check_task_stragglers' in outputs:
+        save_processed(outputs['check_task_stragglers'], paths['stragglers'],
+                       output_format)
+
+    # save final dataset
+
+    save_processed(check_task_gpu_df, paths['processed'], output_format)
+
+def report_file(output_file):
+    """ Gives the run report file location of a final dataset
+
+    Parameters
+    ----------
+    output_file
+        final dataset file location
+
+    Returns
+    -------
+    str
+        run report json file location
+    """
+    return(str(output_file) + '.report.json')
+
+def check_options(streaming, workers, incremental, cache, keep_joined,
+                  until, partitioned=False):
+    """ Refuses build options that do not go together (see main)
+
+    Parameters
+    ----------
+    streaming
+        streaming build
+    workers
+        processes merging host shards
+    incremental
+        incremental build
+    cache
+        stage cache used
+    keep_joined
+        raw joined rows kept
+    until
+        last stage run, None for a whole build
+    partitioned
+        out-of-core build
+    """
+    if partitioned and (streaming or incremental or workers > 1 or
+                        keep_joined or until is not None):
+        raise ValueError("Partitioned builds run on their own (no "
+                         "streaming, no incremental, workers=1, no joined "
+                         "rows, whole builds)")
+    if streaming and workers > 1:
+        raise ValueError("Streaming runs in a single process (workers=1)")
+    if incremental and (streaming or workers > 1):
+        raise ValueError("Incremental builds run in memory in a single "
+                         "process (no streaming, workers=1)")
+    if keep_joined and (streaming or incremental or workers > 1):
+        raise ValueError("Joined rows are only kept by in memory single "
+                         "process runs (no streaming, workers=1)")
+    if until is not None and (not cache or keep_joined or streaming or
+                              incremental or workers > 1):
+        raise ValueError("Stopping after a stage needs the stage cache in "
+                         "memory in a single process")
+
+def check_budget_streaming(output_format, keep_joined):
+    """ Refuses a switch to streaming asked by a memory budget alone that
+    the other build options rule out (see main), before anything is built
+
+    Parameters
+    ----------
+    output_format
+        csv, parquet or feather
+    keep_joined
+        raw joined rows kept
+    """
+    from src.data.streaming import STREAM_FORMATS
+    if output_format not in STREAM_FORMATS:
+        raise ValueError("The raw files do not fit --memory-budget and "
+                         "streaming can not write {} (use {})".format(
+                                 output_format, ' or '.join(STREAM_FORMATS)))
+    if keep_joined:
+        raise ValueError("The raw files do not fit --memory-budget and "
+                         "joined rows are only kept in memory (no "
+                         "--keep-joined)")
+
+def in_memory_outputs(streaming, workers, incremental, features, rollups,
+                      sample_store, partitioned=False, stragglers=False):
+    """ Skips the outputs a build mode cannot write (see main)
+
+    Parameters
+    ----------
+    streaming
+        streaming build
+    workers
+        processes merging host shards
+    incremental
+        incremental build
+    features
+        per task feature table asked for
+    rollups
+        gpu rollups asked for
+    sample_store
+        gpu sample store asked for
+    partitioned
+        out-of-core build (gpu.csv is never in memory either)
+    stragglers
+        stragglers table asked for
+
+    Returns
+    -------
+    tuple
+        (features, rollups, sample_store, stragglers) written
+    """
+    logger = logging.getLogger(__name__)
+    streaming = streaming or partitioned
+    if features and (streaming or incremental or workers > 1):
+        logger.info('per task features are only built by in memory single '
+                    'process runs, skipped')
+        features = False
+    if rollups and (streaming or incremental):
+        logger.info('gpu rollups are only built by in memory runs, skipped')
+        rollups = False
+    if sample_store and (streaming or incremental):
+        logger.info('the gpu sample store is only built by in memory runs, '
+                    'skipped')
+        sample_store = False
+    if stragglers and (streaming and not partitioned or incremental):
+        logger.info('the stragglers table is only built from a whole final '
+                    'dataset, skipped')
+        stragglers = False
+    return(features, rollups, sample_store, stragglers)
+
+def main(streaming=False, output_format='csv', workers=1, incremental=False,
+         cache=True, report=False, trace_memory=False, features=False,
+         rollups=False, sample_store=False, keep_joined=False, follow=False,
+         follow_idle=None, paths=None, memory_budget=None, until=None,
+         partitioned=False, stragglers=False):
     """ Runs data processing scripts to turn raw data from (../raw) into
         cleaned data ready to be analyzed (saved in ../processed).
+
+    Parameters
+    ----------
+    streaming
+        read gpu.csv in chunks with bounded memory (see src.data.streaming)
+    output_format
+        final dataset format, one of csv, parquet or feather (the file is
+        chosen from PROCESSED_FILES)
+    workers
+        processes merging host shards in parallel (see src.data.parallel),
+        1 runs everything in this process
+    incremental
+        only process raw rows appended since the last build when possible
+        (see src.data.incremental)
+    cache
+        load unchanged stage outputs from data/interim instead of recomputing
+        them (see src.data.stage_cache), in memory single process runs only
+    report
+        write the per stage run report (see src.data.instrumentation) beside
+        the final dataset
+    trace_memory
+        measure per stage traced memory with tracemalloc (slower)
+    features
+        also write the per task feature table to FEATURES_FILES (see
+        src.data.features), in memory single process runs only
+    rollups
+        also write the multi resolution gpu rollups to ROLLUP_DIR (see
+        src.data.rollups), in memory runs only
+    sample_store
+        also write the memory-mapped gpu sample store to SAMPLE_STORE_DIR
+        (see src.data.sample_store), in memory runs only
+    keep_joined
+        also write the raw joined rows (one per gpu sample and task
+        interval) to JOINED_FILES, in memory single process runs only
+    follow
+        follow the raw files as they grow and write every finished task to
+        LIVE_CSV_FILE instead (see src.data.follow)
+    follow_idle
+        seconds without a new raw line ending a follow run, never if None
+    paths
+        input and output locations (see build_paths), the module constants
+        if None
+    memory_budget
+        bytes a single process build may use, it streams with chunks
+        fitting the budget when the raw files would not fit in memory (see
+        plan_memory, csv or parquet output only), no limit if None
+    until
+        only run the stages up to this one (see
+        src.data.stage_cache.CACHED_STAGES), a later run resumes from the
+        stage outputs kept in the stage cache
+    partitioned
+        spill gpu.csv to host and time window partitions in the interim
+        directory and join them one at a time, for traces larger than
+        memory (see src.data.partitioned), same final dataset
+    stragglers
+        also write the stragglers table to STRAGGLERS_FILES (see
+        src.data.stragglers), not by streaming or incremental runs
     """
     logger = logging.getLogger(__name__)
+    paths = paths or build_paths(output_format)
+
+    if follow:
+        if streaming or incremental or partitioned or workers > 1:
+            raise ValueError("Follow runs on its own (no streaming, no "
+                             "incremental, not partitioned, workers=1)")
+        from src.data.follow import follow_dataset
+        logger.info('following raw data, writing %s', paths['live'])
+        follow_dataset(paths['gpu'], paths['check'], paths['task'],
+                       paths['live'], idle_seconds=follow_idle)
+        return
+
     logger.info('making final data set from raw data')
-    
-    # Read datasets in
-    
-    gpu_df = pd.read_csv(GPU_CSV_FILE)
-    checkpoints_df = pd.read_csv(CHECK_CSV_FILE)
-    tasks_df = pd.read_csv(TASK_CSV_FILE)
-    
-    # Cleaning and merging process    
-    gpu_df = clean_gpu(gpu_df)
-    check_task_df = merge_check_task(checkpoints_df, tasks_df)
-    check_task_df = clean_check_task(check_task_df)  
-    check_task_gpu_df = merge_check_task_gpu(gpu_df, check_task_df)
 
-    # save final dataset
-    
-    check_task_gpu_df.to_csv(PROCESSED_CSV_FILE)
+    chunksize = None
+    if memory_budget is not None and not (incremental or workers > 1 or
+                                          until is not None or partitioned):
+        planned, chunksize = plan_memory(paths, memory_budget)
+        if planned and not streaming:
+            check_budget_streaming(output_format, keep_joined)
+        streaming = streaming or planned
+    check_options(streaming, workers, incremental, cache, keep_joined, until,
+                  partitioned)
+    features, rollups, sample_store, stragglers = in_memory_outputs(
+            streaming, workers, incremental, features, rollups, sample_store,
+            partitioned, stragglers)
 
-if __name__ == '__main__':
+    with RunReport(trace_memory=trace_memory, streaming=streaming,
+                   output_format=output_format, workers=workers,
+                   incremental=incremental, cache=cache,
+                   features=features, rollups=rollups,
+                   sample_store=sample_store, keep_joined=keep_joined,
+                   memory_budget=memory_budget, until=until,
+                   chunksize=chunksize, partitioned=partitioned,
+                   stragglers=stragglers) as run:
+        build_processed(streaming, output_format, workers, incremental,
+                        cache, features, rollups, sample_store, keep_joined,
+                        paths, until, chunksize, partitioned, stragglers)
+    logger.info('final data set made in %.1fs', run.seconds)
+
+    if report:
+        run.write(report_file(paths['processed']))
+
+def parse_args(argv=None):
+    """ Parses the command line options of main
+
+    Parameters
+    ----------
+    argv
+        command line arguments, sys.argv if None
+
+    Returns
+    -------
+    argparse.Namespace
+        parsed options
+    """
+    from src.data.stage_cache import CACHED_STAGES
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--raw-dir', metavar='DIR',
+                        help='directory of gpu.csv, '
+                        'application-checkpoints.csv and task-x-y.csv '
+                        '(default data/raw)')
+    parser.add_argument('--gpu', metavar='FILE',
+                        help='gpu.csv location or pattern (compressed or '
+                        'in parts, overrides --raw-dir)')
+    parser.add_argument('--checkpoints', metavar='FILE',
+                        help='application-checkpoints.csv location or '
+                        'pattern')
+    parser.add_argument('--tasks', metavar='FILE',
+                        help='task-x-y.csv location or pattern')
+    parser.add_argument('--processed-dir', metavar='DIR',
+                        help='outputs directory (default data/processed)')
+    parser.add_argument('--interim-dir', metavar='DIR',
+                        help='stage cache directory (default data/interim)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='process gpu.csv in chunks with bounded memory')
+    parser.add_argument('--format', default='csv',
+                        choices=sorted(PROCESSED_FILES),
+                        help='final dataset format (default csv)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes merging host shards (default 1)')
+    parser.add_argument('--partitioned', action='store_true',
+                        help='spill gpu.csv to host and time window '
+                        'partitions and join them one at a time (traces '
+                        'larger than memory)')
+    parser.add_argument('--memory-budget', type=float, metavar='MB',
+                        help='stream in chunks fitting MB megabytes when '
+                        'the raw files would not fit in memory')
+    parser.add_argument('--until', choices=CACHED_STAGES, metavar='STAGE',
+                        help='stop after STAGE, one of ' +
+                        ', '.join(CACHED_STAGES) + ' (outputs kept in the '
+                        'stage cache, the next run resumes from them)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only process raw rows appended since the '
+                        'last build')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='recompute every stage instead of loading '
+                        'unchanged ones from data/interim')
+    parser.add_argument('--report', action='store_true',
+                        help='write a json run report beside the final '
+                        'dataset')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='measure per stage memory with tracemalloc')
+    parser.add_argument('--features', action='store_true',
+                        help='also write the per task feature table')
+    parser.add_argument('--rollups', action='store_true',
+                        help='also write the multi resolution gpu rollups '
+                        '(parquet)')
+    parser.add_argument('--stragglers', action='store_true',
+                        help='also write the stragglers table')
+    parser.add_argument('--sample-store', action='store_true',
+                        help='also write the memory-mapped gpu sample store')
+    parser.add_argument('--keep-joined', action='store_true',
+                        help='also write the raw joined gpu/task rows')
+    parser.add_argument('--follow', action='store_true',
+                        help='follow the raw files and write finished '
+                        'tasks to data/processed/live.csv')
+    parser.add_argument('--follow-idle', type=float, default=None,
+                        metavar='SECONDS',
+                        help='stop following after SECONDS without a new '
+                        'line (default never)')
+    return(parser.parse_args(argv))
+
+def cli(argv=None):
+    """ Command line entry point, installed as make-dataset (see setup.py)
+
+    Parameters
+    ----------
+    argv
+        command line arguments, sys.argv if None
+    """
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     logging.basicConfig(level=logging.INFO, format=log_fmt)
+    args = parse_args(argv)
+    paths = build_paths(args.format, args.raw_dir, args.processed_dir,
+                        args.interim_dir, args.gpu, args.checkpoints,
+                        args.tasks)
+    memory_budget = (None if args.memory_budget is None
+                     else int(args.memory_budget * 2 ** 20))
+
+    main(streaming=args.streaming, output_format=args.format,
+         workers=args.workers, incremental=args.incremental,
+         cache=not args.no_cache, report=args.report,
+         trace_memory=args.trace_memory, features=args.features,
+         rollups=args.rollups, sample_store=args.sample_store,
+         keep_joined=args.keep_joined, follow=args.follow,
+         follow_idle=args.follow_idle, paths=paths,
+         memory_budget=memory_budget, until=args.until,
+         partitioned=args.partitioned, stragglers=args.stragglers)
+
+if __name__ == '__main__':
 
     # not used in this stub but often useful for finding various files
-    
+
     project_dir = Path(__file__).resolve().parents[2]
 
-    main()
+    cli()
@@ -0,0 +1,126 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the START/STOP checkpoint
+pairing. Checkpoints are sorted by task keys (hostname, eventName, x, y,
+level) then time, and each START is matched with the STOP right after it in
+a single pass, so re-rendered or retried tiles give one interval per attempt
+instead of every START/STOP combination. START events followed by another
+START of the same task (overlapping attempts), START events never stopped
+and STOP events without a START are left out and reported.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from src.data.interval_join import TASK_KEYS, to_epoch_ns
+
+ISSUES = ('overlapping_start', 'unmatched_start', 'unmatched_stop')
+"""
+tuple: kinds of checkpoints left out of the intervals
+"""
+
+def key_codes(check_task_df):
+    """ Codes every task key column as integers (missing values get their
+    own code, like pandas merge matching missing keys together)
+
+    Parameters
+    ----------
+    check_task_df
+        cleaned application checkpoints and tasks dataframe
+
+    Returns
+    -------
+    list
+        one int64 numpy array per TASK_KEYS column
+    """
+    return([pd.factorize(check_task_df[key], sort=False)[0].astype(np.int64)
+            for key in TASK_KEYS])
+
+def pair_events(check_task_df):
+    """ Pairs START and STOP checkpoints of the same task event into
+    intervals (see module introduction)
+
+    Parameters
+    ----------
+    check_task_df
+        cleaned application checkpoints and tasks dataframe
+
+    Returns
+    -------
+    tuple
+        (intervals dataframe with start_time and stop_time in the START
+        row order, dataframe of the checkpoints left out with an issue
+        column, one of ISSUES)
+    """
+    n_rows = len(check_task_df)
+    codes = key_codes(check_task_df)
+    times = to_epoch_ns(check_task_df['timestamp'])
+
+    # Sort by keys then time, ties put START before STOP (zero length
+    # tasks) then keep file order
+
+    is_start = check_task_df['eventType'].values == 'START'
+    is_stop = check_task_df['eventType'].values == 'STOP'
+    order = np.lexsort([np.arange(n_rows), is_stop, times] + codes[::-1])
+    is_start, is_stop = is_start[order], is_stop[order]
+    same_next = np.ones(max(n_rows - 1, 0), dtype=bool)
+    for code in codes:
+        sorted_code = code[order]
+        same_next &= sorted_code[1:] == sorted_code[:-1]
+
+    # One pass: a START pairs with the row after it when that is its STOP
+
+    paired = np.zeros(n_rows, dtype=bool)
+    paired[:-1] = is_start[:-1] & is_stop[1:] & same_next
+    stopped = np.zeros(n_rows, dtype=bool)
+    stopped[1:] = paired[:-1]
+
+    followed = np.zeros(n_rows, dtype=bool)
+    followed[:-1] = is_start[:-1] & is_start[1:] & same_next
+    issue = np.full(n_rows, None, dtype=object)
+    issue[is_start & ~paired] = 'unmatched_start'
+    issue[followed] = 'overlapping_start'
+    issue[is_stop & ~stopped] = 'unmatched_stop'
+    row_issue = np.empty(n_rows, dtype=object)
+    row_issue[order] = issue
+
+    # Intervals in START row order, like the merge used to give
+
+    start_rows = order[paired]
+    stop_rows = order[np.flatnonzero(paired) + 1]
+    by_start = np.argsort(start_rows, kind='mergesort')
+    start_rows, stop_rows = start_rows[by_start], stop_rows[by_start]
+
+    intervals_df = check_task_df.iloc[start_rows].drop(
+            columns=['timestamp', 'eventType'])
+    intervals_df.insert(0, 'start_time', check_task_df['timestamp'].values[
+            start_rows])
+    intervals_df['stop_time'] = check_task_df['timestamp'].values[stop_rows]
+    intervals_df = intervals_df.reset_index(drop=True)
+
+    left_out = np.flatnonzero(pd.notnull(row_issue))
+    issues_df = check_task_df.iloc[left_out].copy()
+    issues_df['issue'] = pd.Categorical(row_issue[left_out],
+                                        categories=ISSUES)
+    return(intervals_df, issues_df)
+
+def issue_counts(issues_df):
+    """ Counts the left out checkpoints of every kind
+
+    Parameters
+    ----------
+    issues_df
+        left out checkpoints (see pair_events)
+
+    Returns
+    -------
+    dict
+        issue to count, every kind of ISSUES included
+    """
+    counts = issues_df['issue'].value_counts()
+    return({issue: int(counts.get(issue, 0)) for issue in ISSUES})
@@ -0,0 +1,147 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the multi-core data
+preparation process. Checkpoints are only ever paired and joined with gpu
+samples of the same hostname, so the raw inputs are split into host shards
+and each shard is cleaned, paired, joined and aggregated in its own process.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from src.data import make_dataset as md
+from src.data.interval_join import GPU_METRICS, TASK_KEYS
+
+FINAL_COLUMNS = TASK_KEYS + GPU_METRICS + ['start_time', 'stop_time',
+                                          'gpuUUID']
+"""
+list: columns of the final dataset
+"""
+
+def shard_hosts(host_counts, n_shards):
+    """ Assigns hosts to shards, biggest hosts first to the lightest shard
+    (greedy longest processing time), ties broken by hostname so the
+    assignment is deterministic
+
+    Parameters
+    ----------
+    host_counts
+        pandas series of gpu rows per hostname
+    n_shards
+        number of shards
+
+    Returns
+    -------
+    dict
+        hostname to shard number
+    """
+    loads = [0] * n_shards
+    assignment = {}
+    ordered = sorted(host_counts.items(), key=lambda item: (-item[1], item[0]))
+    for host, count in ordered:
+        shard = loads.index(min(loads))
+        assignment[host] = shard
+        loads[shard] += count
+    return(assignment)
+
+def split_shards(df, assignment, n_shards):
+    """ Splits a dataframe into host shards
+
+    Parameters
+    ----------
+    df
+        dataframe with a hostname column
+    assignment
+        hostname to shard number (see shard_hosts)
+    n_shards
+        number of shards
+
+    Returns
+    -------
+    list
+        one dataframe per shard (empty when no rows)
+    """
+    shard_ids = df['hostname'].astype(object).map(assignment).fillna(-1).values
+    return([df[shard_ids == shard] for shard in range(n_shards)])
+
+def merge_shard(gpu_df, check_task_df, time_range, engine):
+    """ Cleans, pairs, joins and aggregates one host shard (process pool
+    worker)
+
+    Parameters
+    ----------
+    gpu_df
+        raw gpu shard
+    check_task_df
+        raw merged application checkpoints and tasks shard
+    time_range
+        (first, last) timestamps of the whole gpu dataset
+    engine
+        join engine, one of make_dataset.MERGE_ENGINES
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        per task averages of the shard
+    """
+    gpu_df = md.clean_gpu(gpu_df.reset_index(drop=True))
+    check_task_df = md.clean_check_task(check_task_df)
+    if len(gpu_df) == 0 or len(check_task_df) == 0:
+        return(None)
+    return(md.merge_check_task_gpu(gpu_df, check_task_df, engine=engine,
+                                   time_range=time_range))
+
+def parallel_merge(gpu_df, check_task_df, workers=None, engine='interval'):
+    """ Runs clean_gpu, clean_check_task and merge_check_task_gpu over host
+    shards in a process pool
+
+    Parameters
+    ----------
+    gpu_df
+        raw gpu dataframe (as read from gpu.csv)
+    check_task_df
+        raw merged application checkpoints and tasks dataframe (output of
+        make_dataset.merge_check_task)
+    workers
+        number of processes, defaults to the cpu count
+    engine
+        join engine, one of make_dataset.MERGE_ENGINES
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        per task averages, shards are concatenated in shard order (hosts
+        with the most gpu rows first) whatever order the workers finish in
+    """
+    logger = logging.getLogger(__name__)
+    workers = workers or os.cpu_count() or 1
+    if len(gpu_df) == 0:
+        return(pd.DataFrame(columns=FINAL_COLUMNS))
+
+    # Whole dataset bounds (gpu.csv may not be in time order), a shard only
+    # sees its own rows
+
+    timestamps = md.timestamp_conv(gpu_df['timestamp'])
+    time_range = (timestamps.min(), timestamps.max())
+
+    assignment = shard_hosts(gpu_df['hostname'].value_counts(), workers)
+    gpu_shards = split_shards(gpu_df, assignment, workers)
+    check_task_shards = split_shards(check_task_df, assignment, workers)
+    logger.info('merging %d hosts in %d shards', len(assignment), workers)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+                merge_shard, gpu_shards, check_task_shards,
+                [time_range] * workers, [engine] * workers))
+
+    results = [result for result in results if result is not None]
+    if not results:
+        return(pd.DataFrame(columns=FINAL_COLUMNS))
+    return(pd.concat(results, ignore_index=True))
@@ -0,0 +1,412 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the out-of-core (partitioned)
+data preparation process, for gpu traces larger than memory. gpu.csv is read
+and cleaned chunk by chunk and spilled to local disk in partitions by host
+bucket (hosts hashed into PARTITION_HOST_BUCKETS buckets) and time window
+(PARTITION_WINDOW_SECONDS long), so gpu.csv does not have to be in time
+order. Checkpoints are paired in memory (they are a small part of the raw
+data) and every host bucket is then joined window after window, only one
+window of one bucket in memory at a time.
+
+The join keeps the in-memory arithmetic: the prefix (cumulative) sums of a
+host carry over from one window to the next, so an interval sum is the
+difference of the same two prefix sums as in src.data.interval_join, and
+the per task aggregation runs once over every interval. The final dataset
+is identical to the in-memory one, row order included.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import logging
+import os
+import shutil
+import tempfile
+import zlib
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data.ingest import (GPU_SCHEMA, READ_CHUNK_ROWS, read_chunks,
+                             read_checkpoints, read_tasks, widen_integers)
+from src.data.instrumentation import instrumented
+from src.data.interval_join import (GPU_METRICS, aggregate_intervals,
+                                    host_positions, to_epoch_ns)
+from src.data.parallel import FINAL_COLUMNS
+
+PARTITION_HOST_BUCKETS = 16
+"""
+int: host buckets gpu samples are partitioned into
+"""
+
+PARTITION_WINDOW_SECONDS = 3600
+"""
+int: length in seconds of the time windows gpu samples are partitioned into
+"""
+
+def host_buckets(hostnames, n_buckets):
+    """ Hashes hostnames into buckets (crc32, the same on every run)
+
+    Parameters
+    ----------
+    hostnames
+        numpy array of hostnames
+    n_buckets
+        number of buckets
+
+    Returns
+    -------
+    numpy.ndarray
+        bucket of every hostname
+    """
+    names, codes = np.unique(hostnames.astype(str), return_inverse=True)
+    buckets = np.array([zlib.crc32(name.encode()) % n_buckets
+                        for name in names], dtype=np.int64)
+    return(buckets[codes])
+
+def partition_dir(directory, bucket, window):
+    """ Gives the directory of a partition
+
+    Parameters
+    ----------
+    directory
+        spill directory
+    bucket
+        host bucket
+    window
+        time window number
+
+    Returns
+    -------
+    str
+        partition directory location
+    """
+    return(os.path.join(str(directory), 'host-{}'.format(bucket),
+                        'window-{}'.format(window)))
+
+@instrumented
+def spill_gpu(gpu_csv_file, directory, n_buckets=PARTITION_HOST_BUCKETS,
+              window_seconds=PARTITION_WINDOW_SECONDS,
+              chunksize=READ_CHUNK_ROWS):
+    """ Reads and cleans gpu.csv chunk by chunk and writes every chunk to
+    its host bucket and time window partitions, rows keep their gpu.csv
+    position
+
+    Parameters
+    ----------
+    gpu_csv_file
+        gpu.csv file location (see src.data.ingest.raw_parts)
+    directory
+        spill directory
+    n_buckets
+        host buckets
+    window_seconds
+        time window length
+    chunksize
+        gpu.csv rows per chunk
+
+    Returns
+    -------
+    dict
+        time_range ((first, last) sample timestamps, None without samples)
+        and windows (host bucket to sorted window numbers)
+    """
+    window_ns = int(window_seconds * 1e9)
+    windows = {}
+    first_time, last_time = None, None
+    offset = 0
+
+    # Integer readings are read as float32 (same values once summed as
+    # float64) so chunks with missing readings share the other chunks dtypes
+
+    schema = widen_integers(GPU_SCHEMA)
+    for number, gpu_df in enumerate(read_chunks(gpu_csv_file, schema,
+                                                chunksize)):
+        gpu_df = md.clean_gpu(gpu_df).reset_index(drop=True)
+        times = to_epoch_ns(gpu_df['timestamp'])
+        part_df = pd.DataFrame({
+                'row': np.arange(offset, offset + len(gpu_df)),
+                'time': times,
+                'hostname': gpu_df['hostname'].astype(str).values,
+                'gpuUUID': gpu_df['gpuUUID'].astype(object).values})
+        for metric in GPU_METRICS:
+            part_df[metric] = gpu_df[metric].to_numpy(dtype=np.float64)
+        offset += len(gpu_df)
+        if not len(gpu_df):
+            continue
+        if first_time is None:
+            first_time, last_time = times.min(), times.max()
+        first_time = min(first_time, times.min())
+        last_time = max(last_time, times.max())
+
+        keys = pd.DataFrame({
+                'bucket': host_buckets(part_df['hostname'].values,
+                                       n_buckets),
+                'window': times // window_ns})
+        for (bucket, window), pos in keys.groupby(
+                ['bucket', 'window'], sort=False).indices.items():
+            path = partition_dir(directory, bucket, window)
+            os.makedirs(path, exist_ok=True)
+            part_df.iloc[pos].to_pickle(os.path.join(
+                    path, 'part-{:06d}.pkl'.format(number)))
+            windows.setdefault(int(bucket), set()).add(int(window))
+
+    time_range = None
+    if first_time is not None:
+        time_range = (pd.Timestamp(first_time), pd.Timestamp(last_time))
+    return({'time_range': time_range,
+            'windows': {bucket: sorted(found)
+                        for bucket, found in windows.items()}})
+
+def load_partition(directory, bucket, window):
+    """ Reads the gpu samples of a partition, in gpu.csv order
+
+    Parameters
+    ----------
+    directory
+        spill directory
+    bucket
+        host bucket
+    window
+        time window number
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        partition samples, None when the partition is empty
+    """
+    path = partition_dir(directory, bucket, window)
+    if not os.path.isdir(path):
+        return(None)
+    return(pd.concat([pd.read_pickle(os.path.join(path, name))
+                      for name in sorted(os.listdir(path))],
+                     ignore_index=True))
+
+class HostPrefix(object):
+    """ Running prefix sums of the time sorted samples of one host (see
+    module introduction), looked up at interval starts and stops one window
+    at a time
+
+    Parameters
+    ----------
+    n_metrics
+        number of gpu metrics
+    """
+
+    def __init__(self, n_metrics=len(GPU_METRICS)):
+        self.sums = np.zeros(n_metrics)
+        self.counts = np.zeros(n_metrics, dtype=np.int64)
+        self.samples = 0
+
+    def window(self, samples_df):
+        """ Moves on to the next window
+
+        Parameters
+        ----------
+        samples_df
+            samples of the host in the window, None when there are none
+
+        Returns
+        -------
+        tuple
+            (times, value prefix sums, count prefix sums, sample prefix
+            counts, rows, uuids) of the window, prefixes starting with the
+            totals of the previous windows
+        """
+        if samples_df is None or not len(samples_df):
+            empty = np.zeros(0, dtype=np.int64)
+            return(empty, self.sums[None], self.counts[None],
+                   np.array([self.samples]), empty, empty.astype(object))
+
+        # Sort by time (stable so ties keep gpu.csv order), the carried
+        # totals seed the cumulative sums so they add up in the same order
+        # as over the whole host
+
+        samples_df = samples_df.iloc[np.argsort(samples_df['time'].values,
+                                                kind='mergesort')]
+        values = samples_df[GPU_METRICS].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        value_cs = np.cumsum(np.vstack(
+                [self.sums[None], np.where(valid, values, 0)]), axis=0)
+        count_cs = np.cumsum(np.vstack([self.counts[None], valid]), axis=0)
+        sample_cs = self.samples + np.arange(len(samples_df) + 1)
+        self.sums, self.counts = value_cs[-1], count_cs[-1]
+        self.samples = sample_cs[-1]
+        return(samples_df['time'].values, value_cs, count_cs, sample_cs,
+               samples_df['row'].values, samples_df['gpuUUID'].values)
+
+def bucket_sums(directory, bucket, windows, intervals_df, window_seconds):
+    """ Sums gpu metrics over the intervals of the hosts of one bucket, one
+    window at a time (see interval_join.interval_sums)
+
+    Parameters
+    ----------
+    directory
+        spill directory
+    bucket
+        host bucket
+    windows
+        window numbers with samples in the bucket
+    intervals_df
+        intervals of the hosts of the bucket
+    window_seconds
+        time window length
+
+    Returns
+    -------
+    tuple
+        (sums, counts, first, uuids) of every interval like
+        interval_join.join_aggregate, first being gpu.csv row positions
+    """
+    window_ns = int(window_seconds * 1e9)
+    n_intervals = len(intervals_df)
+    starts = to_epoch_ns(intervals_df['start_time'])
+    stops = to_epoch_ns(intervals_df['stop_time'])
+    ends = {'start': (starts, starts // window_ns, 'left'),
+            'stop': (stops, stops // window_ns, 'right')}
+    prefixes = {end: [np.zeros((n_intervals, len(GPU_METRICS))),
+                      np.zeros((n_intervals, len(GPU_METRICS)),
+                               dtype=np.int64),
+                      np.zeros(n_intervals, dtype=np.int64)]
+                for end in ends}
+    first = np.full(n_intervals, -1, dtype=np.int64)
+    uuids = np.empty(n_intervals, dtype=object)
+    waiting = np.zeros(n_intervals, dtype=bool)
+
+    hosts = {host: (pos, HostPrefix()) for host, pos in
+             host_positions(intervals_df['hostname'].astype(str)).items()}
+    for window in sorted(set(windows) | set(ends['start'][1]) |
+                         set(ends['stop'][1])):
+        window_df = load_partition(directory, bucket, window)
+        samples = ({} if window_df is None else
+                   host_positions(window_df['hostname']))
+        for host, (pos, prefix) in hosts.items():
+            host_df = (window_df.iloc[samples[host]] if host in samples
+                       else None)
+            times, value_cs, count_cs, sample_cs, rows, ids = prefix.window(
+                    host_df)
+
+            # Intervals started earlier with no sample yet take the first
+            # one of this window
+
+            if len(times):
+                late = pos[waiting[pos]]
+                first[late], uuids[late] = rows[0], ids[0]
+                waiting[late] = False
+
+            for end, (end_times, end_windows, side) in ends.items():
+                here = pos[end_windows[pos] == window]
+                at = np.searchsorted(times, end_times[here], side=side)
+                for store, cs in zip(prefixes[end],
+                                     [value_cs, count_cs, sample_cs]):
+                    store[here] = cs[at]
+                if end == 'start':
+                    found = at < len(times)
+                    first[here[found]] = rows[at[found]]
+                    uuids[here[found]] = ids[at[found]]
+                    waiting[here[~found]] = True
+
+    (start_sums, start_counts, start_samples), (
+            stop_sums, stop_counts, stop_samples) = (prefixes['start'],
+                                                     prefixes['stop'])
+    first = np.where(stop_samples > start_samples, first, -1)
+    return(stop_sums - start_sums, stop_counts - start_counts, first, uuids)
+
+@instrumented
+def partitioned_merge(gpu_csv_file, check_task_df, directory,
+                      n_buckets=PARTITION_HOST_BUCKETS,
+                      window_seconds=PARTITION_WINDOW_SECONDS,
+                      chunksize=READ_CHUNK_ROWS):
+    """ Out-of-core version of make_dataset.merge_check_task_gpu reading
+    gpu.csv itself (see module introduction)
+
+    Parameters
+    ----------
+    gpu_csv_file
+        gpu.csv file location (see src.data.ingest.raw_parts)
+    check_task_df
+        cleaned application checkpoints and tasks dataframe
+    directory
+        spill directory, partitions are written to it
+    n_buckets
+        host buckets
+    window_seconds
+        time window length
+    chunksize
+        gpu.csv rows read at a time
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        per task averages, identical to the in-memory ones
+    """
+    logger = logging.getLogger(__name__)
+    spilled = spill_gpu(gpu_csv_file, directory, n_buckets, window_seconds,
+                        chunksize)
+    if spilled['time_range'] is None:
+        return(pd.DataFrame(columns=FINAL_COLUMNS))
+    logger.info('gpu samples spilled to %d partitions', sum(
+            len(windows) for windows in spilled['windows'].values()))
+
+    intervals_df = md.task_intervals(None, check_task_df,
+                                     spilled['time_range'])
+    n_intervals = len(intervals_df)
+    sums = np.zeros((n_intervals, len(GPU_METRICS)))
+    counts = np.zeros((n_intervals, len(GPU_METRICS)), dtype=np.int64)
+    first = np.full(n_intervals, -1, dtype=np.int64)
+    uuids = np.empty(n_intervals, dtype=object)
+
+    buckets = host_buckets(intervals_df['hostname'].values, n_buckets)
+    for bucket, windows in spilled['windows'].items():
+        pos = np.flatnonzero(buckets == bucket)
+        if len(pos):
+            sums[pos], counts[pos], first[pos], uuids[pos] = bucket_sums(
+                    directory, bucket, windows, intervals_df.iloc[pos],
+                    window_seconds)
+    return(aggregate_intervals(intervals_df, sums, counts, first, uuids))
+
+def partitioned_dataset(gpu_csv_file, check_csv_file, task_csv_file,
+                        spill_dir=None, n_buckets=PARTITION_HOST_BUCKETS,
+                        window_seconds=PARTITION_WINDOW_SECONDS,
+                        chunksize=READ_CHUNK_ROWS):
+    """ Runs the whole data preparation out-of-core, partitions are spilled
+    to a temporary directory removed afterwards
+
+    Parameters
+    ----------
+    gpu_csv_file
+        gpu.csv file location
+    check_csv_file
+        application-checkpoints.csv file location
+    task_csv_file
+        task-x-y.csv file location
+    spill_dir
+        directory the temporary spill directory is made in, the system
+        temporary directory if None
+    n_buckets
+        host buckets
+    window_seconds
+        time window length
+    chunksize
+        gpu.csv rows read at a time
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        final dataset
+    """
+    check_task_df = md.clean_check_task(md.merge_check_task(
+            read_checkpoints(check_csv_file), read_tasks(task_csv_file)))
+    if spill_dir is not None:
+        os.makedirs(str(spill_dir), exist_ok=True)
+    directory = tempfile.mkdtemp(prefix='partitions-',
+                                 dir=None if spill_dir is None
+                                 else str(spill_dir))
+    try:
+        return(partitioned_merge(gpu_csv_file, check_task_df, directory,
+                                 n_buckets, window_seconds, chunksize))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,249 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the query interface over the
+final (processed) dataset. The dataset is loaded once and indexed by
+hostname, eventName, level and tile (x, y): every index maps a value to the
+sorted row positions holding it, so a filter only intersects a few position
+arrays instead of masking the whole frame. Results of select and aggregate
+requests are memoised in a least recently used cache, so repeating an
+interactive query costs a dictionary lookup.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import numpy as np
+from src.data import make_dataset as md
+from src.data.interval_join import GPU_METRICS
+from src.data.load_dataset import load_processed
+
+INDEXED_COLUMNS = ['hostname', 'eventName', 'level']
+"""
+list: columns indexed by value, tile (x, y) is indexed too
+"""
+
+QUERY_CACHE_SIZE = 128
+"""
+int: query results kept in the least recently used cache
+"""
+
+def freeze(value):
+    """ Turns a filter value into a hashable memo key part
+
+    Parameters
+    ----------
+    value
+        scalar, tuple or list (of scalars, tuples or lists)
+
+    Returns
+    -------
+    object
+        hashable value, lists and tuples become tuples
+    """
+    if isinstance(value, (list, tuple, set)):
+        return(tuple(freeze(item) for item in value))
+    if isinstance(value, dict):
+        return(tuple(sorted((key, freeze(item))
+                            for key, item in value.items())))
+    return(value)
+
+class ProcessedQuery(object):
+    """ Indexed, memoised queries over the final dataset (see module
+    introduction)
+
+    Parameters
+    ----------
+    df
+        final dataset, loaded from path if None
+    path
+        final dataset file location, the one the last build wrote if None
+        (see load_dataset.load_processed)
+    cache_size
+        results kept in the least recently used cache
+    """
+
+    def __init__(self, df=None, path=None, cache_size=QUERY_CACHE_SIZE):
+        if df is None:
+            df = load_processed(path)
+        else:
+            df = md.typed_processed(df)
+        self.df = df.reset_index(drop=True)
+        self.indexes = {column: self.df.groupby(
+                column, sort=False, observed=True).indices
+                for column in INDEXED_COLUMNS}
+        self.indexes['tile'] = self.df.groupby(
+                ['x', 'y'], sort=False, observed=True).indices
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, column, values):
+        """ Gives the rows holding any of the values through an index
+
+        Parameters
+        ----------
+        column
+            one of INDEXED_COLUMNS or tile
+        values
+            value, or list of values (a tile is an (x, y) tuple)
+
+        Returns
+        -------
+        numpy.ndarray
+            sorted row positions
+        """
+        index = self.indexes[column]
+        single = (isinstance(values, tuple) if column == 'tile'
+                  else not isinstance(values, (list, tuple, set)))
+        if single:
+            values = [values]
+        found = [index[value] for value in values if value in index]
+        if not found:
+            return(np.zeros(0, dtype=np.int64))
+        if len(found) == 1:
+            return(found[0])
+        return(np.sort(np.concatenate(found)))
+
+    def positions(self, filters, between=None):
+        """ Gives the rows matching every filter
+
+        Parameters
+        ----------
+        filters
+            indexed column (or tile) to value or list of values
+        between
+            column to (low, high) inclusive bounds, None for no bound,
+            checked on the indexed matches only
+
+        Returns
+        -------
+        numpy.ndarray
+            sorted row positions
+        """
+        unknown = set(filters) - set(self.indexes)
+        if unknown:
+            raise ValueError("Not indexed columns: {}".format(
+                    ', '.join(sorted(unknown))))
+
+        # Intersect the smallest position arrays first
+
+        matches = sorted((self.lookup(column, values)
+                          for column, values in filters.items()), key=len)
+        rows = matches[0] if matches else np.arange(len(self.df))
+        for match in matches[1:]:
+            rows = np.intersect1d(rows, match, assume_unique=True)
+
+        for column, (low, high) in (between or {}).items():
+            values = self.df[column].values[rows]
+            keep = np.ones(len(rows), dtype=bool)
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+            rows = rows[keep]
+        return(rows)
+
+    def memo(self, key, compute):
+        """ Gives a memoised result, computing and storing it on a miss (the
+        least recently used result is evicted past cache_size)
+
+        Parameters
+        ----------
+        key
+            hashable request key
+        compute
+            function computing the result
+
+        Returns
+        -------
+        pandas.core.frame.DataFrame
+            result, shared with later hits so do not change it (copy it
+            first)
+        """
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+        else:
+            self.misses += 1
+            self.cache[key] = compute()
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return(self.cache[key])
+
+    def select(self, columns=None, between=None, **filters):
+        """ Gives the final dataset rows matching the filters, for instance
+        select(eventName='Render', hostname=host)
+
+        Parameters
+        ----------
+        columns
+            list of columns to keep, all columns if None
+        between
+            column to (low, high) inclusive bounds (see positions)
+        filters
+            indexed column (or tile) to value or list of values
+
+        Returns
+        -------
+        pandas.core.frame.DataFrame
+            matching rows in dataset order (memoised, do not change it)
+        """
+        key = ('select', freeze(columns), freeze(between), freeze(filters))
+
+        def compute():
+            selected_df = self.df.iloc[self.positions(filters, between)]
+            if columns is not None:
+                selected_df = selected_df[list(columns)]
+            return(selected_df)
+
+        return(self.memo(key, compute))
+
+    def aggregate(self, by, metrics=None, functions='mean', between=None,
+                  **filters):
+        """ Groups the rows matching the filters, for instance
+        aggregate('eventName', ['gpuTempC'], 'median', level=12)
+
+        Parameters
+        ----------
+        by
+            column or list of columns to group by
+        metrics
+            list of columns to aggregate, gpu metrics if None
+        functions
+            aggregation function name(s) (pandas agg)
+        between
+            column to (low, high) inclusive bounds (see positions)
+        filters
+            indexed column (or tile) to value or list of values
+
+        Returns
+        -------
+        pandas.core.frame.DataFrame
+            one row per group (memoised, do not change it)
+        """
+        metrics = metrics or GPU_METRICS
+        key = ('aggregate', freeze(by), freeze(metrics), freeze(functions),
+               freeze(between), freeze(filters))
+
+        def compute():
+            selected_df = self.df.iloc[self.positions(filters, between)]
+            return(selected_df.groupby(by, sort=True, observed=True)[
+                    list(metrics)].agg(functions))
+
+        return(self.memo(key, compute))
+
+    def cache_info(self):
+        """ Gives the memo statistics
+
+        Returns
+        -------
+        dict
+            hits, misses, size and maxsize (like functools.lru_cache)
+        """
+        return({'hits': self.hits, 'misses': self.misses,
+                'size': len(self.cache), 'maxsize': self.cache_size})
@@ -0,0 +1,279 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the multi resolution gpu
+rollups. gpu samples are pre-aggregated per hostname and gpuUUID into time
+buckets of every resolution of RESOLUTIONS (count, sum, min and max of each
+gpu metric), the finest resolution from the samples and every coarser one
+from the previous resolution. Rollups are stored sorted by bucket so a range
+is two binary searches away, and queries use the coarsest resolution whose
+buckets fit the range, so questions about a whole run never scan gpu.csv.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data.instrumentation import instrumented
+from src.data.interval_join import GPU_METRICS, to_epoch_ns
+
+RESOLUTIONS = [('1s', 1), ('10s', 10), ('1min', 60), ('10min', 600)]
+"""
+list: (name, bucket seconds) of every rollup, finest first, every bucket
+size a multiple of the previous one
+"""
+
+ROLLUP_KEYS = ['hostname', 'gpuUUID']
+"""
+list: columns every rollup is grouped by (besides the bucket)
+"""
+
+STATS = ['count', 'sum', 'min', 'max']
+"""
+list: statistics kept for every gpu metric, count skips missing readings
+"""
+
+def rollup_file(directory, name):
+    """ Gives the file location of a rollup
+
+    Parameters
+    ----------
+    directory
+        rollups directory
+    name
+        resolution name (see RESOLUTIONS)
+
+    Returns
+    -------
+    str
+        parquet file location
+    """
+    return(os.path.join(str(directory), 'gpu_' + name + '.parquet'))
+
+def stat_columns(metrics=GPU_METRICS):
+    """ Gives the statistic columns of the metrics
+
+    Parameters
+    ----------
+    metrics
+        gpu metric columns
+
+    Returns
+    -------
+    list
+        <metric>_<stat> column names
+    """
+    return([metric + '_' + stat for metric in metrics for stat in STATS])
+
+def stat_functions(metrics=GPU_METRICS):
+    """ Gives the functions merging statistic columns of finer buckets
+
+    Parameters
+    ----------
+    metrics
+        gpu metric columns
+
+    Returns
+    -------
+    dict
+        statistic column to aggregation function name
+    """
+    return({column: 'sum' if column.endswith(('_count', '_sum'))
+            else column.rsplit('_', 1)[1]
+            for column in stat_columns(metrics)})
+
+def bucket_rows(df, bucket_ns, functions):
+    """ Groups rows into buckets per ROLLUP_KEYS, sorted by bucket then keys
+
+    Parameters
+    ----------
+    df
+        dataframe with ROLLUP_KEYS, a time column and the aggregated columns
+    bucket_ns
+        bucket size in nanoseconds
+    functions
+        column to aggregation function name, or column to list of function
+        names giving <column>_<function> columns
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        ROLLUP_KEYS, bucket start time and aggregated columns
+    """
+    buckets = (to_epoch_ns(df['time']) // bucket_ns * bucket_ns).astype(
+            'datetime64[ns]')
+    rollup_df = df.groupby([buckets] + [df[key] for key in ROLLUP_KEYS],
+                           sort=True, observed=True).agg(functions)
+    rollup_df.columns = ['_'.join(column) if isinstance(column, tuple)
+                         else column for column in rollup_df.columns]
+    rollup_df.index.names = ['bucket'] + ROLLUP_KEYS
+    rollup_df = rollup_df.astype(np.float64).reset_index()
+    return(rollup_df[ROLLUP_KEYS + ['bucket'] + stat_columns()])
+
+@instrumented
+def build_rollups(gpu_df):
+    """ Builds the rollups of every resolution (see module introduction)
+
+    Parameters
+    ----------
+    gpu_df
+        gpu dataframe (typed or cleaned)
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        every rollup with a resolution column, one row per resolution,
+        bucket, hostname and gpuUUID
+    """
+    rows_df = gpu_df[ROLLUP_KEYS + GPU_METRICS].assign(
+            time=gpu_df['timestamp'].values)
+    functions = dict.fromkeys(GPU_METRICS, STATS)
+
+    # Samples feed the finest rollup, each rollup feeds the next one
+
+    rollup_dfs = []
+    for name, seconds in RESOLUTIONS:
+        rollup_df = bucket_rows(rows_df, int(seconds * 1e9), functions)
+        rollup_dfs.append(rollup_df.assign(resolution=name))
+        rows_df = rollup_df.rename(columns={'bucket': 'time'})
+        functions = stat_functions()
+
+    rollups_df = pd.concat(rollup_dfs, ignore_index=True)
+    rollups_df['resolution'] = pd.Categorical(
+            rollups_df['resolution'],
+            categories=[name for name, _ in RESOLUTIONS])
+    return(rollups_df[['resolution'] + ROLLUP_KEYS + ['bucket'] +
+                      stat_columns()])
+
+def write_rollups(rollups_df, directory=md.ROLLUP_DIR):
+    """ Writes every rollup to its own parquet file
+
+    Parameters
+    ----------
+    rollups_df
+        rollups (see build_rollups)
+    directory
+        rollups directory, created if missing
+    """
+    os.makedirs(str(directory), exist_ok=True)
+    for name, rollup_df in rollups_df.groupby('resolution', sort=False,
+                                              observed=True):
+        rollup_df = rollup_df.drop(columns='resolution').reset_index(
+                drop=True)
+        for key in ROLLUP_KEYS:
+            rollup_df[key] = rollup_df[key].astype('category')
+        rollup_df.to_parquet(rollup_file(directory, name), index=False)
+
+def load_rollups(directory=md.ROLLUP_DIR):
+    """ Loads the rollups found in a directory
+
+    Parameters
+    ----------
+    directory
+        rollups directory
+
+    Returns
+    -------
+    dict
+        resolution name to rollup dataframe sorted by bucket
+    """
+    return({name: pd.read_parquet(rollup_file(directory, name))
+            for name, _ in RESOLUTIONS
+            if os.path.exists(rollup_file(directory, name))})
+
+def query_resolution(rollups, start, stop, step=None):
+    """ Chooses the coarsest rollup whose buckets fit a range: start, stop
+    and step must all be multiples of its bucket size (the finest rollup
+    is used when none fits, covering the buckets starting in the range)
+
+    Parameters
+    ----------
+    rollups
+        resolution name to rollup dataframe (see load_rollups)
+    start
+        range start
+    stop
+        range stop (excluded)
+    step
+        output bucket size in seconds, None for the whole range
+
+    Returns
+    -------
+    str
+        resolution name
+    """
+    available = [(name, seconds) for name, seconds in RESOLUTIONS
+                 if name in rollups]
+    if not available:
+        raise ValueError("No rollups to query")
+    bounds_ns = [pd.Timestamp(start).value, pd.Timestamp(stop).value]
+    if step is not None:
+        bounds_ns.append(int(step * 1e9))
+    chosen = available[0][0]
+    for name, seconds in available:
+        if all(bound % int(seconds * 1e9) == 0 for bound in bounds_ns):
+            chosen = name
+    return(chosen)
+
+def query_rollups(rollups, start, stop, step=None, by=('hostname',),
+                  metrics=GPU_METRICS):
+    """ Aggregates gpu metrics over [start, stop) from the coarsest rollup
+    that fits (see query_resolution)
+
+    Parameters
+    ----------
+    rollups
+        resolution name to rollup dataframe (see load_rollups)
+    start
+        range start (timestamp or string)
+    stop
+        range stop, excluded (timestamp or string)
+    step
+        output bucket size in seconds, None aggregates the whole range
+        (buckets are aligned on the epoch like the rollups)
+    by
+        ROLLUP_KEYS columns to group by
+    metrics
+        gpu metric columns
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        by columns, bucket (when step is set) and the count, sum, min, max
+        and mean of every metric
+    """
+    rollup_df = rollups[query_resolution(rollups, start, stop, step)]
+
+    # Rollups are sorted by bucket, the range is a slice
+
+    buckets = rollup_df['bucket'].values
+    lo, hi = np.searchsorted(buckets, np.array(
+            [pd.Timestamp(start).value, pd.Timestamp(stop).value],
+            dtype='datetime64[ns]'))
+    range_df = rollup_df.iloc[lo:hi]
+
+    keys = list(by)
+    if step is not None:
+        step_ns = int(step * 1e9)
+        range_df = range_df.assign(bucket=(
+                to_epoch_ns(range_df['bucket']) // step_ns *
+                step_ns).astype('datetime64[ns]'))
+        keys.append('bucket')
+
+    functions = stat_functions(metrics)
+    if keys:
+        result_df = range_df.groupby(keys, sort=True, observed=True).agg(
+                functions).reset_index()
+    else:
+        result_df = range_df[list(functions)].agg(functions).to_frame().T
+    for metric in metrics:
+        result_df[metric + '_mean'] = (
+                result_df[metric + '_sum'] /
+                result_df[metric + '_count'].where(
+                        result_df[metric + '_count'] > 0))
+    return(result_df)
@@ -0,0 +1,194 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the gpu sample store. gpu
+samples are written once as per host, time sorted numpy arrays (one .npy
+file per column, hosts laid end to end) with a small json index of every
+host's offsets. Arrays are opened memory-mapped, so fetching the samples of
+a (hostname, start, stop) range is two binary searches and a zero-copy
+slice. The store is an export for range lookups, builds still join the gpu
+samples of the stage cache (see src.data.interval_join).
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import json
+import os
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data.instrumentation import instrumented
+from src.data.interval_join import GPU_METRICS, to_epoch_ns
+
+INDEX_FILE = 'index.json'
+"""
+str: name of the store index file, written last
+"""
+
+def column_file(directory, column):
+    """ Gives the file location of a store column
+
+    Parameters
+    ----------
+    directory
+        store directory
+    column
+        column name (time, gpuUUID or a gpu metric)
+
+    Returns
+    -------
+    str
+        npy file location
+    """
+    return(os.path.join(str(directory), column + '.npy'))
+
+@instrumented
+def write_store(gpu_df, directory=md.SAMPLE_STORE_DIR):
+    """ Writes gpu samples sorted by host then time (stable, ties keep file
+    order) as a sample store
+
+    Parameters
+    ----------
+    gpu_df
+        gpu dataframe (typed or cleaned)
+    directory
+        store directory, created if missing
+    """
+    os.makedirs(str(directory), exist_ok=True)
+    hostnames = np.asarray(gpu_df['hostname'].astype(str))
+    times = to_epoch_ns(gpu_df['timestamp'])
+    order = np.lexsort((np.arange(len(times)), times, hostnames))
+
+    hosts, begins, sizes = np.unique(hostnames[order], return_index=True,
+                                     return_counts=True)
+    uuid_codes, uuids = pd.factorize(gpu_df['gpuUUID'].astype(str))
+
+    np.save(column_file(directory, 'time'), times[order])
+    np.save(column_file(directory, 'gpuUUID'),
+            uuid_codes[order].astype(np.int32))
+    for metric in GPU_METRICS:
+        np.save(column_file(directory, metric),
+                gpu_df[metric].to_numpy()[order])
+
+    # The index goes last so a half written store is never opened
+
+    index = {'hosts': {host: [int(begin), int(begin + size)]
+                       for host, begin, size in zip(hosts, begins, sizes)},
+             'uuids': [str(uuid) for uuid in uuids],
+             'metrics': GPU_METRICS}
+    with open(os.path.join(str(directory), INDEX_FILE), 'w') as json_file:
+        json.dump(index, json_file)
+
+class SampleStore(object):
+    """ Memory-mapped reader of a sample store (see write_store)
+
+    Parameters
+    ----------
+    directory
+        store directory
+    """
+
+    def __init__(self, directory=md.SAMPLE_STORE_DIR):
+        with open(os.path.join(str(directory), INDEX_FILE)) as json_file:
+            index = json.load(json_file)
+        self.hosts = {host: tuple(bounds)
+                      for host, bounds in index['hosts'].items()}
+        self.uuids = np.array(index['uuids'], dtype=object)
+        self.metrics = index['metrics']
+        self.columns = {column: np.load(column_file(directory, column),
+                                        mmap_mode='r')
+                        for column in ['time', 'gpuUUID'] + self.metrics}
+
+    def __len__(self):
+        return(len(self.columns['time']))
+
+    def bounds(self, hostname, start=None, stop=None):
+        """ Locates the samples of a host between two times with two binary
+        searches
+
+        Parameters
+        ----------
+        hostname
+            host name
+        start
+            first time (inclusive), host start if None
+        stop
+            last time (inclusive), host end if None
+
+        Returns
+        -------
+        tuple
+            (lo, hi) store positions, lo == hi when there is no sample
+        """
+        begin, end = self.hosts.get(hostname, (0, 0))
+        times = self.columns['time'][begin:end]
+        lo = 0 if start is None else np.searchsorted(
+                times, pd.Timestamp(start).value, side='left')
+        hi = len(times) if stop is None else np.searchsorted(
+                times, pd.Timestamp(stop).value, side='right')
+        return(begin + int(lo), begin + int(max(hi, lo)))
+
+    def samples(self, hostname, start=None, stop=None):
+        """ Gives the samples of a host between two times without copying
+
+        Parameters
+        ----------
+        hostname
+            host name
+        start
+            first time (inclusive), host start if None
+        stop
+            last time (inclusive), host end if None
+
+        Returns
+        -------
+        dict
+            column name to memory-mapped array slice, time as int64
+            nanoseconds and gpuUUID as codes into uuids
+        """
+        lo, hi = self.bounds(hostname, start, stop)
+        return({column: values[lo:hi]
+                for column, values in self.columns.items()})
+
+    def frame(self, hostname, start=None, stop=None):
+        """ Gives the samples of a host between two times as a gpu dataframe
+        (copied out of the store)
+
+        Parameters
+        ----------
+        hostname
+            host name
+        start
+            first time (inclusive), host start if None
+        stop
+            last time (inclusive), host end if None
+
+        Returns
+        -------
+        pandas.core.frame.DataFrame
+            cleaned gpu dataframe of the samples, sorted by time
+        """
+        samples = self.samples(hostname, start, stop)
+        gpu_df = pd.DataFrame({
+            'timestamp': np.array(samples['time']).astype('datetime64[ns]'),
+            'hostname': hostname,
+            'gpuUUID': self.uuids[samples['gpuUUID']]})
+        for metric in self.metrics:
+            gpu_df[metric] = np.array(samples[metric])
+        return(gpu_df)
+
+    def time_range(self):
+        """ Gives the first and last sample times of the store
+
+        Returns
+        -------
+        tuple
+            (first, last) timestamps
+        """
+        times = self.columns['time']
+        firsts = [times[begin] for begin, end in self.hosts.values()]
+        lasts = [times[end - 1] for begin, end in self.hosts.values()]
+        return(pd.Timestamp(min(firsts)), pd.Timestamp(max(lasts)))
@@ -0,0 +1,240 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the conditional split
+analysis of the final dataset: how task durations change when a gpu metric
+is above or below some of its quantiles (for instance Render times above and
+below the median temperature). Every metric is cut into buckets at its
+quantiles (found with np.partition, no full sort), the rows of every metric
+are given a (metric, bucket, eventName) group code and all the groups of all
+the metrics are sorted by code and duration together, once. Every group
+distribution is then a slice of one sorted array and its statistics come
+from reduceat and position lookups, so a sweep over many metrics and cut
+points is one call instead of two masked frames and a groupby per split.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data.interval_join import GPU_METRICS
+
+SPLIT_QUANTILES = (0.5,)
+"""
+tuple: default cut points, the median splits rows into below or equal and
+above
+"""
+
+SUMMARY_QUANTILES = [('q1', 0.25), ('median', 0.5), ('q3', 0.75)]
+"""
+list: (column, quantile) of the durations given by describe_splits
+"""
+
+def cut_points(values, quantiles):
+    """ Gives quantiles of values by partitioning, with the linear
+    interpolation of numpy.quantile (the median equals statistics.median)
+
+    Parameters
+    ----------
+    values
+        numpy array without nan
+    quantiles
+        list of quantiles between 0 and 1
+
+    Returns
+    -------
+    numpy.ndarray
+        value of every quantile, nan when values is empty
+    """
+    quantiles = np.asarray(quantiles, dtype=np.float64)
+    if not len(values):
+        return(np.full(len(quantiles), np.nan))
+    positions = quantiles * (len(values) - 1)
+    low = np.floor(positions).astype(np.int64)
+    high = np.ceil(positions).astype(np.int64)
+    parted = np.partition(values, np.unique(np.concatenate([low, high])))
+    return(parted[low] + (parted[high] - parted[low]) * (positions - low))
+
+def sorted_quantiles(values, starts, counts, quantile):
+    """ Gives a quantile of every group of a grouped, sorted array
+
+    Parameters
+    ----------
+    values
+        numpy array sorted within every group
+    starts
+        first position of every group
+    counts
+        size of every group (1 or more)
+    quantile
+        quantile between 0 and 1
+
+    Returns
+    -------
+    numpy.ndarray
+        quantile of every group (numpy.quantile linear interpolation)
+    """
+    positions = quantile * (counts - 1)
+    low = np.floor(positions).astype(np.int64)
+    high = np.ceil(positions).astype(np.int64)
+    return(values[starts + low] + (values[starts + high] -
+                                   values[starts + low]) * (positions - low))
+
+def sorted_splits(df, metrics=GPU_METRICS, quantiles=SPLIT_QUANTILES,
+                  events=None):
+    """ Groups task durations by metric, bucket and eventName in one sort
+    (see module introduction)
+
+    Parameters
+    ----------
+    df
+        final dataset
+    metrics
+        list of gpu metric columns split
+    quantiles
+        list of quantiles cutting every metric, len(quantiles) + 1 buckets,
+        bucket b holds readings above cut b - 1 and below or equal to cut b
+    events
+        list of eventName kept, every event if None (cut points are
+        quantiles of every event)
+
+    Returns
+    -------
+    dict
+        groups (DataFrame of metric, bucket, eventName, cut_low, cut_high,
+        start and count), durations (seconds, sorted within every group)
+        and cuts (metric to cut points)
+    """
+    quantiles = sorted(quantiles)
+    if any(not 0 <= quantile <= 1 for quantile in quantiles):
+        raise ValueError("Quantiles must be between 0 and 1: {}".format(
+                quantiles))
+    missing = set(metrics) - set(df.columns)
+    if missing:
+        raise ValueError("Unknown metrics: {}".format(
+                ', '.join(sorted(missing))))
+
+    # Cut points come from every event, like the medians of the notebooks
+
+    cuts = {}
+    for metric in metrics:
+        values = df[metric].values.astype(np.float64)
+        cuts[metric] = cut_points(values[~np.isnan(values)], quantiles)
+    if events is not None:
+        df = df[df['eventName'].astype(str).isin(events)]
+    times_df = md.typed_processed(df[md.TIME_COLUMNS])
+    durations = ((times_df['stop_time'].values -
+                  times_df['start_time'].values) / np.timedelta64(1, 's'))
+    event_codes, event_names = pd.factorize(df['eventName'].astype(str),
+                                            sort=True)
+
+    # Rows of every metric get a (metric, bucket, event) code, rows without
+    # a reading are dropped
+
+    n_buckets, n_events = len(quantiles) + 1, len(event_names)
+    codes, rows = [], []
+    for n, metric in enumerate(metrics):
+        values = df[metric].values.astype(np.float64)
+        present = np.flatnonzero(~np.isnan(values))
+        buckets = np.searchsorted(cuts[metric], values[present], side='left')
+        codes.append((n * n_buckets + buckets) * n_events +
+                     event_codes[present])
+        rows.append(present)
+    codes = np.concatenate(codes) if codes else np.zeros(0, np.int64)
+    rows = np.concatenate(rows) if rows else np.zeros(0, np.int64)
+
+    order = np.lexsort((durations[rows], codes))
+    codes, sorted_durations = codes[order], durations[rows][order]
+    group_codes, starts, counts = np.unique(codes, return_index=True,
+                                            return_counts=True)
+
+    metric_codes, rest = np.divmod(group_codes, n_buckets * n_events)
+    buckets, group_events = np.divmod(rest, n_events)
+    bounds = {metric: np.concatenate([[-np.inf], cuts[metric], [np.inf]])
+              for metric in metrics}
+    group_metrics = np.asarray(metrics, dtype=object)[metric_codes]
+    groups_df = pd.DataFrame({
+            'metric': group_metrics,
+            'bucket': buckets,
+            'eventName': np.asarray(event_names, dtype=object)[group_events],
+            'cut_low': [bounds[metric][bucket] for metric, bucket in
+                        zip(group_metrics, buckets)],
+            'cut_high': [bounds[metric][bucket + 1] for metric, bucket in
+                         zip(group_metrics, buckets)],
+            'start': starts, 'count': counts})
+    return({'groups': groups_df, 'durations': sorted_durations,
+            'cuts': cuts})
+
+def split_durations(df, metrics=GPU_METRICS, quantiles=SPLIT_QUANTILES,
+                    events=None):
+    """ Gives the task duration distribution of every metric, bucket and
+    eventName, for instance split_durations(df, ['gpuTempC'],
+    events=['Render']) gives the Render times below or equal to and above
+    the median temperature
+
+    Parameters
+    ----------
+    df
+        final dataset
+    metrics
+        list of gpu metric columns split
+    quantiles
+        list of quantiles cutting every metric (see sorted_splits)
+    events
+        list of eventName kept, every event if None
+
+    Returns
+    -------
+    dict
+        (metric, bucket, eventName) to sorted durations in seconds (views
+        of one array, do not change them), groups without rows are left out
+    """
+    splits = sorted_splits(df, metrics, quantiles, events)
+    groups_df, durations = splits['groups'], splits['durations']
+    return({(metric, bucket, event): durations[start:start + count]
+            for metric, bucket, event, start, count in zip(
+                    groups_df['metric'], groups_df['bucket'],
+                    groups_df['eventName'], groups_df['start'],
+                    groups_df['count'])})
+
+def describe_splits(df, metrics=GPU_METRICS, quantiles=SPLIT_QUANTILES,
+                    events=None):
+    """ Summarises the task duration distribution of every metric, bucket
+    and eventName (a sensitivity sweep over metrics and cut points)
+
+    Parameters
+    ----------
+    df
+        final dataset
+    metrics
+        list of gpu metric columns split
+    quantiles
+        list of quantiles cutting every metric (see sorted_splits)
+    events
+        list of eventName kept, every event if None
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        one row per (metric, bucket, eventName) with the bucket bounds
+        (cut_low excluded, cut_high included) and count, mean, min,
+        SUMMARY_QUANTILES and max of the durations in seconds
+    """
+    splits = sorted_splits(df, metrics, quantiles, events)
+    groups_df, durations = splits['groups'], splits['durations']
+    starts = groups_df['start'].values
+    counts = groups_df['count'].values
+
+    summary_df = groups_df.drop(columns=['start'])
+    summary_df['mean'] = (np.add.reduceat(durations, starts) / counts
+                          if len(starts) else np.zeros(0))
+    summary_df['min'] = durations[starts]
+    for column, quantile in SUMMARY_QUANTILES:
+        summary_df[column] = sorted_quantiles(durations, starts, counts,
+                                              quantile)
+    summary_df['max'] = durations[starts + counts - 1]
+    return(summary_df.set_index(['metric', 'bucket', 'eventName']))
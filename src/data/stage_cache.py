@@ -0,0 +1,422 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the stage cache of the data
+preparation process. clean_gpu, merge_check_task, clean_check_task and
+merge_check_task_gpu are pure functions of their inputs, so their outputs
+are stored in data/interim under a key made of the stage name, the hashes
+of the raw csv files (or the keys of the stages they read) and the code
+version. A run or a test whose inputs did not change loads the stage output
+instead of recomputing it. The least recently used outputs are evicted when
+the cache grows over its size limit.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import threading
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import interval_join, ingest, pairing, features, rollups
+from src.data.graph import run_graph
+from src.data.ingest import (raw_parts, read_gpu, read_checkpoints,
+                             read_tasks)
+
+BASE_INTERIM_DATA_DIR = 'data/interim'
+"""
+str: Base interim data directory, where the stage cache lives
+"""
+
+CACHE_MAX_BYTES = 4 << 30
+"""
+int: default stage cache size limit in bytes (4 GiB)
+"""
+
+CACHE_SUFFIX = '.pkl'
+"""
+str: stage output file suffix (pandas pickle, exact dtypes and fast to load)
+"""
+
+HASH_BLOCK_BYTES = 1 << 24
+"""
+int: bytes read at a time when hashing raw files
+"""
+
+CACHED_STAGES = ['clean_gpu', 'merge_check_task', 'clean_check_task',
+                 'merge_check_task_gpu', 'check_task_features']
+"""
+list: stages cached_stages can run up to, in pipeline order
+"""
+
+CODE_MODULES = [md, interval_join, ingest, pairing, features, rollups]
+"""
+list: modules whose source is part of every cache key
+"""
+
+def code_version():
+    """ Hashes the source of the stage modules and the pandas version, any
+    code change gives new keys
+
+    Returns
+    -------
+    str
+        sha1 hex digest
+    """
+    digest = hashlib.sha1(pd.__version__.encode())
+    for module in CODE_MODULES:
+        with open(module.__file__, 'rb') as source_file:
+            digest.update(source_file.read())
+    return(digest.hexdigest())
+
+class StageCache(object):
+    """ Content addressed, size bounded on disk cache of stage outputs
+
+    Parameters
+    ----------
+    directory
+        cache directory
+    max_bytes
+        size limit, least recently used outputs are evicted past it
+    """
+
+    def __init__(self, directory=BASE_INTERIM_DATA_DIR,
+                 max_bytes=CACHE_MAX_BYTES):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.code = code_version()
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.RLock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def file_hash(self, path):
+        """ Hashes a raw file, the hash is remembered against the file size
+        and modification time so unchanged files are only read once
+
+        Parameters
+        ----------
+        path
+            file location
+
+        Returns
+        -------
+        str
+            sha1 hex digest of the file content (of the part digests for
+            multi-part files, see src.data.ingest.raw_parts)
+        """
+        parts = raw_parts(path)
+        if len(parts) > 1:
+            digest = hashlib.sha1()
+            for part in parts:
+                digest.update(self.file_hash(part).encode())
+            return(digest.hexdigest())
+        path = os.path.abspath(parts[0])
+        stat = os.stat(path)
+
+        # The hash index is shared by the stages run side by side
+
+        with self.lock:
+            index_file = os.path.join(self.directory, 'file_hashes.json')
+            index = {}
+            if os.path.exists(index_file):
+                with open(index_file) as json_file:
+                    index = json.load(json_file)
+
+            entry = index.get(path)
+            if entry and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+                return(entry[2])
+
+            digest = hashlib.sha1()
+            with open(path, 'rb') as raw_file:
+                for block in iter(lambda: raw_file.read(HASH_BLOCK_BYTES),
+                                  b''):
+                    digest.update(block)
+            index[path] = [stat.st_size, stat.st_mtime_ns,
+                           digest.hexdigest()]
+            self.write_atomic(index_file, json.dumps(index).encode())
+            return(index[path][2])
+
+    def key(self, stage, inputs, **params):
+        """ Builds the key of a stage output
+
+        Parameters
+        ----------
+        stage
+            stage (function) name
+        inputs
+            hashes of the raw files or keys of the stages read
+        params
+            stage keyword arguments
+
+        Returns
+        -------
+        str
+            sha1 hex digest
+        """
+        description = json.dumps([stage, self.code, list(inputs), params],
+                                 sort_keys=True, default=str)
+        return(hashlib.sha1(description.encode()).hexdigest())
+
+    def path(self, key):
+        """ Gives the file location of a stage output
+
+        Parameters
+        ----------
+        key
+            stage output key
+
+        Returns
+        -------
+        str
+            file location
+        """
+        return(os.path.join(self.directory, key + CACHE_SUFFIX))
+
+    def get(self, key):
+        """ Loads a stage output and marks it as recently used
+
+        Parameters
+        ----------
+        key
+            stage output key
+
+        Returns
+        -------
+        pandas.core.frame.DataFrame or None
+            stage output, None on a miss
+        """
+        path = self.path(key)
+        try:
+            df = pd.read_pickle(path)
+        except (OSError, EOFError, ValueError):
+            return(None)
+        os.utime(path)
+        return(df)
+
+    def put(self, key, df):
+        """ Stores a stage output then evicts past the size limit
+
+        Parameters
+        ----------
+        key
+            stage output key
+        df
+            stage output
+        """
+        temp = self.path(key) + '.tmp'
+        df.to_pickle(temp)
+        with self.lock:
+            os.replace(temp, self.path(key))
+            self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """ Deletes the least recently used outputs until the cache fits
+        its size limit
+
+        Parameters
+        ----------
+        keep
+            key never evicted (the output just stored)
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_SUFFIX):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(entry[1] for entry in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == str(keep) + CACHE_SUFFIX:
+                continue
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+            self.logger.info('evicted %s (%d bytes)', name, size)
+
+    def write_atomic(self, path, data):
+        """ Writes a file through a temporary file and a rename
+
+        Parameters
+        ----------
+        path
+            file location
+        data
+            bytes to write
+        """
+        with open(path + '.tmp', 'wb') as out_file:
+            out_file.write(data)
+        os.replace(path + '.tmp', path)
+
+    def run(self, stage, func, inputs, *args, **params):
+        """ Loads a stage output, or runs the stage and stores its output
+
+        Parameters
+        ----------
+        stage
+            stage name
+        func
+            function computing the output from args
+        inputs
+            hashes or keys the output depends on
+        args
+            positional arguments of func, or functions giving them (only
+            called on a miss, so cached upstream stages are not loaded,
+            and called concurrently, see src.data.graph)
+        params
+            keyword arguments of func, part of the key
+
+        Returns
+        -------
+        tuple
+            (stage output, key)
+        """
+        key = self.key(stage, inputs, **params)
+        df = self.get(key)
+        if df is not None:
+            self.logger.info('%s loaded from cache', stage)
+            return(df, key)
+        graph = {position: (arg, []) for position, arg in enumerate(args)
+                 if callable(arg)}
+        outputs = run_graph(graph) if len(graph) > 1 else {
+                position: func() for position, (func, _) in graph.items()}
+        args = [outputs.get(position, arg)
+                for position, arg in enumerate(args)]
+        df = func(*args, **params)
+        self.put(key, df)
+        return(df, key)
+
+def cached_check_task(cache, check_csv_file, task_csv_file):
+    """ merge_check_task over the raw files through the cache
+
+    Parameters
+    ----------
+    cache
+        StageCache
+    check_csv_file
+        application-checkpoints.csv file location
+    task_csv_file
+        task-x-y.csv file location
+
+    Returns
+    -------
+    tuple
+        (application checkpoints and tasks merged dataframe, key)
+    """
+    return(cache.run(
+            'merge_check_task', md.merge_check_task,
+            [cache.file_hash(check_csv_file), cache.file_hash(task_csv_file)],
+            lambda: read_checkpoints(check_csv_file),
+            lambda: read_tasks(task_csv_file)))
+
+def cached_stages(gpu_csv_file, check_csv_file, task_csv_file, cache=None,
+                  stage='merge_check_task_gpu', features=False):
+    """ Runs clean_gpu, merge_check_task, clean_check_task and
+    merge_check_task_gpu (or check_task_features) through the cache,
+    upstream stages are only loaded or computed when a later stage misses
+    (the final dataset and feature table come from one join when either
+    misses)
+
+    Parameters
+    ----------
+    gpu_csv_file
+        gpu.csv file location
+    check_csv_file
+        application-checkpoints.csv file location
+    task_csv_file
+        task-x-y.csv file location
+    cache
+        StageCache, default one in BASE_INTERIM_DATA_DIR if None
+    stage
+        last stage, one of CACHED_STAGES (a build stopped early resumes
+        from the stored outputs)
+    features
+        give the per task feature table with the final dataset
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame or tuple
+        application, tasks and gpu final merged dataframe, per task
+        feature table, or output of the earlier stage asked for, (final
+        dataset, feature table) when features is set
+    """
+    if stage not in CACHED_STAGES:
+        raise ValueError("Unrecognized stage: {}".format(stage))
+    cache = cache or StageCache()
+    gpu_hash = cache.file_hash(gpu_csv_file)
+    check_hash = cache.file_hash(check_csv_file)
+    task_hash = cache.file_hash(task_csv_file)
+
+    # Keys chain, a stage key is built from the keys of the stages it reads
+
+    gpu_key = cache.key('clean_gpu', [gpu_hash])
+    check_task_key = cache.key('merge_check_task', [check_hash, task_hash])
+    clean_key = cache.key('clean_check_task', [check_task_key])
+
+    def clean_gpu():
+        return(cache.run('clean_gpu', md.clean_gpu, [gpu_hash],
+                         lambda: read_gpu(gpu_csv_file))[0])
+
+    def clean_check_task():
+        return(cache.run(
+                'clean_check_task', md.clean_check_task, [check_task_key],
+                lambda: cached_check_task(cache, check_csv_file,
+                                          task_csv_file)[0])[0])
+
+    if stage == 'clean_gpu':
+        return(clean_gpu())
+    if stage == 'merge_check_task':
+        return(cached_check_task(cache, check_csv_file, task_csv_file)[0])
+    if stage == 'clean_check_task':
+        return(clean_check_task())
+    if stage == 'merge_check_task_gpu' and not features:
+        return(cache.run(stage, md.merge_check_task_gpu,
+                         [gpu_key, clean_key], clean_gpu,
+                         clean_check_task)[0])
+
+    # The final dataset and feature table are stored apart, built together
+
+    keys = [cache.key(name, [gpu_key, clean_key]) for name in
+            ['merge_check_task_gpu', 'check_task_features']]
+    outputs = [cache.get(key) for key in keys]
+    if any(output is None for output in outputs):
+        outputs = run_graph({'clean_gpu': (clean_gpu, []),
+                             'clean_check_task': (clean_check_task, [])})
+        outputs = md.merge_check_task_gpu(outputs['clean_gpu'],
+                                          outputs['clean_check_task'],
+                                          features=True)
+        for key, output in zip(keys, outputs):
+            cache.put(key, output)
+    else:
+        cache.logger.info('%s loaded from cache', stage)
+    return(tuple(outputs) if features else outputs[-1])
+
+def cached_rollups(gpu_csv_file, cache=None):
+    """ Runs build_rollups (see src.data.rollups) over the cleaned gpu
+    dataframe through the cache
+
+    Parameters
+    ----------
+    gpu_csv_file
+        gpu.csv file location
+    cache
+        StageCache, default one in BASE_INTERIM_DATA_DIR if None
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        rollups of every resolution
+    """
+    cache = cache or StageCache()
+    gpu_hash = cache.file_hash(gpu_csv_file)
+
+    def clean_gpu():
+        return(cache.run('clean_gpu', md.clean_gpu, [gpu_hash],
+                         lambda: read_gpu(gpu_csv_file))[0])
+
+    return(cache.run('build_rollups', rollups.build_rollups,
+                     [cache.key('clean_gpu', [gpu_hash])], clean_gpu)[0])
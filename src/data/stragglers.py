@@ -0,0 +1,219 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the straggler and anomaly
+detection stage run on the final dataset. Every task duration and gpu
+metric average is scored against its peers (same eventName and level) with
+a robust z-score, (value - median) / (MAD_SCALE * MAD), so the tail being
+looked for does not inflate the spread it is measured with. Every duration
+is also compared with a rolling baseline of its host: the mean duration of
+the HOST_WINDOW previous tasks of the same host, eventName and level.
+
+Medians and MADs come from one sort of all the groups at once and the
+baselines from cumulative sums, so every task of a full run is scored with
+a few array operations. Tasks past a threshold are kept in a compact
+stragglers table, flagged slow, hot, underused or host_slow.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import numpy as np
+from src.data import make_dataset as md
+from src.data.instrumentation import instrumented
+from src.data.interval_join import GPU_METRICS, TASK_KEYS, to_epoch_ns
+from src.data.splits import sorted_quantiles
+
+PEER_GROUPS = ['eventName', 'level']
+"""
+list: columns grouping the tasks a task is scored against
+"""
+
+SCORED_COLUMNS = ['duration'] + GPU_METRICS
+"""
+list: columns given a robust z-score, duration is in seconds
+"""
+
+MAD_SCALE = 1.4826
+"""
+float: MAD scale factor making it estimate the standard deviation of normal
+data
+"""
+
+MEAN_AD_SCALE = 1.2533
+"""
+float: mean absolute deviation scale factor, used for groups whose MAD is 0
+(more than half the group shares the median)
+"""
+
+ROBUST_Z_THRESHOLD = 3.5
+"""
+float: robust z-score past which a task is flagged (Iglewicz and Hoaglin)
+"""
+
+HOST_WINDOW = 20
+"""
+int: previous tasks of the same host, eventName and level averaged into the
+host baseline
+"""
+
+HOST_RATIO_THRESHOLD = 2.0
+"""
+float: duration to host baseline ratio past which a task is flagged
+"""
+
+STRAGGLER_FLAGS = ['slow', 'hot', 'underused', 'host_slow']
+"""
+list: flag columns of the stragglers table, slow and host_slow on the
+duration, hot on gpuTempC and underused on gpuUtilPerc
+"""
+
+def robust_z(values, codes):
+    """ Scores values against the median and MAD of their group
+
+    Parameters
+    ----------
+    values
+        float numpy array, nan values are not scored
+    codes
+        group code of every value
+
+    Returns
+    -------
+    numpy.ndarray
+        robust z-scores, nan for nan values and 0 for groups without spread
+    """
+    z = np.full(len(values), np.nan)
+    present = np.flatnonzero(~np.isnan(values))
+    if not len(present):
+        return(z)
+
+    # Sort by group then value, every group is a slice
+
+    order = present[np.lexsort((values[present], codes[present]))]
+    sorted_values = values[order]
+    _, starts, counts = np.unique(codes[order], return_index=True,
+                                  return_counts=True)
+    groups = np.repeat(np.arange(len(starts)), counts)
+    medians = sorted_quantiles(sorted_values, starts, counts, 0.5)
+
+    deviations = np.abs(sorted_values - medians[groups])
+    sorted_deviations = deviations[np.lexsort((deviations, groups))]
+    mads = sorted_quantiles(sorted_deviations, starts, counts, 0.5)
+    mean_ads = np.add.reduceat(deviations, starts) / counts
+    scales = np.where(mads > 0, MAD_SCALE * mads, MEAN_AD_SCALE * mean_ads)
+
+    spread = scales[groups] > 0
+    z[order] = np.where(spread, (sorted_values - medians[groups]) /
+                        np.where(spread, scales[groups], 1), 0)
+    return(z)
+
+def host_baselines(durations, codes, starts, window=HOST_WINDOW):
+    """ Averages the durations of the previous tasks of the same group (a
+    host, eventName and level) in start time order
+
+    Parameters
+    ----------
+    durations
+        float numpy array of task durations
+    codes
+        group code of every task
+    starts
+        int64 task start times
+    window
+        previous tasks averaged
+
+    Returns
+    -------
+    numpy.ndarray
+        baseline of every task, nan for the first task of a group
+    """
+    order = np.lexsort((starts, codes))
+    _, group_starts, counts = np.unique(codes[order], return_index=True,
+                                        return_counts=True)
+    rank = np.arange(len(order)) - np.repeat(group_starts, counts)
+
+    # Window sums are differences of one cumulative sum
+
+    cumulative = np.concatenate([[0], np.cumsum(durations[order])])
+    ends = np.flatnonzero(rank > 0)
+    lows = ends - np.minimum(rank[ends], window)
+    baselines = np.full(len(order), np.nan)
+    baselines[order[ends]] = ((cumulative[ends] - cumulative[lows]) /
+                              (ends - lows))
+    return(baselines)
+
+def task_scores(df, window=HOST_WINDOW):
+    """ Scores every task of the final dataset (see module introduction)
+
+    Parameters
+    ----------
+    df
+        final dataset
+    window
+        previous tasks in the host baselines
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        TASK_KEYS, gpuUUID, start_time, duration, a _z column for every
+        SCORED_COLUMNS, host_baseline and host_ratio, in dataset order
+    """
+    times_df = md.typed_processed(df[md.TIME_COLUMNS])
+    scores_df = df[TASK_KEYS + ['gpuUUID']].reset_index(drop=True)
+    scores_df['start_time'] = times_df['start_time'].values
+    scores_df['duration'] = ((times_df['stop_time'].values -
+                              times_df['start_time'].values) /
+                             np.timedelta64(1, 's'))
+
+    peers = df.groupby(PEER_GROUPS, sort=False, observed=True).ngroup()
+    for column in SCORED_COLUMNS:
+        values = (scores_df['duration'].values if column == 'duration'
+                  else df[column].to_numpy(dtype=np.float64))
+        scores_df[column + '_z'] = robust_z(values, peers.values)
+
+    hosts = df.groupby(['hostname'] + PEER_GROUPS, sort=False,
+                       observed=True).ngroup()
+    scores_df['host_baseline'] = host_baselines(
+            scores_df['duration'].values, hosts.values,
+            to_epoch_ns(scores_df['start_time']), window)
+    scores_df['host_ratio'] = (scores_df['duration'] /
+                               scores_df['host_baseline'])
+    return(scores_df)
+
+@instrumented
+def find_stragglers(df, threshold=ROBUST_Z_THRESHOLD,
+                    host_ratio=HOST_RATIO_THRESHOLD, window=HOST_WINDOW):
+    """ Builds the stragglers table: the tasks slower than their peers or
+    host, or whose gpu ran hot or underused
+
+    Parameters
+    ----------
+    df
+        final dataset
+    threshold
+        robust z-score flagging a task
+    host_ratio
+        duration to host baseline ratio flagging a task
+    window
+        previous tasks in the host baselines
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        task_scores columns and STRAGGLER_FLAGS of the flagged tasks, most
+        extreme durations first
+    """
+    scores_df = task_scores(df, window)
+    scores_df['slow'] = scores_df['duration_z'] > threshold
+    scores_df['hot'] = scores_df['gpuTempC_z'] > threshold
+    scores_df['underused'] = scores_df['gpuUtilPerc_z'] < -threshold
+    scores_df['host_slow'] = scores_df['host_ratio'] > host_ratio
+
+    flagged = scores_df[STRAGGLER_FLAGS].any(axis=1)
+    stragglers_df = scores_df[flagged.values]
+    return(stragglers_df.sort_values('duration_z', ascending=False,
+                                     kind='mergesort')
+           .reset_index(drop=True))
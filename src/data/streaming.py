@@ -0,0 +1,381 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the streaming (chunked) data
+preparation process. gpu.csv is read in time ordered chunks, each chunk only
+touches the checkpoint intervals open during it and its samples are added to
+running per interval sums and counts. Tasks are written out as soon as every
+interval sharing their keys has closed, so gpu.csv is never fully in memory
+and only the intervals reached and not yet written out are accumulated.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import logging
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data.ingest import (GPU_SCHEMA, read_chunks, read_checkpoints,
+                             read_tasks)
+from src.data.interval_join import (GPU_METRICS, TASK_KEYS, to_epoch_ns,
+                                    interval_sums, aggregate_intervals)
+
+STREAM_CHUNK_ROWS = 500000
+"""
+int: gpu.csv rows read per chunk in streaming mode
+"""
+
+STREAM_FORMATS = ('csv', 'parquet')
+"""
+tuple: final dataset formats that can be appended to batch by batch
+"""
+
+def order_intervals(intervals_df):
+    """ Sorts paired intervals by the time their whole task group closes
+    (latest stop_time of the intervals sharing the same task keys)
+
+    Parameters
+    ----------
+    intervals_df
+        paired start/stop checkpoint and task dataframe
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        intervals with a group_stop column, sorted by it
+    """
+    intervals_df = intervals_df.reset_index(drop=True)
+    intervals_df['group_stop'] = intervals_df.groupby(
+            TASK_KEYS, sort=False)['stop_time'].transform('max').fillna(
+                    intervals_df['stop_time'])
+    return(intervals_df.sort_values('group_stop', kind='mergesort')
+           .reset_index(drop=True))
+
+class OpenIntervals(object):
+    """ Running metric sums and counts of the intervals a stream has reached
+    (started before the current chunk ended) and not emitted yet, memory
+    follows the intervals open around the current chunk instead of every
+    checkpoint of the run
+    """
+
+    def __init__(self):
+        n_metrics = len(GPU_METRICS)
+        self.positions = np.zeros(0, dtype=np.int64)
+        self.sums = np.zeros((0, n_metrics))
+        self.counts = np.zeros((0, n_metrics), dtype=np.int64)
+        self.first = np.zeros(0, dtype=np.int64)
+        self.uuids = np.empty(0, dtype=object)
+
+    def __len__(self):
+        return(len(self.positions))
+
+    def open(self, positions):
+        """ Starts accumulating intervals
+
+        Parameters
+        ----------
+        positions
+            interval positions
+        """
+        n_open, n_metrics = len(positions), len(GPU_METRICS)
+        self.positions = np.concatenate([self.positions, positions])
+        self.sums = np.vstack([self.sums, np.zeros((n_open, n_metrics))])
+        self.counts = np.vstack([self.counts, np.zeros((n_open, n_metrics),
+                                                       dtype=np.int64)])
+        self.first = np.concatenate([self.first,
+                                     np.full(n_open, -1, dtype=np.int64)])
+        self.uuids = np.concatenate([self.uuids,
+                                     np.empty(n_open, dtype=object)])
+
+    def accumulate(self, gpu_df, intervals_df, active, offset):
+        """ Adds the samples of a gpu chunk to some open intervals
+
+        Parameters
+        ----------
+        gpu_df
+            cleaned gpu chunk
+        intervals_df
+            sorted intervals (see order_intervals)
+        active
+            mask of the open intervals overlapping the chunk
+        offset
+            global gpu row position of the chunk first row
+        """
+        rows = np.flatnonzero(active)
+        chunk_sums, chunk_counts, chunk_first = interval_sums(
+                gpu_df, intervals_df.iloc[self.positions[rows]])
+        self.sums[rows] += chunk_sums
+        self.counts[rows] += chunk_counts
+
+        # First sample position and uuid are set once per interval
+
+        new_first = (self.first[rows] < 0) & (chunk_first >= 0)
+        set_ids = rows[new_first]
+        self.first[set_ids] = chunk_first[new_first] + offset
+        self.uuids[set_ids] = gpu_df['gpuUUID'].to_numpy()[
+                chunk_first[new_first]]
+
+    def close(self, begin, end):
+        """ Stops accumulating the intervals before end, every open interval
+        is at begin or after
+
+        Parameters
+        ----------
+        begin
+            first interval position of the closed range
+        end
+            end interval position of the closed range (exclusive)
+
+        Returns
+        -------
+        tuple
+            (sums, counts, first, uuids) of every interval of the range,
+            intervals never opened have no samples
+        """
+        n_closed, n_metrics = end - begin, len(GPU_METRICS)
+        sums = np.zeros((n_closed, n_metrics))
+        counts = np.zeros((n_closed, n_metrics), dtype=np.int64)
+        first = np.full(n_closed, -1, dtype=np.int64)
+        uuids = np.empty(n_closed, dtype=object)
+
+        closed = self.positions < end
+        rows = self.positions[closed] - begin
+        sums[rows] = self.sums[closed]
+        counts[rows] = self.counts[closed]
+        first[rows] = self.first[closed]
+        uuids[rows] = self.uuids[closed]
+
+        self.positions = self.positions[~closed]
+        self.sums = self.sums[~closed]
+        self.counts = self.counts[~closed]
+        self.first = self.first[~closed]
+        self.uuids = self.uuids[~closed]
+        return(sums, counts, first, uuids)
+
+def stream_merge_check_task_gpu(gpu_chunks, check_task_df):
+    """ Streaming version of make_dataset.merge_check_task_gpu, yields the
+    per task averages in batches as their intervals close
+
+    Parameters
+    ----------
+    gpu_chunks
+        iterable of cleaned gpu dataframes in time order
+    check_task_df
+        cleaned application checkpoints and tasks dataframe
+
+    Yields
+    ------
+    pandas.core.frame.DataFrame
+        finished per task averages (same columns as merge_check_task_gpu)
+
+    Raises
+    ------
+    ValueError
+        if a gpu chunk starts before the end of the previous one
+    """
+    intervals_df = order_intervals(md.pair_check_task(check_task_df))
+    starts = to_epoch_ns(intervals_df['start_time'])
+    stops = to_epoch_ns(intervals_df['stop_time'])
+    group_stops = to_epoch_ns(intervals_df['group_stop'])
+
+    # Intervals are opened in start order, emitted in group stop order
+
+    by_start = np.argsort(starts, kind='mergesort')
+    sorted_starts = starts[by_start]
+    open_intervals = OpenIntervals()
+
+    opened = 0
+    emitted = 0
+    offset = 0
+    first_time = None
+    last_time = None
+
+    for gpu_df in gpu_chunks:
+        if len(gpu_df) == 0:
+            continue
+        gpu_df = gpu_df.reset_index(drop=True)
+        times = to_epoch_ns(gpu_df['timestamp'])
+        if last_time is not None and times.min() < last_time:
+            raise ValueError("gpu samples are not in time order, chunk "
+                             "starting at row {} goes back in time"
+                             .format(offset))
+
+        # Intervals starting before the gpu dataset are never opened (rows
+        # of a chunk may be in any order, chunks are in time order)
+
+        if first_time is None:
+            first_time = times.min()
+            opened = int(np.searchsorted(sorted_starts, first_time,
+                                         side='left'))
+        last_time = times.max()
+
+        reached = int(np.searchsorted(sorted_starts, last_time,
+                                      side='right'))
+        open_intervals.open(by_start[opened:reached])
+        opened = max(opened, reached)
+
+        # Only open intervals overlapping this chunk
+
+        active = stops[open_intervals.positions] >= times.min()
+        if active.any():
+            open_intervals.accumulate(gpu_df, intervals_df, active, offset)
+
+        offset += len(gpu_df)
+
+        # Emit groups whose every interval stopped before this chunk ended
+
+        closed = int(np.searchsorted(group_stops, last_time, side='left'))
+        if closed > emitted:
+            yield(finished_tasks(intervals_df, emitted, closed,
+                                 *open_intervals.close(emitted, closed)))
+            emitted = closed
+
+    # Flush, remove intervals stopping after the gpu dataset
+
+    if last_time is not None and emitted < len(intervals_df):
+        sums, counts, first, uuids = open_intervals.close(
+                emitted, len(intervals_df))
+        first[stops[emitted:] > last_time] = -1
+        yield(finished_tasks(intervals_df, emitted, len(intervals_df), sums,
+                             counts, first, uuids))
+
+def finished_tasks(intervals_df, begin, end, sums, counts, first, uuids):
+    """ Aggregates a closed range of intervals into per task averages
+
+    Parameters
+    ----------
+    intervals_df
+        sorted intervals (see order_intervals)
+    begin
+        first interval position of the range
+    end
+        end interval position of the range (exclusive)
+    sums
+        metric sums of the range
+    counts
+        metric counts of the range
+    first
+        global gpu row position of each interval first sample of the range
+        (-1 when empty or outside the gpu dataset time range)
+    uuids
+        gpuUUID of each interval first sample of the range
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        per task averages
+    """
+    return(aggregate_intervals(intervals_df.iloc[begin:end], sums, counts,
+                               first, uuids))
+
+def read_gpu_chunks(gpu_csv_file, chunksize=STREAM_CHUNK_ROWS):
+    """ Reads (typed, see src.data.ingest) and cleans gpu.csv chunk by chunk
+
+    Parameters
+    ----------
+    gpu_csv_file
+        gpu.csv file location
+    chunksize
+        rows per chunk
+
+    Yields
+    ------
+    pandas.core.frame.DataFrame
+        cleaned gpu chunk
+    """
+    for gpu_df in read_chunks(gpu_csv_file, GPU_SCHEMA, chunksize):
+        yield(md.clean_gpu(gpu_df))
+
+def stream_dataset(gpu_csv_file, check_csv_file, task_csv_file,
+                   output_file, chunksize=STREAM_CHUNK_ROWS,
+                   output_format='csv'):
+    """ Runs the whole data preparation in streaming mode, appending
+    finished tasks to the final dataset as they close
+
+    Parameters
+    ----------
+    gpu_csv_file
+        gpu.csv file location
+    check_csv_file
+        application-checkpoints.csv file location
+    task_csv_file
+        task-x-y.csv file location
+    output_file
+        final dataset file location
+    chunksize
+        gpu.csv rows per chunk
+    output_format
+        csv or parquet (one row group per batch), feather files can not be
+        appended to
+
+    Returns
+    -------
+    int
+        number of task rows written
+    """
+    logger = logging.getLogger(__name__)
+
+    if output_format not in STREAM_FORMATS:
+        raise ValueError("Streaming can not write format: {}".format(
+                output_format))
+
+    check_task_df = md.merge_check_task(read_checkpoints(check_csv_file),
+                                        read_tasks(task_csv_file))
+    check_task_df = md.clean_check_task(check_task_df)
+
+    written = 0
+    writer = None
+    for tasks_df in stream_merge_check_task_gpu(
+            read_gpu_chunks(gpu_csv_file, chunksize), check_task_df):
+
+        # Continue the row index across batches like a single to_csv
+
+        tasks_df.index = pd.RangeIndex(written, written + len(tasks_df))
+
+        if output_format == 'csv':
+            tasks_df.to_csv(output_file, mode='w' if written == 0 else 'a',
+                            header=written == 0)
+        else:
+            writer = write_parquet_batch(writer, output_file, tasks_df)
+        written += len(tasks_df)
+        logger.info('streamed %d finished tasks', written)
+
+    if writer is not None:
+        writer.close()
+
+    return(written)
+
+def write_parquet_batch(writer, output_file, tasks_df):
+    """ Appends a batch of finished tasks to a parquet file as a row group,
+    categorical columns are written as strings so every batch shares the
+    first batch schema (load_dataset.load_processed sets the categories)
+
+    Parameters
+    ----------
+    writer
+        open pyarrow.parquet.ParquetWriter, None for the first batch
+    output_file
+        final dataset file location
+    tasks_df
+        finished tasks
+
+    Returns
+    -------
+    pyarrow.parquet.ParquetWriter
+        writer to pass with the next batch
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tasks_df = md.typed_processed(tasks_df, categorical=False)
+    if writer is None:
+        table = pa.Table.from_pandas(tasks_df, preserve_index=False)
+        writer = pq.ParquetWriter(output_file, table.schema)
+    else:
+        table = pa.Table.from_pandas(tasks_df, schema=writer.schema,
+                                     preserve_index=False)
+    writer.write_table(table)
+    return(writer)
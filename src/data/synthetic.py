@@ -0,0 +1,265 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the synthetic render trace
+generator. It writes gpu.csv, application-checkpoints.csv and task-x-y.csv
+files with the same columns and formats as the raw dataset, for any number
+of hosts, run duration and tile levels, so the data preparation process can
+be tested and benchmarked without the real (large) raw files. When the real
+files are there, sample_traces cuts a miniature copy of them down to a few
+hosts instead.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+import pandas as pd
+
+SAMPLE_CHUNK_ROWS = 1000000
+"""
+int: gpu.csv rows read at a time when sampling real raw files
+"""
+
+START_TIME = '2018-11-08T07:41:00'
+"""
+str: timestamp of the first generated gpu sample
+"""
+
+JOB_ID = '1024-lvl12-7e026be3-5fd0-48ee-b7d1-abd61f747705'
+"""
+str: job id of every generated task
+"""
+
+TASK_EVENTS = [('TotalRender', 'START', 0.0, 0.0),
+               ('Render', 'START', 0.0, 0.1),
+               ('Render', 'STOP', 1.0, -2.0),
+               ('Saving Config', 'START', 1.0, -2.0),
+               ('Saving Config', 'STOP', 1.0, -1.9),
+               ('Tiling', 'START', 1.0, -1.9),
+               ('Tiling', 'STOP', 1.0, -1.0),
+               ('Uploading', 'START', 1.0, -1.0),
+               ('Uploading', 'STOP', 1.0, -0.2),
+               ('TotalRender', 'STOP', 1.0, 0.0)]
+"""
+list: (eventName, eventType, fraction of the task duration, offset in
+seconds) of the checkpoints logged by every task
+"""
+
+def level_tiles(level):
+    """ Lists the tiles of a level, a level 12 image is 256 by 256 tiles and
+    every 4 levels down divides the side by 16
+
+    Parameters
+    ----------
+    level
+        tile level (4 or more)
+
+    Returns
+    -------
+    tuple
+        (x, y) numpy arrays
+    """
+    side = 2 ** max(level - 4, 0)
+    y, x = np.divmod(np.arange(side * side), side)
+    return(x, y)
+
+def format_timestamps(seconds):
+    """ Formats seconds after START_TIME as raw timestamps
+
+    Parameters
+    ----------
+    seconds
+        numpy array of offsets in seconds
+
+    Returns
+    -------
+    numpy.ndarray
+        timestamps in the raw TIMESTAMP_FORMAT
+    """
+    times = (np.datetime64(START_TIME, 'ms') +
+             np.round(np.asarray(seconds) * 1000).astype('timedelta64[ms]'))
+    return(np.char.add(np.datetime_as_string(times, unit='ms'), 'Z'))
+
+def generate_traces(hosts=4, duration=600, levels=(12,), sample_period=2.0,
+                    task_seconds=(20, 60), seed=0):
+    """ Generates raw gpu, application checkpoints and tasks dataframes
+
+    Every host renders tasks back to back for the whole duration while its
+    gpu is sampled every sample_period seconds (with jitter). Tasks take
+    tiles of the given levels in order, lowest level first.
+
+    Parameters
+    ----------
+    hosts
+        number of hosts
+    duration
+        run duration in seconds
+    levels
+        tile levels rendered
+    sample_period
+        seconds between two gpu samples of a host
+    task_seconds
+        (shortest, longest) task duration in seconds
+    seed
+        random seed, the same arguments always give the same traces
+
+    Returns
+    -------
+    tuple
+        (gpu, checkpoints, tasks) dataframes as read from the raw csv files
+
+    Raises
+    ------
+    ValueError
+        if the tasks outnumber the tiles of the levels
+    """
+    rng = np.random.RandomState(seed)
+    hostnames = ['{:032x}'.format(rng.randint(1 << 62)) for _ in
+                 range(hosts)]
+
+    # gpu samples, every host at the same rate with up to 0.9s jitter
+
+    samples = int(duration // sample_period)
+    sample_times = (np.arange(samples) * sample_period +
+                    rng.uniform(0, 0.9, (hosts, samples)))
+    rows = hosts * samples
+    gpu_df = pd.DataFrame({
+        'timestamp': format_timestamps(sample_times.ravel()),
+        'hostname': np.repeat(hostnames, samples),
+        'gpuSerial': np.repeat(323217055910 + np.arange(hosts), samples),
+        'gpuUUID': np.repeat(['GPU-{:08x}'.format(host) for host in
+                              range(hosts)], samples),
+        'powerDrawWatt': rng.uniform(25, 200, rows).round(2),
+        'gpuTempC': rng.randint(30, 50, rows),
+        'gpuUtilPerc': rng.randint(0, 100, rows),
+        'gpuMemUtilPerc': rng.randint(0, 60, rows)})
+    gpu_df = gpu_df.iloc[np.argsort(sample_times.ravel(), kind='stable')]
+
+    # Back to back tasks on every host, starting 5s in, ending 5s early
+
+    starts, lengths, task_hosts = [], [], []
+    low, high = task_seconds
+    for host in range(hosts):
+        length = rng.uniform(low, high, int(duration / low) + 1)
+        start = 5 + np.concatenate([[0], np.cumsum(length + 0.5)[:-1]])
+        keep = start + length < duration - 5
+        starts.append(start[keep])
+        lengths.append(length[keep])
+        task_hosts.append(np.full(keep.sum(), host))
+    starts = np.concatenate(starts)
+    lengths = np.concatenate(lengths)
+    task_hosts = np.concatenate(task_hosts)
+
+    x, y, level = [], [], []
+    for tile_level in sorted(levels):
+        tile_x, tile_y = level_tiles(tile_level)
+        x.append(tile_x)
+        y.append(tile_y)
+        level.append(np.full(len(tile_x), tile_level))
+    x, y, level = np.concatenate(x), np.concatenate(y), np.concatenate(level)
+    if len(starts) > len(x):
+        raise ValueError("{} tasks but only {} tiles in levels {}, add "
+                         "levels or lower hosts/duration"
+                         .format(len(starts), len(x), list(levels)))
+    task_ids = np.array(['{:08x}-task-{}'.format(task, task) for task in
+                         range(len(starts))])
+    tasks_df = pd.DataFrame({'taskId': task_ids, 'jobId': JOB_ID,
+                             'x': x[:len(starts)], 'y': y[:len(starts)],
+                             'level': level[:len(starts)]})
+
+    events = len(TASK_EVENTS)
+    fractions = np.array([event[2] for event in TASK_EVENTS])
+    offsets = np.array([event[3] for event in TASK_EVENTS])
+    event_times = (starts[:, None] + lengths[:, None] * fractions +
+                   offsets).ravel()
+    order = np.argsort(event_times, kind='stable')
+    checkpoints_df = pd.DataFrame({
+        'timestamp': format_timestamps(event_times[order]),
+        'hostname': np.asarray(hostnames)[np.repeat(task_hosts,
+                                                    events)][order],
+        'eventName': np.tile([event[0] for event in TASK_EVENTS],
+                             len(starts))[order],
+        'eventType': np.tile([event[1] for event in TASK_EVENTS],
+                             len(starts))[order],
+        'jobId': JOB_ID,
+        'taskId': np.repeat(task_ids, events)[order]})
+
+    return(gpu_df.reset_index(drop=True), checkpoints_df, tasks_df)
+
+def write_traces(directory, **kwargs):
+    """ Generates raw csv files (see generate_traces)
+
+    Parameters
+    ----------
+    directory
+        directory to write gpu.csv, application-checkpoints.csv and
+        task-x-y.csv to
+    kwargs
+        generate_traces arguments
+
+    Returns
+    -------
+    list
+        gpu, checkpoints and tasks file locations
+    """
+    os.makedirs(str(directory), exist_ok=True)
+    paths = [os.path.join(str(directory), name) for name in
+             ['gpu.csv', 'application-checkpoints.csv', 'task-x-y.csv']]
+    for df, path in zip(generate_traces(**kwargs), paths):
+        df.to_csv(path, index=False)
+    return(paths)
+
+def sample_traces(raw_files, directory, hosts=4, seed=0,
+                  chunksize=SAMPLE_CHUNK_ROWS):
+    """ Writes a miniature copy of real raw csv files holding the rows of a
+    few hosts (and the tasks they ran), values kept as text so they are
+    written back unchanged
+
+    Parameters
+    ----------
+    raw_files
+        gpu, checkpoints and tasks file locations
+    directory
+        directory to write the sampled files to, task-x-y.csv is written
+        last so its presence means the sample is complete
+    hosts
+        number of hosts kept
+    seed
+        random seed choosing the hosts, the same files and arguments always
+        give the same sample
+
+    Returns
+    -------
+    list
+        gpu, checkpoints and tasks sample file locations
+    """
+    gpu_csv, check_csv, task_csv = raw_files
+    checkpoints_df = pd.read_csv(check_csv, dtype=str, keep_default_na=False)
+    hostnames = np.sort(checkpoints_df['hostname'].unique())
+    chosen = np.random.RandomState(seed).choice(
+            hostnames, min(hosts, len(hostnames)), replace=False)
+
+    os.makedirs(str(directory), exist_ok=True)
+    paths = [os.path.join(str(directory), name) for name in
+             ['gpu.csv', 'application-checkpoints.csv', 'task-x-y.csv']]
+
+    # gpu.csv is filtered a chunk at a time
+
+    header = True
+    for chunk in pd.read_csv(gpu_csv, dtype=str, keep_default_na=False,
+                             chunksize=chunksize):
+        chunk[chunk['hostname'].isin(chosen)].to_csv(
+                paths[0], index=False, header=header,
+                mode='w' if header else 'a')
+        header = False
+
+    checkpoints_df = checkpoints_df[checkpoints_df['hostname'].isin(chosen)]
+    checkpoints_df.to_csv(paths[1], index=False)
+    tasks_df = pd.read_csv(task_csv, dtype=str, keep_default_na=False)
+    tasks_df[tasks_df['taskId'].isin(checkpoints_df['taskId'])].to_csv(
+            paths[2], index=False)
+    return(paths)
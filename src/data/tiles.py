@@ -0,0 +1,364 @@
+"""
+Introduction
+--------------
+
+This python file contains the source code for the tile grid (spatial) index
+of the final dataset. The rows of one eventName are aggregated once into
+dense numpy grids per tile level, indexed [y, x]: count, sum and max of the
+task duration and of every gpu metric, and the code of the host that
+rendered each tile. A level L image is 2 ** (L - ROOT_LEVEL) tiles a side
+and every tile splits into 2 by 2 tiles one level down (a quadtree), so a
+coarser grid is rolled up from a finer one by summing (or taking the max of)
+2 ** d by 2 ** d blocks. Heatmap, neighbourhood and sub-tile queries are
+then array slices instead of groupbys over the whole frame.
+
+Code
+------
+
+"""
+# -*- coding: utf-8 -*-
+import numpy as np
+from src.data import make_dataset as md
+from src.data.interval_join import GPU_METRICS
+from src.data.load_dataset import load_processed
+
+ROOT_LEVEL = 4
+"""
+int: tile level of the single tile covering the whole image
+"""
+
+TILE_METRICS = ['duration'] + GPU_METRICS
+"""
+list: metrics aggregated per tile, duration is stop_time - start_time in
+seconds
+"""
+
+TILE_STATS = ['count', 'sum', 'max', 'mean']
+"""
+list: statistics of a tile metric, count skips missing readings
+"""
+
+HOST_EMPTY = -1
+"""
+int: host code of a tile without rows
+"""
+
+HOST_MIXED = -2
+"""
+int: host code of a rolled up tile whose sub-tiles were rendered by several
+hosts
+"""
+
+def level_side(level):
+    """ Gives the number of tiles a side of a level
+
+    Parameters
+    ----------
+    level
+        tile level (ROOT_LEVEL or more)
+
+    Returns
+    -------
+    int
+        tiles a side
+    """
+    if level < ROOT_LEVEL:
+        raise ValueError("Tile levels start at {}: {}".format(ROOT_LEVEL,
+                                                              level))
+    return(2 ** (level - ROOT_LEVEL))
+
+def blocks(grid, factor):
+    """ Views the last two (y, x) axes of a grid as factor by factor blocks
+
+    Parameters
+    ----------
+    grid
+        numpy array, last two axes of a side divisible by factor
+
+    Returns
+    -------
+    numpy.ndarray
+        view with axes (..., y block, y in block, x block, x in block)
+    """
+    side = grid.shape[-1]
+    return(grid.reshape(grid.shape[:-2] + (side // factor, factor,
+                                           side // factor, factor)))
+
+def build_level(level_df, side, hostnames):
+    """ Aggregates the rows of one level into dense grids
+
+    Parameters
+    ----------
+    level_df
+        final dataset rows of the level
+    side
+        tiles a side of the level
+    hostnames
+        host names, the host grid holds positions in this list
+
+    Returns
+    -------
+    dict
+        count, sum and max arrays (metric, y, x) and host array (y, x)
+    """
+    x = level_df['x'].values.astype(np.int64)
+    y = level_df['y'].values.astype(np.int64)
+    if len(x) and (min(x.min(), y.min()) < 0 or max(x.max(), y.max()) >= side):
+        raise ValueError("Tiles outside a {0} by {0} level".format(side))
+    cells = y * side + x
+    shape = (len(TILE_METRICS), side * side)
+    grids = {'count': np.zeros(shape, dtype=np.int64),
+             'sum': np.zeros(shape), 'max': np.full(shape, np.nan)}
+
+    durations = (level_df['stop_time'].values -
+                 level_df['start_time'].values) / np.timedelta64(1, 's')
+    for n, metric in enumerate(TILE_METRICS):
+        values = (durations if metric == 'duration' else
+                  level_df[metric].values.astype(np.float64))
+        present = ~np.isnan(values)
+        grids['count'][n] = np.bincount(cells[present],
+                                        minlength=side * side)
+        grids['sum'][n] = np.bincount(cells[present], weights=values[present],
+                                      minlength=side * side)
+        np.fmax.at(grids['max'][n], cells[present], values[present])
+
+    # A tile rendered more than once keeps the host of its last row
+
+    grids['host'] = np.full(side * side, HOST_EMPTY, dtype=np.int32)
+    grids['host'][cells] = np.searchsorted(
+            hostnames, level_df['hostname'].astype(str).values)
+    return({name: grid.reshape(grid.shape[:-1] + (side, side))
+            for name, grid in grids.items()})
+
+def rollup_level(grids, factor):
+    """ Rolls a level up into the level whose tiles cover factor by factor
+    of its tiles
+
+    Parameters
+    ----------
+    grids
+        count, sum, max and host arrays of the finer level (see build_level)
+    factor
+        tiles a side merged (a power of 2)
+
+    Returns
+    -------
+    dict
+        count, sum, max and host arrays of the coarser level
+    """
+    hosts = blocks(grids['host'], factor)
+    first = np.where(hosts == HOST_EMPTY, np.iinfo(np.int32).max,
+                     hosts).min(axis=(1, 3))
+    last = hosts.max(axis=(1, 3))
+    host = np.where(last == HOST_EMPTY, HOST_EMPTY,
+                    np.where(first == last, last, HOST_MIXED))
+    return({'count': blocks(grids['count'], factor).sum(axis=(2, 4)),
+            'sum': blocks(grids['sum'], factor).sum(axis=(2, 4)),
+            'max': np.fmax.reduce(blocks(grids['max'], factor),
+                                  axis=(2, 4)),
+            'host': host.astype(np.int32)})
+
+class TileGrid(object):
+    """ Dense per level tile grids of one eventName (see module
+    introduction)
+
+    Parameters
+    ----------
+    df
+        final dataset, loaded from path if None
+    path
+        final dataset file location, the one the last build wrote if None
+        (see load_dataset.load_processed)
+    event
+        eventName aggregated
+    """
+
+    def __init__(self, df=None, path=None, event='TotalRender'):
+        if df is None:
+            df = load_processed(path)
+        else:
+            df = md.typed_processed(df)
+        df = df[df['eventName'].astype(str) == event]
+        self.event = event
+        self.hostnames = np.unique(df['hostname'].astype(str).values)
+        self.grids = {}
+        for level, level_df in df.groupby('level', sort=True):
+            level = int(level)
+            self.grids[(level, level)] = build_level(
+                    level_df, level_side(level), self.hostnames)
+        self.levels = sorted(level for level, _ in self.grids)
+
+    def grid(self, level, source=None):
+        """ Gives the grids of a level, rolled up from a finer level when
+        asked for or when the level has no rows of its own (the roll up is
+        kept for later queries)
+
+        Parameters
+        ----------
+        level
+            tile level
+        source
+            level whose tiles are aggregated (level or a finer one), the
+            level itself when it has rows and the finest level otherwise
+
+        Returns
+        -------
+        dict
+            count, sum, max arrays (metric, y, x) and host array (y, x)
+        """
+        if source is None:
+            source = level if level in self.levels else max(self.levels)
+        if source not in self.levels:
+            raise ValueError("No rows of level {}".format(source))
+        if level > source:
+            raise ValueError("Level {} is finer than level {}".format(
+                    level, source))
+        level_side(level)
+        if (level, source) not in self.grids:
+            self.grids[(level, source)] = rollup_level(
+                    self.grids[(source, source)], 2 ** (source - level))
+        return(self.grids[(level, source)])
+
+    def heatmap(self, level, metric='duration', stat='mean', source=None):
+        """ Gives a statistic of a metric for every tile of a level, for
+        instance heatmap(8, 'powerDrawWatt', source=12) averages the level
+        12 tiles inside every level 8 tile
+
+        Parameters
+        ----------
+        level
+            tile level
+        metric
+            one of TILE_METRICS
+        stat
+            one of TILE_STATS
+        source
+            level whose tiles are aggregated (see grid)
+
+        Returns
+        -------
+        numpy.ndarray
+            (y, x) array, nan for tiles without readings (0 for count),
+            do not change it (it may be a view of the grids)
+        """
+        if metric not in TILE_METRICS:
+            raise ValueError("Unrecognized tile metric: {}".format(metric))
+        if stat not in TILE_STATS:
+            raise ValueError("Unrecognized tile statistic: {}".format(stat))
+        grids = self.grid(level, source)
+        n = TILE_METRICS.index(metric)
+        if stat != 'mean':
+            return(grids[stat][n])
+        counts = grids['count'][n]
+        means = np.full(counts.shape, np.nan)
+        np.divide(grids['sum'][n], counts, out=means, where=counts > 0)
+        return(means)
+
+    def window(self, level, x, y, radius=1, metric='duration', stat='mean',
+               source=None):
+        """ Gives the heatmap of the tiles around a tile, cut at the image
+        borders
+
+        Parameters
+        ----------
+        level
+            tile level
+        x
+            tile column
+        y
+            tile row
+        radius
+            tiles kept on each side
+        metric
+            one of TILE_METRICS
+        stat
+            one of TILE_STATS
+        source
+            level whose tiles are aggregated (see grid)
+
+        Returns
+        -------
+        numpy.ndarray
+            (y, x) array of at most 2 * radius + 1 tiles a side
+        """
+        heatmap = self.heatmap(level, metric, stat, source)
+        return(heatmap[max(y - radius, 0):y + radius + 1,
+                       max(x - radius, 0):x + radius + 1])
+
+    def children(self, level, x, y, fine_level, metric='duration',
+                 stat='mean'):
+        """ Gives the heatmap of the finer level tiles inside a tile
+
+        Parameters
+        ----------
+        level
+            tile level
+        x
+            tile column
+        y
+            tile row
+        fine_level
+            finer tile level shown
+        metric
+            one of TILE_METRICS
+        stat
+            one of TILE_STATS
+
+        Returns
+        -------
+        numpy.ndarray
+            (y, x) array of 2 ** (fine_level - level) tiles a side
+        """
+        if fine_level < level:
+            raise ValueError("Level {} is coarser than level {}".format(
+                    fine_level, level))
+        factor = 2 ** (fine_level - level)
+        heatmap = self.heatmap(fine_level, metric, stat)
+        return(heatmap[y * factor:(y + 1) * factor,
+                       x * factor:(x + 1) * factor])
+
+    def hosts(self, level, source=None):
+        """ Gives the host of every tile of a level
+
+        Parameters
+        ----------
+        level
+            tile level
+        source
+            level whose tiles are aggregated (see grid)
+
+        Returns
+        -------
+        numpy.ndarray
+            (y, x) array of positions in hostnames, HOST_EMPTY for tiles
+            without rows and HOST_MIXED for rolled up tiles of several hosts
+        """
+        return(self.grid(level, source)['host'])
+
+    def tile(self, level, x, y, source=None):
+        """ Gives the statistics of one tile
+
+        Parameters
+        ----------
+        level
+            tile level
+        x
+            tile column
+        y
+            tile row
+        source
+            level whose tiles are aggregated (see grid)
+
+        Returns
+        -------
+        dict
+            mean of every TILE_METRICS, count of rows and hostname (None
+            when empty or mixed)
+        """
+        stats = {metric: self.heatmap(level, metric, 'mean', source)[y, x]
+                 for metric in TILE_METRICS}
+        stats['count'] = int(self.heatmap(level, 'duration', 'count',
+                                          source)[y, x])
+        host = self.hosts(level, source)[y, x]
+        stats['hostname'] = self.hostnames[host] if host >= 0 else None
+        return(stats)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the session fixtures shared by the tests: a
+miniature raw dataset (a few hosts sampled from data/raw when the real files
+are there, deterministic synthetic traces otherwise) and the stage outputs
+built from it once per test session, so tests never reload the full raw
+files
+
+Code
+------
+
+"""
+import hashlib
+import os
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import stage_cache as sc
+from src.data.synthetic import sample_traces, write_traces
+import pytest
+
+SAMPLE_HOSTS = 4
+"""
+int: hosts in the miniature raw dataset
+"""
+
+SAMPLE_DURATION = 1200
+"""
+int: seconds of synthetic traces when the real raw files are missing
+"""
+
+SAMPLE_LEVELS = (4, 8, 12)
+"""
+tuple: tile levels of synthetic traces, rendered lowest first like the real
+run
+"""
+
+def raw_sample_dir(raw_files, hosts=SAMPLE_HOSTS):
+    """ Gives the directory of the sample of the real raw files, named after
+    their hashes so a new raw dataset is sampled again
+
+    Parameters
+    ----------
+    raw_files
+        gpu, checkpoints and tasks file locations
+    hosts
+        hosts sampled
+
+    Returns
+    -------
+    str
+        sample directory location, in the stage cache directory
+    """
+    cache = sc.StageCache()
+    digest = hashlib.sha1(' '.join(
+            [cache.file_hash(path) for path in raw_files] +
+            [str(hosts)]).encode()).hexdigest()
+    return(os.path.join(cache.directory, 'sample-' + digest))
+
+@pytest.fixture(scope='session')
+def global_sample_files(tmp_path_factory):
+    """Fixture used to pass the miniature raw dataset files, sampled from the
+    real raw files once (and kept until they change) or synthetic
+
+    Returns
+    -------
+    list
+        gpu.csv, application-checkpoints.csv and task-x-y.csv locations
+    """
+    raw_files = [md.GPU_CSV_FILE, md.CHECK_CSV_FILE, md.TASK_CSV_FILE]
+    if not all(os.path.exists(path) for path in raw_files):
+        return(write_traces(tmp_path_factory.mktemp('raw'),
+                            hosts=SAMPLE_HOSTS, duration=SAMPLE_DURATION,
+                            levels=SAMPLE_LEVELS, seed=0))
+
+    directory = raw_sample_dir(raw_files)
+    paths = [os.path.join(directory, os.path.basename(path))
+             for path in raw_files]
+    if not os.path.exists(paths[-1]):
+        sample_traces(raw_files, directory, hosts=SAMPLE_HOSTS, seed=0)
+    return(paths)
+
+@pytest.fixture(scope='session')
+def global_sample_raw(global_sample_files):
+    """Fixture used to pass the miniature raw dataframes, read once per
+    session (copy them before changing them)
+
+    Returns
+    -------
+    dict
+        gpu, checkpoints and tasks raw dataframes
+    """
+    return(dict(zip(['gpu', 'checkpoints', 'tasks'],
+                    [pd.read_csv(str(path)) for path in global_sample_files])))
+
+@pytest.fixture(scope='session')
+def global_sample_cache(tmp_path_factory):
+    """Fixture used to pass a stage cache living for the test session
+
+    Returns
+    -------
+    src.data.stage_cache.StageCache
+        stage cache in a session temporary directory
+    """
+    return(sc.StageCache(tmp_path_factory.mktemp('interim')))
+
+@pytest.fixture(scope='session')
+def global_sample_check_task(global_sample_files, global_sample_cache):
+    """Fixture used to pass the miniature application and tasks merged
+    dataframe, built once per session (copy it before changing it)
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        application and tasks merged dataframe
+    """
+    return(sc.cached_check_task(global_sample_cache,
+                                *global_sample_files[1:])[0])
+
+@pytest.fixture(scope='session')
+def global_sample_check_task_gpu(global_sample_files, global_sample_cache):
+    """Fixture used to pass the miniature final dataset, built once per
+    session (copy it before changing it)
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        application, tasks and gpu final merged dataframe
+    """
+    return(sc.cached_stages(*global_sample_files, cache=global_sample_cache))
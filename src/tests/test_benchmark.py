@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the synthetic trace
+generator and the data preparation benchmark
+
+Code
+------
+
+"""
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import synthetic as sy
+from src.data import benchmark as bm
+import pytest
+
+class TestSyntheticTraces(object):
+    """ Tests the synthetic raw dataset generator
+
+    """
+
+    def test_raw_columns(self):
+        """ Tests if the generated dataframes have the raw csv columns and
+        go through the whole data preparation process
+
+        """
+        gpu_df, checkpoints_df, tasks_df = sy.generate_traces(
+                hosts=3, duration=300)
+        assert (list(gpu_df.columns) ==
+                ['timestamp', 'hostname', 'gpuSerial', 'gpuUUID',
+                 'powerDrawWatt', 'gpuTempC', 'gpuUtilPerc',
+                 'gpuMemUtilPerc'])
+        assert (list(checkpoints_df.columns) ==
+                ['timestamp', 'hostname', 'eventName', 'eventType', 'jobId',
+                 'taskId'])
+        final_df = md.merge_check_task_gpu(
+                md.clean_gpu(gpu_df), md.clean_check_task(
+                        md.merge_check_task(checkpoints_df, tasks_df)))
+        assert (len(final_df) > 0)
+        assert not (final_df.isnull().values.any())
+
+    def test_deterministic(self):
+        """ Tests if the same seed gives the same traces
+
+        """
+        for first_df, second_df in zip(sy.generate_traces(seed=3),
+                                       sy.generate_traces(seed=3)):
+            pd.testing.assert_frame_equal(first_df, second_df)
+
+    def test_levels(self):
+        """ Tests if tasks take the tiles of the lowest levels first
+
+        """
+        tasks_df = sy.generate_traces(hosts=2, duration=600,
+                                      levels=(8, 4))[2]
+        assert (list(tasks_df['level'][:2]) == [4, 8])
+        assert (tasks_df[['x', 'y', 'level']].duplicated().sum() == 0)
+
+    def test_too_many_tasks(self):
+        """ Tests if tasks outnumbering the tiles are rejected
+
+        """
+        with pytest.raises(ValueError):
+            sy.generate_traces(hosts=4, duration=600, levels=(4,))
+
+class TestBenchmark(object):
+    """ Tests benchmark reports
+
+    """
+
+    def test_case_report(self):
+        """ Tests if every stage is timed and memory profiled
+
+        """
+        case = bm.benchmark_case(repeat=2, hosts=2, duration=300)
+        assert (sorted(case['stages']) == sorted(bm.STAGES))
+        for stage in bm.STAGES:
+            assert (len(case['stages'][stage]['runs']) == 2)
+            assert (case['stages'][stage]['peak_bytes'] >= 0)
+        assert (case['rows']['final'] > 0)
+
+    def test_unsorted_gpu(self, tmp_path):
+        """ Tests if the timed stages keep the tasks of the pipeline when the
+        gpu rows are not in time order
+
+        """
+        gpu_df, checkpoints_df, tasks_df = sy.generate_traces(
+                hosts=2, duration=300)
+        gpu_df = gpu_df.sample(frac=1, random_state=0)
+        final_df = md.merge_check_task_gpu(
+                md.clean_gpu(gpu_df.copy()), md.clean_check_task(
+                        md.merge_check_task(checkpoints_df, tasks_df)))
+        rows = bm.run_stages((gpu_df, checkpoints_df, tasks_df),
+                             str(tmp_path / 'processed.csv'),
+                             bm.StageTimer())
+        assert (rows == len(final_df))
+
+    def test_compare(self):
+        """ Tests if cases are matched by parameters when comparing
+
+        """
+        def report(seconds):
+            return({'cases': [{'params': {'hosts': 2},
+                               'stages': {'csv_write':
+                                          {'seconds': seconds}}}]})
+        df = bm.compare_reports(report(2.0), report(0.5))
+        assert (list(df['speedup']) == [4.0])
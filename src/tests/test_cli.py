@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the configurable
+command line of the data preparation process
+
+Code
+------
+
+"""
+import os
+import pandas as pd
+from src.data import make_dataset as md
+from src.data.load_dataset import load_processed
+from src.data.stage_cache import StageCache
+from src.data.synthetic import write_traces
+import pytest
+
+@pytest.fixture
+def global_raw_dir(tmp_path):
+    """Fixture used to pass a directory of small synthetic raw files
+
+    Returns
+    -------
+    pathlib.Path
+        raw files directory
+    """
+    write_traces(tmp_path / 'raw', hosts=3, duration=600)
+    return(tmp_path / 'raw')
+
+@pytest.mark.usefixtures('global_raw_dir')
+class TestCommandLine(object):
+    """ Tests builds configured from the command line
+
+    """
+
+    def test_paths(self, tmp_path):
+        """ Tests if directories and files given replace the defaults
+
+        """
+        paths = md.build_paths('parquet', raw_dir=tmp_path / 'raw',
+                               processed_dir=tmp_path / 'out',
+                               gpu='gpu-*.csv.zst')
+        assert (paths['gpu'] == 'gpu-*.csv.zst')
+        assert (paths['check'] ==
+                str(tmp_path / 'raw' / 'application-checkpoints.csv'))
+        assert (paths['processed'] ==
+                str(tmp_path / 'out' / 'processed.parquet'))
+        assert (paths['rollups'] == str(tmp_path / 'out' / 'rollups'))
+        assert (md.build_paths()['processed'] == md.PROCESSED_CSV_FILE)
+
+    def test_build(self, tmp_path, global_raw_dir):
+        """ Tests if a build writes where it is told to, in the format it is
+        told to, and only the final dataset unless asked for more
+
+        """
+        out_dir = tmp_path / 'out'
+        args = ['--raw-dir', str(global_raw_dir), '--interim-dir',
+                str(tmp_path / 'interim'), '--format', 'parquet']
+        md.cli(args + ['--processed-dir', str(out_dir), '--features',
+                       '--stragglers', '--report'])
+
+        assert (sorted(os.listdir(str(out_dir))) ==
+                ['features.parquet', 'processed.parquet',
+                 'processed.parquet.report.json', 'stragglers.parquet'])
+        assert (len(load_processed(out_dir / 'processed.parquet')) > 0)
+
+        md.cli(args + ['--processed-dir', str(tmp_path / 'default')])
+        assert (os.listdir(str(tmp_path / 'default')) ==
+                ['processed.parquet'])
+
+    def test_until_and_resume(self, tmp_path, global_raw_dir):
+        """ Tests if a build stopped after a stage only stores the stages up
+        to it and the next build resumes from them
+
+        """
+        args = ['--raw-dir', str(global_raw_dir), '--processed-dir',
+                str(tmp_path / 'out'), '--interim-dir',
+                str(tmp_path / 'interim')]
+        md.cli(args + ['--until', 'clean_check_task'])
+        cache = StageCache(tmp_path / 'interim')
+        stored = [name for name in os.listdir(cache.directory)
+                  if name.endswith('.pkl')]
+
+        assert (not (tmp_path / 'out' / 'processed.csv').exists())
+        gpu_key = cache.key('clean_gpu', [cache.file_hash(
+                global_raw_dir / 'gpu.csv')])
+        assert (len(stored) == 2)
+        assert (os.path.basename(cache.path(gpu_key)) not in stored)
+        md.cli(args)
+        assert ((tmp_path / 'out' / 'processed.csv').exists())
+        with pytest.raises(ValueError):
+            md.cli(args + ['--until', 'clean_gpu', '--no-cache'])
+
+    def test_memory_budget(self, tmp_path, global_raw_dir):
+        """ Tests if a small memory budget streams the same final dataset
+
+        """
+        paths = md.build_paths(raw_dir=global_raw_dir)
+        assert (md.plan_memory(paths, 1 << 40) == (False, None))
+        streaming, chunksize = md.plan_memory(paths, 1000)
+        assert (streaming)
+        assert (chunksize == md.MIN_STREAM_CHUNK_ROWS)
+
+        for budget, name in [('0.001', 'stream'), ('100000', 'memory')]:
+            md.cli(['--raw-dir', str(global_raw_dir), '--processed-dir',
+                    str(tmp_path / name), '--no-cache', '--memory-budget',
+                    budget])
+        key = ['hostname', 'eventName', 'x', 'y', 'level']
+        stream_df, memory_df = [
+                pd.read_csv(str(tmp_path / name / 'processed.csv'),
+                            index_col=0).sort_values(key).reset_index(
+                                    drop=True)
+                for name in ['stream', 'memory']]
+        pd.testing.assert_frame_equal(stream_df, memory_df)
+
+    def test_memory_budget_conflicts(self, tmp_path, global_raw_dir):
+        """ Tests if a memory budget needing a switch to streaming refuses
+        options streaming can not honour, and keeps them when it fits
+
+        """
+        processed_dir = tmp_path / 'processed'
+        args = ['--raw-dir', str(global_raw_dir), '--processed-dir',
+                str(processed_dir), '--no-cache', '--memory-budget']
+        for options, message in [(['--format', 'feather'], 'feather'),
+                                 (['--keep-joined'], '--keep-joined')]:
+            with pytest.raises(ValueError, match=message) as error:
+                md.cli(args + ['0.001'] + options)
+            assert ('--memory-budget' in str(error.value))
+        assert (not processed_dir.exists() or
+                not list(processed_dir.iterdir()))
+
+        md.cli(args + ['100000', '--format', 'feather'])
+        assert ((processed_dir / 'processed.feather').exists())
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the per task feature
+table
+
+Code
+------
+
+"""
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import features as ft
+from src.data import ingest as ig
+from src.data.synthetic import write_traces
+import pytest
+
+BASE = pd.Timestamp('2018-11-08 07:41:00')
+"""
+pandas.Timestamp: time of the first gpu sample
+"""
+
+@pytest.fixture
+def global_gpu_df():
+    """Fixture used to pass one host sampled every second for 10 seconds,
+    power rising by one watt per sample
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        cleaned gpu dataframe
+    """
+    return(pd.DataFrame({
+        'timestamp': [BASE + pd.Timedelta(seconds=i) for i in range(10)],
+        'hostname': 'host-a', 'gpuUUID': 'GPU-a',
+        'powerDrawWatt': np.arange(10, dtype=float),
+        'gpuTempC': 40 + np.arange(10), 'gpuUtilPerc': 90,
+        'gpuMemUtilPerc': 30}))
+
+def intervals(spans):
+    """ Builds paired intervals of one tile on host-a
+
+    Parameters
+    ----------
+    spans
+        list of (start, stop) seconds after BASE
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        paired start/stop checkpoint and task dataframe
+    """
+    return(pd.DataFrame({
+        'start_time': [BASE + pd.Timedelta(seconds=span[0])
+                       for span in spans],
+        'hostname': 'host-a', 'eventName': 'Render', 'x': 1, 'y': 2,
+        'level': 12,
+        'stop_time': [BASE + pd.Timedelta(seconds=span[1])
+                      for span in spans]}))
+
+@pytest.mark.usefixtures('global_gpu_df')
+class TestTaskFeatures(object):
+    """ Tests per task features against direct computations
+
+    """
+
+    def test_energy(self, global_gpu_df):
+        """ Tests if power is integrated between samples and held to the
+        interval bounds
+
+        """
+        features_df = ft.task_features(global_gpu_df,
+                                       intervals([(1.5, 4.5)]))
+        assert (features_df['samples'][0] == 3)
+        assert (features_df['duration'][0] == 3)
+
+        # 2 to 4 watts over [2, 4] plus 2 and 4 watts held half a second
+
+        assert (np.isclose(features_df['energy'][0], 6 + 1 + 2))
+
+    def test_missing_power(self, global_gpu_df):
+        """ Tests if samples without a power reading are skipped instead of
+        counted as 0 W
+
+        """
+        global_gpu_df.loc[4, 'powerDrawWatt'] = np.nan
+        features_df = ft.task_features(global_gpu_df,
+                                       intervals([(1.5, 4.5)]))
+
+        # 2 to 3 watts over [2, 3], 2 watts held half a second and 3 watts
+        # held to the stop
+
+        assert (np.isclose(features_df['energy'][0], 2.5 + 1 + 4.5))
+        global_gpu_df['powerDrawWatt'] = np.nan
+        features_df = ft.task_features(global_gpu_df,
+                                       intervals([(1.5, 4.5)]))
+        assert (np.isnan(features_df['energy'][0]))
+
+    def test_pooled_attempts(self, global_gpu_df):
+        """ Tests if retried attempts are pooled into one task, timed by
+        the earliest one like the final dataset
+
+        """
+        features_df = ft.task_features(global_gpu_df,
+                                       intervals([(6, 8), (0, 3)]))
+        temps = [40, 41, 42, 43, 46, 47, 48]
+        assert (len(features_df) == 1)
+        assert (features_df['attempts'][0] == 2)
+        assert (features_df['samples'][0] == 7)
+        assert (features_df['duration'][0] == 5)
+        assert (features_df['start_time'][0] == BASE)
+        assert (features_df['gpuTempC_min'][0] == 40)
+        assert (features_df['gpuTempC_max'][0] == 48)
+        assert (np.isclose(features_df['gpuTempC_p95'][0],
+                           np.percentile(temps, 95)))
+
+    def test_missing_readings(self, global_gpu_df):
+        """ Tests if missing readings are skipped and empty intervals left
+        out
+
+        """
+        global_gpu_df['gpuUtilPerc'] = np.nan
+        global_gpu_df.loc[2, 'gpuUtilPerc'] = 50
+        spans = intervals([(0, 4), (20, 30)])
+        spans.loc[1, 'x'] = 5
+        features_df = ft.task_features(global_gpu_df, spans)
+        assert (len(features_df) == 1)
+        assert (features_df['gpuUtilPerc_p95'][0] == 50)
+        assert (list(features_df.columns) ==
+                ['hostname', 'eventName', 'x', 'y', 'level', 'start_time',
+                 'stop_time'] + ft.FEATURE_COLUMNS)
+
+    def test_matches_final_dataset(self, tmp_path):
+        """ Tests if tasks match the final dataset rows and percentiles
+        match numpy on synthetic traces
+
+        """
+        gpu_csv, check_csv, task_csv = write_traces(tmp_path, hosts=3,
+                                                    duration=600)
+        gpu_df = md.clean_gpu(ig.read_gpu(gpu_csv))
+        check_task_df = md.clean_check_task(md.merge_check_task(
+                ig.read_checkpoints(check_csv), ig.read_tasks(task_csv)))
+        features_df = md.check_task_features(gpu_df, check_task_df)
+        final_df = md.merge_check_task_gpu(gpu_df, check_task_df)
+        keys = ['hostname', 'eventName', 'x', 'y', 'level']
+        pd.testing.assert_frame_equal(features_df[keys], final_df[keys],
+                                      check_categorical=False)
+
+        task = features_df.iloc[len(features_df) // 2]
+        samples = gpu_df[(gpu_df['hostname'] == task['hostname']) &
+                         (gpu_df['timestamp'] >= task['start_time']) &
+                         (gpu_df['timestamp'] <= task['stop_time'])]
+        assert (task['samples'] == len(samples))
+        assert (np.isclose(task['powerDrawWatt_p95'], np.percentile(
+                samples['powerDrawWatt'].astype(float), 95)))
+
+    def test_one_join(self, tmp_path, monkeypatch):
+        """ Tests if the feature table built with the final dataset pairs
+        checkpoints once and matches the table built on its own
+
+        """
+        gpu_csv, check_csv, task_csv = write_traces(tmp_path, hosts=2,
+                                                    duration=300)
+        gpu_df = md.clean_gpu(ig.read_gpu(gpu_csv))
+        check_task_df = md.clean_check_task(md.merge_check_task(
+                ig.read_checkpoints(check_csv), ig.read_tasks(task_csv)))
+        expected_df = md.check_task_features(gpu_df, check_task_df)
+
+        calls = []
+        pair_check_task = md.pair_check_task
+        monkeypatch.setattr(md, 'pair_check_task', lambda df: calls.append(
+                len(df)) or pair_check_task(df))
+        final_df, features_df = md.merge_check_task_gpu(
+                gpu_df, check_task_df, features=True)
+        assert (len(calls) == 1)
+        pd.testing.assert_frame_equal(final_df, md.merge_check_task_gpu(
+                gpu_df, check_task_df))
+        pd.testing.assert_frame_equal(features_df, expected_df)
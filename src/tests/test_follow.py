@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the follow (live)
+data preparation process
+
+Code
+------
+
+"""
+import threading
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import follow as fl
+from src.data import ingest as ig
+from src.data.load_dataset import load_processed
+from src.data.synthetic import write_traces
+import pytest
+
+@pytest.fixture
+def global_traces(tmp_path):
+    """Fixture used to pass synthetic raw files
+
+    Returns
+    -------
+    tuple
+        gpu.csv, application-checkpoints.csv and task-x-y.csv locations
+    """
+    return(write_traces(tmp_path, hosts=3, duration=600))
+
+def batch_dataset(gpu_csv, check_csv, task_csv):
+    """ Builds the final dataset of raw files in memory
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        final dataset sorted by task keys
+    """
+    gpu_df = md.clean_gpu(ig.read_gpu(gpu_csv))
+    check_task_df = md.clean_check_task(md.merge_check_task(
+            ig.read_checkpoints(check_csv), ig.read_tasks(task_csv)))
+    df = md.typed_processed(md.merge_check_task_gpu(gpu_df, check_task_df))
+    return(df.sort_values(['hostname', 'eventName', 'x', 'y', 'level'])
+           .reset_index(drop=True))
+
+def task_record(task, x, y, level=12):
+    """ Gives a task-x-y.csv record
+    """
+    return({'taskId': task, 'x': str(x), 'y': str(y), 'level': str(level)})
+
+def check_record(task, event_type, seconds, host='host-a', event='Render'):
+    """ Gives an application-checkpoints.csv record
+    """
+    return({'timestamp': '2018-11-08T07:41:{:02d}.000Z'.format(seconds),
+            'hostname': host, 'eventName': event, 'eventType': event_type,
+            'taskId': task})
+
+def gpu_record(seconds, power, host='host-a'):
+    """ Gives a gpu.csv record
+    """
+    return({'timestamp': '2018-11-08T07:41:{:02d}.000Z'.format(seconds),
+            'hostname': host, 'gpuUUID': 'GPU-a', 'powerDrawWatt': str(power),
+            'gpuTempC': '40', 'gpuUtilPerc': '', 'gpuMemUtilPerc': '5'})
+
+class TestLiveJoin(object):
+    """ Tests incremental pairing and emission
+
+    """
+
+    def test_emit_when_sampled(self):
+        """ Tests if an interval is only emitted once its host was sampled
+        past its stop, with the batch averages
+
+        """
+        join = fl.LiveJoin(capacity=8)
+        join.add_checkpoint(check_record('t1', 'START', 2))
+        join.add_task(task_record('t1', 1, 2))
+        join.add_checkpoint(check_record('t1', 'STOP', 5))
+        for second in range(1, 5):
+            join.add_sample(gpu_record(second, second * 10))
+        assert (len(join.emit()) == 0)
+
+        join.add_sample(gpu_record(6, 60))
+        tasks_df = join.emit()
+        assert (len(tasks_df) == 1)
+        assert (tasks_df['powerDrawWatt'][0] == 30)
+        assert (np.isnan(tasks_df['gpuUtilPerc'][0]))
+        assert (tasks_df['start_time'][0] ==
+                pd.Timestamp('2018-11-08 07:41:02'))
+        assert (len(join.emit()) == 0)
+
+    def test_issues(self):
+        """ Tests if unmatched and overlapping checkpoints are counted and
+        intervals outside the samples left out at the end
+
+        """
+        join = fl.LiveJoin()
+        join.add_task(task_record('t1', 1, 2))
+        join.add_checkpoint(check_record('t1', 'STOP', 1))
+        join.add_checkpoint(check_record('t1', 'START', 2))
+        join.add_checkpoint(check_record('t1', 'START', 3))
+        join.add_checkpoint(check_record('t1', 'STOP', 9))
+        join.add_checkpoint(check_record('t1', 'START', 10))
+        for second in range(2, 6):
+            join.add_sample(gpu_record(second, 1))
+
+        assert (len(join.finish()) == 0)
+        assert (join.issues['unmatched_stop'] == 1)
+        assert (join.issues['overlapping_start'] == 1)
+        assert (join.issues['unmatched_start'] == 1)
+
+    def test_waiting(self):
+        """ Tests if checkpoints waiting for their task are indexed by
+        taskId and dropped once the newest checkpoint is max_wait past them
+
+        """
+        join = fl.LiveJoin(max_wait=10)
+        join.add_checkpoint(check_record('t1', 'START', 1))
+        join.add_checkpoint(check_record('t2', 'START', 5))
+        join.add_checkpoint(check_record('t2', 'STOP', 8))
+        assert (sorted(join.waiting) == ['t1', 't2'])
+
+        join.add_task(task_record('t2', 3, 4))
+        assert (list(join.waiting) == ['t1'])
+        assert (len(join.closed) == 1)
+
+        join.add_checkpoint(check_record('t3', 'START', 12))
+        assert (list(join.waiting) == ['t3'])
+        assert (join.taskless == 1)
+
+        join.add_task(task_record('t1', 1, 2))
+        join.finish()
+        assert (join.taskless == 2)
+        assert (join.issues['unmatched_start'] == 0)
+
+    def test_ring_buffer(self):
+        """ Tests if only the latest samples are kept
+
+        """
+        ring = fl.SampleRing(capacity=4)
+        for second in range(6):
+            ring.append(second, 'GPU-a', [second] * 4)
+        values, uuids = ring.window(0, 10)
+        assert (list(values[:, 0]) == [2, 3, 4, 5])
+        assert (ring.covers(3))
+        assert (not ring.covers(1))
+
+@pytest.mark.usefixtures('global_traces')
+class TestFollow(object):
+    """ Tests following raw files against the batch build
+
+    """
+
+    def test_matches_batch(self, tmp_path, global_traces):
+        """ Tests if following finished files gives the final dataset
+
+        """
+        live_csv = tmp_path / 'live.csv'
+        written = fl.follow_dataset(*global_traces, output_file=live_csv,
+                                    poll_seconds=0.01, idle_seconds=0.2)
+        expected_df = batch_dataset(*global_traces)
+        live_df = load_processed(live_csv).sort_values(
+                ['hostname', 'eventName', 'x', 'y', 'level']).reset_index(
+                        drop=True)
+
+        assert (written == len(expected_df))
+        pd.testing.assert_frame_equal(live_df, expected_df,
+                                      check_dtype=False,
+                                      check_categorical=False, rtol=1e-6)
+
+    def test_growing_files(self, tmp_path, global_traces):
+        """ Tests if lines appended while following are picked up
+
+        """
+        sources = [path.read_text().splitlines(True)
+                   for path in map(Path, global_traces)]
+        growing = [tmp_path / ('growing-' + str(n)) for n in range(3)]
+        for path, lines in zip(growing, sources):
+            path.write_text(''.join(lines[:len(lines) // 2]))
+
+        def append_rest():
+            for path, lines in zip(growing, sources):
+                with open(str(path), 'a') as raw_file:
+                    raw_file.write(''.join(lines[len(lines) // 2:]))
+
+        writer = threading.Timer(0.1, append_rest)
+        writer.start()
+        written = fl.follow_dataset(*growing, output_file=tmp_path / 'l.csv',
+                                    poll_seconds=0.01, idle_seconds=0.5)
+        writer.join()
+
+        assert (written == len(batch_dataset(*global_traces)))
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the stage graph
+runner of the data preparation process
+
+Code
+------
+
+"""
+import threading
+from functools import partial
+from src.data import graph as gr
+from src.data import make_dataset as md
+from src.data.instrumentation import RunReport, instrumented
+import pytest
+
+@pytest.fixture
+def global_graph():
+    """Fixture used to pass a small stage graph with two independent
+    branches joined by a last stage
+
+    Returns
+    -------
+    dict
+        stage name to (function, list of stage names read)
+    """
+    return({'left': (lambda: 2, []),
+            'right': (lambda: 3, []),
+            'double': (lambda left: left * 2, ['left']),
+            'join': (lambda double, right: double + right,
+                     ['double', 'right']),
+            'unused': (lambda: 1 / 0, [])})
+
+@pytest.mark.usefixtures('global_graph')
+class TestGraph(object):
+    """ Tests stage ordering, concurrency and failures
+
+    """
+
+    def test_order(self, global_graph):
+        """ Tests if only the stages read by the targets run, after the
+        stages they read
+
+        """
+        order = gr.graph_order(global_graph, ['join'])
+        assert (set(order) == {'left', 'right', 'double', 'join'})
+        assert (order.index('double') > order.index('left'))
+        assert (order[-1] == 'join')
+        assert (gr.run_graph(global_graph, ['join'])['join'] == 7)
+
+    def test_bad_graph(self, global_graph):
+        """ Tests if unknown stages and cycles are refused
+
+        """
+        with pytest.raises(ValueError):
+            gr.graph_order(global_graph, ['missing'])
+        global_graph['left'] = (lambda join: join, ['join'])
+        with pytest.raises(ValueError):
+            gr.graph_order(global_graph, ['join'])
+
+    def test_failure(self, global_graph):
+        """ Tests if a stage error is raised by run_graph
+
+        """
+        with pytest.raises(ZeroDivisionError):
+            gr.run_graph(global_graph)
+
+    def test_branches_overlap(self):
+        """ Tests if independent branches run at the same time (each waits
+        for the other to start) and are reported as top level stages
+
+        """
+        barrier = threading.Barrier(2, timeout=5)
+
+        @instrumented
+        def branch(name):
+            barrier.wait()
+            return(name)
+
+        graph = {'gpu': (partial(branch, 'gpu'), []),
+                 'check_task': (partial(branch, 'check_task'), []),
+                 'merge': (lambda gpu, check_task: gpu + check_task,
+                           ['gpu', 'check_task'])}
+        with RunReport() as run:
+            outputs = gr.run_graph(graph)
+
+        assert (outputs['merge'] == 'gpucheck_task')
+        assert (run.stages['branch']['calls'] == 2)
+        assert (run.stages['branch']['depth'] == 0)
+
+    def test_processed_graph(self):
+        """ Tests if the gpu and checkpoints/tasks branches only meet at the
+        merge
+
+        """
+        graph = md.processed_graph(features=True, rollups=True)
+        gpu_branch = set(gr.graph_order(graph, ['clean_gpu']))
+        check_task_branch = set(gr.graph_order(graph, ['clean_check_task']))
+
+        assert (not gpu_branch & check_task_branch)
+        assert (set(graph['merge_check_task_gpu'][1]) ==
+                {'clean_gpu', 'clean_check_task'})
+        assert ('check_task_features' not in md.processed_graph(workers=2))
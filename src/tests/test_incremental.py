@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the incremental
+data preparation process
+
+Code
+------
+
+"""
+import os
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import incremental as inc
+from src.data import load_dataset as ld
+from src.data import ingest as ig
+import pytest
+
+def timestamps(seconds):
+    """ Formats seconds after the first sample as raw timestamps
+
+    Parameters
+    ----------
+    seconds
+        list of offsets in seconds
+
+    Returns
+    -------
+    list
+        timestamps in the raw TIMESTAMP_FORMAT
+    """
+    base = pd.Timestamp('2018-11-08 07:41:00')
+    return([(base + pd.Timedelta(seconds=second))
+            .strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+            for second in seconds])
+
+@pytest.fixture
+def global_raw():
+    """Fixture used to pass small raw gpu, checkpoints and tasks dataframes
+    (two hosts, ten tasks each, in time order)
+
+    Returns
+    -------
+    tuple
+        (gpu, checkpoints, tasks) dataframes
+    """
+    hosts = ['host-a', 'host-b']
+    seconds = range(200)
+    gpu_df = pd.DataFrame({
+        'timestamp': [stamp for stamp in timestamps(seconds)
+                      for host in hosts],
+        'hostname': hosts * len(seconds),
+        'gpuSerial': [0, 1] * len(seconds),
+        'gpuUUID': ['GPU-a', 'GPU-b'] * len(seconds),
+        'powerDrawWatt': [float(i % 97) for i in range(2 * len(seconds))],
+        'gpuTempC': [30 + i % 13 for i in range(2 * len(seconds))],
+        'gpuUtilPerc': [i % 100 for i in range(2 * len(seconds))],
+        'gpuMemUtilPerc': [i % 50 for i in range(2 * len(seconds))]})
+
+    rows = []
+    for task in range(10):
+        for host_id, host in enumerate(hosts):
+            start = 1 + task * 19 + host_id * 3
+            task_id = 'task-{}-{}'.format(host, task)
+            rows.append((start, host, 'TotalRender', 'START', task_id))
+            rows.append((start + 1, host, 'Render', 'START', task_id))
+            rows.append((start + 15, host, 'Render', 'STOP', task_id))
+            rows.append((start + 16, host, 'TotalRender', 'STOP', task_id))
+    rows.sort()
+    checkpoints_df = pd.DataFrame({
+        'timestamp': timestamps([row[0] for row in rows]),
+        'hostname': [row[1] for row in rows],
+        'eventName': [row[2] for row in rows],
+        'eventType': [row[3] for row in rows],
+        'jobId': 'job',
+        'taskId': [row[4] for row in rows]})
+
+    task_ids = sorted(set(checkpoints_df['taskId']))
+    tasks_df = pd.DataFrame({'taskId': task_ids, 'jobId': 'job',
+                             'x': range(len(task_ids)), 'y': 0,
+                             'level': 12})
+    return(gpu_df, checkpoints_df, tasks_df)
+
+def write_raw(directory, raw, until=None):
+    """ Writes the raw csv files, keeping rows before a cut off time
+
+    Parameters
+    ----------
+    directory
+        directory to write gpu.csv, application-checkpoints.csv and
+        task-x-y.csv to
+    raw
+        (gpu, checkpoints, tasks) dataframes
+    until
+        raw timestamp cut off, all rows if None
+
+    Returns
+    -------
+    list
+        gpu, checkpoints and tasks file locations
+    """
+    gpu_df, checkpoints_df, tasks_df = raw
+    if until is not None:
+        gpu_df = gpu_df[gpu_df['timestamp'] < until]
+        checkpoints_df = checkpoints_df[checkpoints_df['timestamp'] < until]
+    paths = [os.path.join(str(directory), name) for name in
+             ['gpu.csv', 'application-checkpoints.csv', 'task-x-y.csv']]
+    for df, path in zip([gpu_df, checkpoints_df, tasks_df], paths):
+        df.to_csv(path, index=False)
+    return(paths)
+
+def full_merge(paths):
+    """ Runs the in memory merge over typed raw csv files
+
+    Parameters
+    ----------
+    paths
+        gpu, checkpoints and tasks file locations
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        typed final dataframe sorted by task keys
+    """
+    final_df = md.merge_check_task_gpu(
+            md.clean_gpu(ig.read_gpu(paths[0])),
+            md.clean_check_task(md.merge_check_task(
+                    ig.read_checkpoints(paths[1]), ig.read_tasks(paths[2]))))
+    return(sort_tasks(md.typed_processed(final_df)))
+
+def sort_tasks(df):
+    """ Sorts a final dataframe by task keys
+
+    Parameters
+    ----------
+    df
+        final dataframe
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        sorted final dataframe
+    """
+    keys = ['hostname', 'eventName', 'x', 'y', 'level']
+    return(df.sort_values(keys).reset_index(drop=True))
+
+@pytest.mark.usefixtures('global_raw')
+class TestIncrementalBuild(object):
+    """ Tests incremental builds against full builds
+
+    """
+
+    def test_append(self, tmp_path, global_raw):
+        """ Tests if appended rows are merged like a full build would
+
+        """
+        output = str(tmp_path / 'processed.parquet')
+        cut = timestamps([90])[0]
+        paths = write_raw(tmp_path, global_raw, until=cut)
+        assert (inc.incremental_dataset(*paths, output, 'parquet') == 'full')
+
+        # Append the rest of the rows to the raw files
+
+        gpu_df, checkpoints_df, _ = global_raw
+        gpu_df[gpu_df['timestamp'] >= cut].to_csv(
+                paths[0], index=False, header=False, mode='a')
+        checkpoints_df[checkpoints_df['timestamp'] >= cut].to_csv(
+                paths[1], index=False, header=False, mode='a')
+        assert (inc.incremental_dataset(*paths, output, 'parquet') ==
+                'incremental')
+
+        pd.testing.assert_frame_equal(
+                sort_tasks(ld.load_processed(output)), full_merge(paths),
+                check_categorical=False)
+
+    def test_unchanged(self, tmp_path, global_raw):
+        """ Tests if a second build without new rows does nothing
+
+        """
+        output = str(tmp_path / 'processed.csv')
+        paths = write_raw(tmp_path, global_raw)
+        inc.incremental_dataset(*paths, output, 'csv')
+        assert (inc.incremental_dataset(*paths, output, 'csv') ==
+                'unchanged')
+
+    def test_rewrite(self, tmp_path, global_raw):
+        """ Tests if changed earlier rows force a full rebuild
+
+        """
+        output = str(tmp_path / 'processed.csv')
+        paths = write_raw(tmp_path, global_raw, until=timestamps([90])[0])
+        inc.incremental_dataset(*paths, output, 'csv')
+        gpu_df, checkpoints_df, tasks_df = global_raw
+        gpu_df = gpu_df.assign(powerDrawWatt=gpu_df['powerDrawWatt'] + 1)
+        paths = write_raw(tmp_path, (gpu_df, checkpoints_df, tasks_df))
+        assert (inc.incremental_dataset(*paths, output, 'csv') == 'full')
+        pd.testing.assert_frame_equal(
+                sort_tasks(ld.load_processed(output)), full_merge(paths),
+                check_categorical=False, check_dtype=False)
+
+    def test_middle_edit(self, tmp_path, monkeypatch, global_raw):
+        """ Tests if an edit between the first and last fingerprint blocks
+        of gpu.csv forces a full rebuild
+
+        """
+        monkeypatch.setattr(inc, 'FINGERPRINT_BYTES', 512)
+        output = str(tmp_path / 'processed.csv')
+        cut = timestamps([90])[0]
+        paths = write_raw(tmp_path, global_raw, until=cut)
+        inc.incremental_dataset(*paths, output, 'csv')
+
+        # Same size edit in the middle, then rows appended
+
+        with open(paths[0], 'rb') as raw_file:
+            data = raw_file.read()
+        middle = data.index(b'host-a', len(data) // 2)
+        with open(paths[0], 'wb') as raw_file:
+            raw_file.write(data[:middle] + b'host-b' +
+                           data[middle + len(b'host-a'):])
+        assert (len(data) > 8 * inc.FINGERPRINT_BYTES)
+        gpu_df, checkpoints_df, _ = global_raw
+        gpu_df[gpu_df['timestamp'] >= cut].to_csv(
+                paths[0], index=False, header=False, mode='a')
+        checkpoints_df[checkpoints_df['timestamp'] >= cut].to_csv(
+                paths[1], index=False, header=False, mode='a')
+
+        assert (inc.incremental_dataset(*paths, output, 'csv') == 'full')
+        pd.testing.assert_frame_equal(
+                sort_tasks(ld.load_processed(output)), full_merge(paths),
+                check_categorical=False, check_dtype=False)
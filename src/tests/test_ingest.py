@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the typed ingestion
+of the raw csv files
+
+Code
+------
+
+"""
+import bz2
+import gzip
+import io
+import lzma
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import ingest as ig
+from src.data.incremental import incremental_dataset
+from src.data.stage_cache import StageCache
+from src.data.synthetic import write_traces
+import pytest
+
+@pytest.fixture
+def global_raw_files(tmp_path):
+    """Fixture used to pass small synthetic raw csv files
+
+    Returns
+    -------
+    list
+        gpu, checkpoints and tasks file locations
+    """
+    return(write_traces(tmp_path, hosts=3, duration=600))
+
+@pytest.mark.usefixtures('global_raw_files')
+class TestTypedRead(object):
+    """ Tests reading the raw schemas
+
+    """
+
+    def test_gpu_dtypes(self, global_raw_files):
+        """ Tests if gpuSerial is skipped and columns are narrow
+
+        """
+        gpu_df = ig.read_gpu(global_raw_files[0], chunksize=100)
+        assert ('gpuSerial' not in gpu_df.columns)
+        assert (gpu_df['timestamp'].dtype == 'datetime64[ns]')
+        assert (gpu_df['hostname'].dtype.name == 'category')
+        assert (gpu_df['gpuTempC'].dtype == np.uint8)
+        assert (gpu_df['powerDrawWatt'].dtype == np.float32)
+
+    def test_chunks(self, global_raw_files):
+        """ Tests if chunked reads equal a single read and stay categorical
+
+        """
+        pd.testing.assert_frame_equal(
+                ig.read_checkpoints(global_raw_files[1], chunksize=7),
+                ig.read_checkpoints(global_raw_files[1]),
+                check_categorical=False)
+        assert (ig.read_checkpoints(global_raw_files[1], chunksize=7)
+                ['eventName'].dtype.name == 'category')
+
+    def test_matches_untyped(self, global_raw_files):
+        """ Tests if the final dataset equals the one of untyped reads (up
+        to float32 power readings)
+
+        """
+        gpu_csv, check_csv, task_csv = global_raw_files
+        typed_df = md.merge_check_task_gpu(
+                md.clean_gpu(ig.read_gpu(gpu_csv)),
+                md.clean_check_task(md.merge_check_task(
+                        ig.read_checkpoints(check_csv),
+                        ig.read_tasks(task_csv))))
+        untyped_df = md.merge_check_task_gpu(
+                md.clean_gpu(pd.read_csv(gpu_csv)),
+                md.clean_check_task(md.merge_check_task(
+                        pd.read_csv(check_csv), pd.read_csv(task_csv))))
+        pd.testing.assert_frame_equal(typed_df, untyped_df,
+                                      check_dtype=False,
+                                      check_categorical=False, rtol=1e-5)
+
+    def test_missing_integers(self):
+        """ Tests if integer metrics with missing values are read as floats
+
+        """
+        gpu_csv = io.StringIO(
+                'timestamp,hostname,gpuSerial,gpuUUID,powerDrawWatt,'
+                'gpuTempC,gpuUtilPerc,gpuMemUtilPerc\n'
+                '2018-11-08T07:41:55.921Z,host-a,0,GPU-a,25.5,,90,30\n')
+        gpu_df = ig.read_gpu(gpu_csv)
+        assert (gpu_df['gpuTempC'].dtype == np.float32)
+        assert (gpu_df['gpuTempC'].isnull().all())
+        assert (gpu_df['gpuUtilPerc'].dtype == np.uint8)
+
+    def test_bad_integers(self):
+        """ Tests if integer metrics failing to parse without missing values
+        are not read as floats
+
+        """
+        gpu_csv = io.StringIO(
+                'timestamp,hostname,gpuSerial,gpuUUID,powerDrawWatt,'
+                'gpuTempC,gpuUtilPerc,gpuMemUtilPerc\n'
+                '2018-11-08T07:41:55.921Z,host-a,0,GPU-a,25.5,40.5,,30\n')
+        with pytest.raises(ValueError):
+            ig.read_gpu(gpu_csv)
+
+def compress(path, suffix):
+    """ Writes a compressed copy of a raw file
+
+    Parameters
+    ----------
+    path
+        raw file location (pathlib.Path)
+    suffix
+        one of ingest.COMPRESSION_SUFFIXES
+
+    Returns
+    -------
+    pathlib.Path
+        compressed file location
+    """
+    data = path.read_bytes()
+    if suffix == '.zst':
+        data = pytest.importorskip('zstandard').ZstdCompressor().compress(
+                data)
+    else:
+        data = {'.gz': gzip, '.bz2': bz2, '.xz': lzma}[suffix].compress(data)
+    compressed = path.with_name(path.name + suffix)
+    compressed.write_bytes(data)
+    return(compressed)
+
+def split_parts(path, n_parts, suffix='.gz'):
+    """ Splits a raw file into compressed parts named <stem>-<n>.csv<suffix>,
+    each with the header
+
+    Parameters
+    ----------
+    path
+        raw file location (pathlib.Path)
+    n_parts
+        number of parts
+    suffix
+        compression suffix
+
+    Returns
+    -------
+    list
+        part locations in order
+    """
+    header, *lines = path.read_text().splitlines(True)
+    parts = []
+    for part in range(n_parts):
+        part_path = path.with_name('{}-{}.csv'.format(path.stem, part))
+        part_path.write_text(header + ''.join(lines[part::n_parts]))
+        parts.append(compress(part_path, suffix))
+        part_path.unlink()
+    return(parts)
+
+@pytest.mark.usefixtures('global_raw_files')
+class TestCompressedRead(object):
+    """ Tests reading compressed and multi-part raw files
+
+    """
+
+    @pytest.mark.parametrize('suffix', ig.COMPRESSION_SUFFIXES)
+    def test_compressed(self, tmp_path, global_raw_files, suffix):
+        """ Tests if a compressed file, or a missing plain file name found
+        compressed, reads like the plain file
+
+        """
+        gpu_csv = tmp_path / 'gpu.csv'
+        compressed = compress(gpu_csv, suffix)
+        expected_df = ig.read_gpu(gpu_csv)
+        pd.testing.assert_frame_equal(ig.read_gpu(compressed, chunksize=50),
+                                      expected_df)
+        gpu_csv.unlink()
+        pd.testing.assert_frame_equal(ig.read_gpu(gpu_csv), expected_df)
+
+    def test_parts(self, tmp_path, global_raw_files):
+        """ Tests if parts read in parallel and in chunks hold the rows of
+        the whole file, parts in natural order
+
+        """
+        gpu_csv = tmp_path / 'gpu.csv'
+        expected_df = ig.read_gpu(gpu_csv)
+        parts = split_parts(gpu_csv, 12)
+        gpu_csv.unlink()
+
+        assert (ig.raw_parts(gpu_csv) == [str(part) for part in parts])
+        pattern = str(tmp_path / 'gpu-*.csv.gz')
+        parts_df = ig.read_gpu(pattern)
+        pd.testing.assert_frame_equal(
+                ig.concat_chunks(list(ig.read_chunks(pattern, ig.GPU_SCHEMA,
+                                                     10))),
+                parts_df)
+
+        key = ['hostname', 'timestamp', 'gpuUUID']
+        pd.testing.assert_frame_equal(
+                parts_df.sort_values(key).reset_index(drop=True),
+                expected_df.sort_values(key).reset_index(drop=True),
+                check_categorical=False)
+        with pytest.raises(FileNotFoundError):
+            ig.raw_parts(tmp_path / 'missing.csv')
+
+    def test_cache_and_incremental(self, tmp_path, global_raw_files):
+        """ Tests if the stage cache hashes every part and incremental builds
+        refuse compressed files
+
+        """
+        gpu_csv, check_csv, task_csv = global_raw_files
+        parts = split_parts(tmp_path / 'gpu.csv', 3)
+        cache = StageCache(tmp_path / 'interim')
+        digest = cache.file_hash(tmp_path / 'gpu-*.csv.gz')
+        parts[1].write_bytes(gzip.compress(b'timestamp\n'))
+        assert (cache.file_hash(tmp_path / 'gpu-*.csv.gz') != digest)
+
+        with pytest.raises(ValueError):
+            incremental_dataset(parts[0], check_csv, task_csv,
+                                tmp_path / 'processed.csv')
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the instrumentation
+of the data preparation process
+
+Code
+------
+
+"""
+import json
+import logging
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import instrumentation as ins
+from src.data.synthetic import write_traces
+
+@ins.instrumented
+def inner(df):
+    """ Instrumented test stage allocating a megabyte
+
+    """
+    return(pd.DataFrame({'a': np.ones(1 << 17)}).head(len(df) // 2))
+
+@ins.instrumented
+def outer(df):
+    """ Instrumented test stage calling inner twice
+
+    """
+    return(pd.concat([inner(df), inner(df)]))
+
+class TestInstrumented(object):
+    """ Tests per call records and run report summaries
+
+    """
+
+    def test_rows(self, caplog):
+        """ Tests if calls are logged with their rows in and out
+
+        """
+        caplog.set_level(logging.DEBUG)
+        outer(pd.DataFrame({'a': range(10)}))
+        metrics = {record.stage_metrics['stage']: record.stage_metrics
+                   for record in caplog.records}
+        assert (metrics['inner']['rows_in'] == 10)
+        assert (metrics['inner']['rows_out'] == 5)
+        assert (metrics['inner']['depth'] == 1)
+        assert (metrics['outer']['rows_out'] == 10)
+
+    def test_report(self):
+        """ Tests if calls are summed per stage with traced peaks
+
+        """
+        with ins.RunReport(trace_memory=True) as run:
+            outer(pd.DataFrame({'a': range(10)}))
+        stages = run.to_dict()['stages']
+        assert (stages['inner']['calls'] == 2)
+        assert (stages['outer']['depth'] == 0)
+        assert (stages['inner']['traced_peak_bytes'] >= 1 << 20)
+        assert (stages['outer']['traced_peak_bytes'] >=
+                stages['inner']['traced_peak_bytes'])
+        assert (stages['outer']['seconds'] >= stages['inner']['seconds'])
+
+    def test_main_report(self, tmp_path, monkeypatch):
+        """ Tests if main writes a run report beside the final dataset
+
+        """
+        gpu_csv, check_csv, task_csv = write_traces(tmp_path, hosts=2,
+                                                    duration=300)
+        output_file = str(tmp_path / 'processed.csv')
+        monkeypatch.setattr(md, 'GPU_CSV_FILE', gpu_csv)
+        monkeypatch.setattr(md, 'CHECK_CSV_FILE', check_csv)
+        monkeypatch.setattr(md, 'TASK_CSV_FILE', task_csv)
+        monkeypatch.setattr(md, 'PROCESSED_FILES', {'csv': output_file})
+        monkeypatch.setattr(md, 'FEATURES_FILES',
+                            {'csv': str(tmp_path / 'features.csv')})
+        monkeypatch.setattr(md, 'STRAGGLERS_FILES',
+                            {'csv': str(tmp_path / 'stragglers.csv')})
+        monkeypatch.setattr(md, 'ROLLUP_DIR', str(tmp_path / 'rollups'))
+        md.main(cache=False, report=True, features=True, rollups=True,
+                stragglers=True)
+        with open(md.report_file(output_file)) as json_file:
+            report = json.load(json_file)
+        for stage in ['read_gpu', 'read_checkpoints', 'read_tasks',
+                      'timestamp_conv', 'clean_gpu', 'merge_check_task',
+                      'pair_check_task', 'interval_sums',
+                      'aggregate_intervals', 'task_features',
+                      'build_rollups', 'find_stragglers',
+                      'save_processed']:
+            assert (stage in report['stages'])
+        assert (report['stages']['read_gpu']['depth'] == 0)
+        assert (report['stages']['timestamp_conv']['depth'] == 1)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the sorted interval
+join used in the data preparation process
+
+Code
+------
+
+"""
+import pandas as pd
+import numpy as np
+from src.data import make_dataset as md
+from src.data import interval_join as ij
+import pytest
+
+@pytest.fixture
+def global_gpu():
+    """Fixture used to pass a small cleaned GPU dataframe (two hosts, one
+    sample every second)
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        GPU dataframe
+    """
+    times = pd.date_range('2018-11-08 07:41:00', periods=20, freq='s')
+    gpu_df = pd.DataFrame({
+        'timestamp': list(times) * 2,
+        'hostname': ['host-a'] * 20 + ['host-b'] * 20,
+        'gpuUUID': ['GPU-a'] * 20 + ['GPU-b'] * 20,
+        'powerDrawWatt': np.arange(40, dtype=float),
+        'gpuTempC': np.arange(40) % 7 + 30,
+        'gpuUtilPerc': np.arange(40) % 11,
+        'gpuMemUtilPerc': np.arange(40) % 5})
+    return(gpu_df.sort_values('timestamp', kind='mergesort')
+           .reset_index(drop=True))
+
+@pytest.fixture
+def global_check_task_df():
+    """Fixture used to pass a small cleaned checkpoints and tasks dataframe,
+    including a task retried twice on the same tile
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        application checkpoints and tasks cleaned dataframe
+    """
+    base = pd.Timestamp('2018-11-08 07:41:00')
+    rows = [
+        ('host-a', 'Render', 'START', 2, 1, 1, 12),
+        ('host-a', 'Render', 'STOP', 6, 1, 1, 12),
+        ('host-a', 'Tiling', 'START', 6.5, 1, 1, 12),
+        ('host-a', 'Tiling', 'STOP', 6.7, 1, 1, 12),
+        ('host-b', 'Render', 'START', 1, 2, 3, 12),
+        ('host-b', 'Render', 'STOP', 4, 2, 3, 12),
+        ('host-b', 'Render', 'START', 10, 2, 3, 12),
+        ('host-b', 'Render', 'STOP', 12, 2, 3, 12)]
+    return(pd.DataFrame({
+        'timestamp': [base + pd.Timedelta(seconds=row[3]) for row in rows],
+        'hostname': [row[0] for row in rows],
+        'eventName': [row[1] for row in rows],
+        'eventType': [row[2] for row in rows],
+        'x': [row[4] for row in rows],
+        'y': [row[5] for row in rows],
+        'level': [row[6] for row in rows]}))
+
+def sorted_tasks(df):
+    """ Sorts a final dataframe by task keys with parsed times for comparison
+
+    Parameters
+    ----------
+    df
+        final merged dataframe
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        sorted dataframe
+    """
+    df = df.copy()
+    for col in ['start_time', 'stop_time']:
+        df[col] = pd.to_datetime(df[col].astype(str))
+    return(df.sort_values(ij.TASK_KEYS).reset_index(drop=True))
+
+@pytest.mark.usefixtures('global_gpu', 'global_check_task_df')
+class TestIntervalJoin(object):
+    """ Tests the sorted interval join against the sqlite reference join
+
+    """
+
+    def test_matches_sqlite(self, global_gpu, global_check_task_df):
+        """ Tests if both engines produce the same per task aggregates
+
+        """
+        interval_df = md.merge_check_task_gpu(
+                global_gpu.copy(), global_check_task_df.copy(),
+                engine='interval')
+        sqlite_df = md.merge_check_task_gpu(
+                global_gpu.copy(), global_check_task_df.copy(),
+                engine='sqlite')
+        pd.testing.assert_frame_equal(sorted_tasks(interval_df),
+                                      sorted_tasks(sqlite_df),
+                                      check_dtype=False)
+
+    def test_empty_interval_dropped(self, global_gpu, global_check_task_df):
+        """ Tests if intervals without gpu samples are left out
+
+        """
+        merged_df = md.merge_check_task_gpu(global_gpu, global_check_task_df)
+        assert not (merged_df['eventName'] == 'Tiling').any()
+
+    def test_retried_task_pooled(self, global_gpu, global_check_task_df):
+        """ Tests if each attempt of a retried tile is paired once and the
+        attempts are averaged together
+
+        """
+        merged_df = md.merge_check_task_gpu(global_gpu, global_check_task_df)
+        host_b = merged_df[merged_df['hostname'] == 'host-b']
+        assert (len(host_b) == 1)
+        assert (host_b['powerDrawWatt'].iloc[0] ==
+                np.mean(list(range(21, 25)) + list(range(30, 33))))
+
+    def test_unknown_engine(self, global_gpu, global_check_task_df):
+        """ Tests if an unknown engine is rejected
+
+        """
+        with pytest.raises(ValueError):
+            md.merge_check_task_gpu(global_gpu, global_check_task_df,
+                                    engine='nested-loop')
+
+    def test_sqlite_order(self, global_gpu, global_check_task_df):
+        """ Tests if the sqlite join aggregating in sql keeps the interval
+        join row order and first times
+
+        """
+        interval_df = md.merge_check_task_gpu(global_gpu,
+                                              global_check_task_df)
+        sqlite_df = md.merge_check_task_gpu(global_gpu, global_check_task_df,
+                                            engine='sqlite')
+        pd.testing.assert_frame_equal(interval_df.reset_index(drop=True),
+                                      sqlite_df, check_dtype=False)
+
+    def test_keep_joined(self, global_gpu, global_check_task_df):
+        """ Tests if joined rows are only returned when asked for and
+        average to the final dataset
+
+        """
+        merged_df, joined_df = md.merge_check_task_gpu(
+                global_gpu, global_check_task_df, keep_joined=True)
+        assert (len(joined_df) == 5 + 4 + 3)
+        assert ((joined_df['timestamp'] >= joined_df['start_time']).all())
+        means = joined_df.groupby(ij.TASK_KEYS, sort=False)[
+                ij.GPU_METRICS].mean().reset_index()
+        pd.testing.assert_frame_equal(means,
+                                      merged_df[ij.TASK_KEYS + ij.GPU_METRICS])
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test saving and loading
+the final (processed) dataset
+
+Code
+------
+
+"""
+import os
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import load_dataset as ld
+import pytest
+
+@pytest.fixture
+def global_processed_df():
+    """Fixture used to pass a small final dataframe as produced by the
+    merge (timestamps as text, like the sqlite join used to return)
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        final dataframe
+    """
+    return(pd.DataFrame({
+        'hostname': ['host-a', 'host-a', 'host-b'],
+        'eventName': ['Render', 'TotalRender', 'Render'],
+        'x': [1, 1, 2], 'y': [3, 3, 4], 'level': [12, 12, 12],
+        'powerDrawWatt': [120.5, 110.25, 98.0],
+        'gpuTempC': [40.0, 39.5, 35.0],
+        'gpuUtilPerc': [90.0, 80.0, 85.5],
+        'gpuMemUtilPerc': [40.0, 35.0, 30.0],
+        'start_time': ['2018-11-08 07:41:05.100000', '2018-11-08 07:41:05',
+                       '2018-11-08 07:41:06.500000'],
+        'stop_time': ['2018-11-08 07:41:45.100000', '2018-11-08 07:41:50',
+                      '2018-11-08 07:41:36.500000'],
+        'gpuUUID': ['GPU-a', 'GPU-a', 'GPU-b']}))
+
+@pytest.mark.usefixtures('global_processed_df')
+class TestProcessedRoundTrip(object):
+    """ Tests writing then loading the final dataset in every format
+
+    """
+
+    @pytest.mark.parametrize('output_format', ['csv', 'parquet', 'feather'])
+    def test_types(self, tmp_path, global_processed_df, output_format):
+        """ Tests if timestamps and categoricals come back typed
+
+        """
+        path = str(tmp_path / ('processed.' + output_format))
+        md.save_processed(global_processed_df, path, output_format)
+        df = ld.load_processed(path)
+        assert (df['start_time'].dtype == 'datetime64[ns]')
+        assert (df['hostname'].dtype.name == 'category')
+        assert (df['start_time'][1] == pd.Timestamp('2018-11-08 07:41:05'))
+
+    def test_columns(self, tmp_path, global_processed_df):
+        """ Tests if only the requested columns are read
+
+        """
+        path = str(tmp_path / 'processed.parquet')
+        md.save_processed(global_processed_df, path, 'parquet')
+        df = ld.load_processed(path, columns=['eventName', 'gpuTempC'])
+        assert (list(df.columns) == ['eventName', 'gpuTempC'])
+
+    def test_unknown_format(self, global_processed_df):
+        """ Tests if an unknown extension is rejected
+
+        """
+        with pytest.raises(ValueError):
+            ld.load_processed('processed.xlsx')
+
+    def test_built_file(self, tmp_path, monkeypatch, global_processed_df):
+        """ Tests if the loaders default to the file the last build wrote,
+        csv when there is none
+
+        """
+        files = {output_format: str(tmp_path / ('processed.' +
+                                                output_format))
+                 for output_format in ['csv', 'parquet', 'feather']}
+        monkeypatch.setattr(md, 'PROCESSED_FILES', files)
+        assert (ld.built_file(files) == files['csv'])
+
+        md.save_processed(global_processed_df, files['csv'], 'csv')
+        assert (ld.built_file(files) == files['csv'])
+        assert (len(ld.load_processed()) == len(global_processed_df))
+        md.save_processed(global_processed_df, files['parquet'], 'parquet')
+        os.utime(files['csv'], (0, 0))
+        assert (ld.built_file(files) == files['parquet'])
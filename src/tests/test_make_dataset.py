@@ -12,50 +12,64 @@ Code
 """
 import pandas as pd
 from src.data import make_dataset as md
+from src.data import ingest as ig
 import pytest
 from datetime import datetime
 
-BASE_RAW_DATA_DIR = 'data/raw'
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
 """
-str: Base raw data directory
+str: string used to format timestamp for ms sinc epoch conversion
 """
 
-GPU_CSV_FILE = BASE_RAW_DATA_DIR + '/gpu.csv'
-"""
-str: gpu.csv file location 
-"""
+def naive_merge_check_task_gpu(gpu_df, check_task_df):
+    """ Original join kept as a naive reference for the engines: START and
+    STOP checkpoints merged on the task keys, tasks outside the gpu samples
+    dropped, gpu samples merged on hostname and filtered between the task
+    times, then averaged per task
 
-CHECK_CSV_FILE = BASE_RAW_DATA_DIR +  '/application-checkpoints.csv'
-"""
-str: application-checkpoints.csv filename file location 
-"""
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        per task averages
+    """
+    keys = ['hostname', 'eventName', 'x', 'y', 'level']
+    start_df, stop_df = [
+            check_task_df[check_task_df['eventType'] == event_type]
+            .drop(columns='eventType').rename(columns={'timestamp': name})
+            for event_type, name in [('START', 'start_time'),
+                                     ('STOP', 'stop_time')]]
+    task_df = pd.merge(start_df, stop_df, on=keys)
+    task_df = task_df[(task_df['start_time'] >= gpu_df['timestamp'].min()) &
+                      (task_df['stop_time'] <= gpu_df['timestamp'].max())]
 
-TASK_CSV_FILE = BASE_RAW_DATA_DIR + '/task-x-y.csv'
-"""
-str: task-x-y.csv file location 
-"""
+    joined_df = pd.merge(gpu_df, task_df, on='hostname')
+    joined_df = joined_df[
+            (joined_df['timestamp'] >= joined_df['start_time']) &
+            (joined_df['timestamp'] <= joined_df['stop_time'])]
 
-TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
-"""
-str: string used to format timestamp for ms sinc epoch conversion
-"""
+    functions = {
+        'powerDrawWatt': 'mean', 'gpuTempC': 'mean',
+        'gpuUtilPerc': 'mean', 'gpuMemUtilPerc': 'mean',
+        'start_time': 'first', 'stop_time': 'first',
+        'gpuUUID': 'first'}
+    return(joined_df.groupby(keys, as_index=False, sort=False,
+                             observed=True).agg(functions))
 
 @pytest.fixture
-def global_gpu():
-    """Fixture used to pass GPU dataset
+def global_gpu(global_sample_raw):
+    """Fixture used to pass GPU dataset (of the miniature raw dataset, see
+    conftest)
     
     Returns
     -------
     pandas.core.frame.DataFrame
         GPU dataframe
     """
-    
-    GPU_DF = pd.read_csv(GPU_CSV_FILE)
-    return(GPU_DF.copy())
+    return(global_sample_raw['gpu'].copy())
 
    
 @pytest.fixture
-def global_checkpoints():
+def global_checkpoints(global_sample_raw):
     """Fixture used to pass application checkpoint dataset
        
     Returns
@@ -63,12 +77,10 @@ def global_checkpoints():
     pandas.core.frame.DataFrame
         application checkpoints dataframe
     """
-
-    CHECK_DF = pd.read_csv(CHECK_CSV_FILE)
-    return(CHECK_DF.copy())
+    return(global_sample_raw['checkpoints'].copy())
   
 @pytest.fixture
-def global_tasks():
+def global_tasks(global_sample_raw):
     """Fixture used to pass the tasks dataset
     
     Returns
@@ -76,40 +88,31 @@ def global_tasks():
     pandas.core.frame.DataFrame
         tasks dataframe
     """
-    TASK_DF = pd.read_csv(TASK_CSV_FILE)
-    return(TASK_DF.copy())
+    return(global_sample_raw['tasks'].copy())
     
 @pytest.fixture
-def global_check_task_df():
+def global_check_task_df(global_sample_check_task):
     """Fixture used to pass the application and tasks merged dataframe
+    (built once per test session)
     
     Returns
     -------
     pandas.core.frame.DataFrame
         application and tasks merged dataframe
     """
-
-    CHECK_TASK_DF = md.merge_check_task(pd.read_csv(CHECK_CSV_FILE),
-                                        pd.read_csv(TASK_CSV_FILE))
-    return(CHECK_TASK_DF.copy())
+    return(global_sample_check_task.copy())
     
 @pytest.fixture
-def global_check_task_gpu_df():
+def global_check_task_gpu_df(global_sample_check_task_gpu):
     """Fixture used to pass the application, tasks and gpu merged dataframe
+    (built once per test session)
     
     Returns
     -------
     pandas.core.frame.DataFrame
         application, tasks and gpu final merged dataframe
     """
-    FINAL_MERGED_DF = md.merge_check_task_gpu(
-                md.clean_gpu(pd.read_csv(GPU_CSV_FILE)),
-                md.clean_check_task(md.merge_check_task(
-                        pd.read_csv(CHECK_CSV_FILE),
-                        pd.read_csv(TASK_CSV_FILE)
-                                   ))
-                        )
-    return(FINAL_MERGED_DF.copy())    
+    return(global_sample_check_task_gpu.copy())
             
 @pytest.fixture
 def global_check_task_merge_col_count():
@@ -225,3 +228,84 @@ class TestCheckTaskGPUMerge(object):
         """
         assert not (global_check_task_gpu_df.isnull().values.any())
         
+
+class TestTimestampConv(object):
+    """ Tests vectorized timestamp parsing
+
+    """
+
+    def test_datetime64(self):
+        """ Tests if fixed format timestamps become a datetime64 column
+
+        """
+        timestamps = pd.Series(['2018-11-08T07:41:55.921Z',
+                                '2018-11-08T08:27:10.314Z'])
+        converted = md.timestamp_conv(timestamps)
+        assert (converted.dtype == 'datetime64[ns]')
+        assert (converted[1] == datetime(2018, 11, 8, 8, 27, 10, 314000))
+
+    def test_pydatetime(self):
+        """ Tests if the compatibility switch returns python datetimes
+
+        """
+        timestamps = pd.Series(['2018-11-08T07:41:55.921Z'])
+        converted = md.timestamp_conv(timestamps, as_pydatetime=True)
+        assert (converted.dtype == object)
+        assert (type(converted[0]) is datetime)
+
+    def test_malformed(self):
+        """ Tests if malformed rows are reported
+
+        """
+        timestamps = pd.Series(['2018-11-08T07:41:55.921Z',
+                                '2018-11-08 07:41'])
+        with pytest.raises(ValueError, match='2018-11-08 07:41'):
+            md.timestamp_conv(timestamps)
+
+@pytest.mark.usefixtures('global_gpu', 'global_checkpoints', 'global_tasks')
+class TestFastEngines(object):
+    """ Tests the fast engines against their reference implementations on
+    the miniature raw dataset
+
+    """
+
+    def test_timestamp_conv(self, global_checkpoints):
+        """ Tests if vectorized parsing gives the strptime datetimes
+
+        """
+        timestamps = global_checkpoints['timestamp']
+        expected = timestamps.apply(
+                lambda text: datetime.strptime(text, TIMESTAMP_FORMAT))
+        converted = md.timestamp_conv(timestamps)
+        assert ((converted == pd.to_datetime(expected)).all())
+        assert ((md.timestamp_conv(timestamps, as_pydatetime=True) ==
+                 expected).all())
+
+    def test_typed_read(self, global_sample_files, global_gpu):
+        """ Tests if the typed reader gives the pandas read_csv values
+
+        """
+        gpu_df = ig.read_gpu(global_sample_files[0])
+        for col in ['hostname', 'gpuUUID']:
+            assert ((gpu_df[col].astype(str) == global_gpu[col]).all())
+        pd.testing.assert_series_equal(
+                gpu_df['powerDrawWatt'].astype(float),
+                global_gpu['powerDrawWatt'].astype(float))
+
+    def test_interval_join(self, global_gpu, global_checkpoints,
+                           global_tasks):
+        """ Tests if every join engine gives the averages of the original
+        naive join
+
+        """
+        gpu_df = md.clean_gpu(global_gpu)
+        check_task_df = md.clean_check_task(md.merge_check_task(
+                global_checkpoints, global_tasks))
+        reference_df = naive_merge_check_task_gpu(gpu_df, check_task_df)
+        assert (len(reference_df) > 0)
+        for engine in md.MERGE_ENGINES:
+            merged_df = md.merge_check_task_gpu(gpu_df, check_task_df,
+                                                engine=engine)
+            pd.testing.assert_frame_equal(merged_df, reference_df,
+                                          check_dtype=False,
+                                          check_categorical=False)
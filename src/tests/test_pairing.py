@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the START/STOP
+checkpoint pairing
+
+Code
+------
+
+"""
+import pandas as pd
+from src.data import pairing as pr
+import pytest
+
+def checkpoints(events):
+    """ Builds a cleaned checkpoints dataframe for one tile
+
+    Parameters
+    ----------
+    events
+        list of (seconds, eventType) tuples, in file order
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        cleaned application checkpoints and tasks dataframe
+    """
+    base = pd.Timestamp('2018-11-08 07:41:00')
+    return(pd.DataFrame({
+        'timestamp': [base + pd.Timedelta(seconds=event[0])
+                      for event in events],
+        'hostname': 'host-a', 'eventName': 'Render',
+        'eventType': [event[1] for event in events],
+        'x': 1, 'y': 2, 'level': 12}))
+
+@pytest.fixture
+def global_retried_df():
+    """Fixture used to pass the checkpoints of a tile rendered three times,
+    logged out of order
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        cleaned application checkpoints and tasks dataframe
+    """
+    return(checkpoints([(20, 'START'), (0, 'START'), (25, 'STOP'),
+                        (5, 'STOP'), (10, 'START'), (15, 'STOP')]))
+
+@pytest.mark.usefixtures('global_retried_df')
+class TestPairEvents(object):
+    """ Tests START/STOP pairing
+
+    """
+
+    def test_one_interval_per_attempt(self, global_retried_df):
+        """ Tests if every attempt gives exactly one interval
+
+        """
+        intervals_df, issues_df = pr.pair_events(global_retried_df)
+        durations = (intervals_df['stop_time'] -
+                     intervals_df['start_time']).dt.total_seconds()
+        assert (list(durations) == [5, 5, 5])
+        assert (len(issues_df) == 0)
+
+    def test_start_row_order(self, global_retried_df):
+        """ Tests if intervals keep the order of their START rows
+
+        """
+        intervals_df = pr.pair_events(global_retried_df)[0]
+        assert (list(intervals_df['start_time'].dt.second) == [20, 0, 10])
+        assert (list(intervals_df.columns) ==
+                ['start_time', 'hostname', 'eventName', 'x', 'y', 'level',
+                 'stop_time'])
+
+    def test_issues(self):
+        """ Tests if orphaned and overlapping events are reported
+
+        """
+        check_task_df = checkpoints([(0, 'STOP'), (5, 'START'), (6, 'START'),
+                                     (9, 'STOP'), (12, 'START')])
+        intervals_df, issues_df = pr.pair_events(check_task_df)
+        assert (len(intervals_df) == 1)
+        assert (intervals_df['start_time'][0].second == 6)
+        assert (list(issues_df['issue']) ==
+                ['unmatched_stop', 'overlapping_start', 'unmatched_start'])
+        assert (pr.issue_counts(issues_df) ==
+                {'overlapping_start': 1, 'unmatched_start': 1,
+                 'unmatched_stop': 1})
+
+    def test_zero_length(self):
+        """ Tests if a task starting and stopping at the same time pairs
+        whatever its rows order in the file
+
+        """
+        for events in [[(3, 'START'), (3, 'STOP')],
+                       [(3, 'STOP'), (3, 'START')]]:
+            intervals_df, issues_df = pr.pair_events(checkpoints(events))
+            assert (len(intervals_df) == 1)
+            assert (len(issues_df) == 0)
+
+    def test_linear_rows(self):
+        """ Tests if a tile retried many times gives as many intervals as
+        attempts (no START/STOP cross product)
+
+        """
+        events = []
+        for attempt in range(500):
+            events += [(attempt * 10, 'START'), (attempt * 10 + 5, 'STOP')]
+        intervals_df = pr.pair_events(checkpoints(events))[0]
+        assert (len(intervals_df) == 500)
+
+    def test_missing_keys(self):
+        """ Tests if checkpoints of tasks without tiles still pair
+
+        """
+        check_task_df = checkpoints([(0, 'START'), (5, 'STOP')])
+        check_task_df['x'] = float('nan')
+        assert (len(pr.pair_events(check_task_df)[0]) == 1)
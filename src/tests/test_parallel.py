@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the multi-core
+(host sharded) data preparation process
+
+Code
+------
+
+"""
+import pandas as pd
+import numpy as np
+from src.data import make_dataset as md
+from src.data import parallel as par
+import pytest
+
+@pytest.fixture
+def global_gpu():
+    """Fixture used to pass a small raw GPU dataframe (four hosts, one
+    sample every second, timestamps as text)
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        GPU dataframe
+    """
+    rng = np.random.RandomState(1)
+    times = pd.date_range('2018-11-08 07:41:00', periods=60, freq='s')
+    hosts = ['host-a', 'host-b', 'host-c', 'host-d']
+    rows = len(times) * len(hosts)
+    return(pd.DataFrame({
+        'timestamp': np.repeat(times.strftime('%Y-%m-%dT%H:%M:%S.%f')
+                               .str.slice(0, -3) + 'Z', len(hosts)),
+        'hostname': hosts * len(times),
+        'gpuSerial': list(range(len(hosts))) * len(times),
+        'gpuUUID': [host.replace('host', 'GPU') for host in hosts] *
+                   len(times),
+        'powerDrawWatt': rng.uniform(25, 200, rows),
+        'gpuTempC': rng.randint(30, 50, rows),
+        'gpuUtilPerc': rng.randint(0, 100, rows),
+        'gpuMemUtilPerc': rng.randint(0, 60, rows)}))
+
+@pytest.fixture
+def global_check_task_df():
+    """Fixture used to pass a small raw merged checkpoints and tasks
+    dataframe, with one task starting before the gpu dataset
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        application checkpoints and tasks merged dataframe
+    """
+    base = pd.Timestamp('2018-11-08 07:41:00')
+    rows = []
+    for host_id, host in enumerate(['host-a', 'host-b', 'host-c', 'host-d']):
+        for task in range(4):
+            start = task * 14 + host_id - 1.5
+            for event_type, offset in [('START', 0), ('STOP', 12)]:
+                rows.append((start + offset, host, event_type, task))
+    return(pd.DataFrame({
+        'timestamp': [(base + pd.Timedelta(seconds=row[0]))
+                      .strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+                      for row in rows],
+        'hostname': [row[1] for row in rows],
+        'eventName': 'Render',
+        'eventType': [row[2] for row in rows],
+        'jobId': 'job',
+        'taskId': [row[3] for row in rows],
+        'x': [row[3] for row in rows],
+        'y': 0,
+        'level': 12}))
+
+@pytest.mark.usefixtures('global_gpu', 'global_check_task_df')
+class TestParallelMerge(object):
+    """ Tests the host sharded merge against the single process merge
+
+    """
+
+    def test_matches_serial(self, global_gpu, global_check_task_df):
+        """ Tests if sharding gives the same per task averages
+
+        """
+        serial_df = md.merge_check_task_gpu(
+                md.clean_gpu(global_gpu.copy()),
+                md.clean_check_task(global_check_task_df.copy()))
+        parallel_df = par.parallel_merge(global_gpu.copy(),
+                                         global_check_task_df.copy(),
+                                         workers=3)
+        keys = ['hostname', 'eventName', 'x', 'y', 'level']
+        pd.testing.assert_frame_equal(
+                parallel_df.sort_values(keys).reset_index(drop=True),
+                serial_df.sort_values(keys).reset_index(drop=True))
+
+    def test_unsorted(self, global_gpu, global_check_task_df):
+        """ Tests if gpu rows out of time order give the single process
+        tasks, and no gpu rows no tasks
+
+        """
+        gpu_df = global_gpu.sample(frac=1, random_state=0)
+        serial_df = md.merge_check_task_gpu(
+                md.clean_gpu(gpu_df.copy()),
+                md.clean_check_task(global_check_task_df.copy()))
+        parallel_df = par.parallel_merge(gpu_df.copy(),
+                                         global_check_task_df.copy(),
+                                         workers=2)
+        keys = ['hostname', 'eventName', 'x', 'y', 'level']
+        assert (len(parallel_df) == len(md.merge_check_task_gpu(
+                md.clean_gpu(global_gpu.copy()),
+                md.clean_check_task(global_check_task_df.copy()))))
+        pd.testing.assert_frame_equal(
+                parallel_df.sort_values(keys).reset_index(drop=True),
+                serial_df.sort_values(keys).reset_index(drop=True))
+        assert (len(par.parallel_merge(global_gpu.iloc[:0],
+                                       global_check_task_df.copy(),
+                                       workers=2)) == 0)
+
+    def test_deterministic(self, global_gpu, global_check_task_df):
+        """ Tests if two runs give the same row order
+
+        """
+        first_df = par.parallel_merge(global_gpu.copy(),
+                                      global_check_task_df.copy(), workers=2)
+        second_df = par.parallel_merge(global_gpu.copy(),
+                                       global_check_task_df.copy(), workers=2)
+        pd.testing.assert_frame_equal(first_df, second_df)
+
+class TestShardHosts(object):
+    """ Tests host to shard assignment
+
+    """
+
+    def test_balanced(self):
+        """ Tests if shards get similar row counts
+
+        """
+        counts = pd.Series({'a': 8, 'b': 7, 'c': 5, 'd': 4})
+        assignment = par.shard_hosts(counts, 2)
+        loads = counts.groupby(pd.Series(assignment)).sum()
+        assert (sorted(loads) == [12, 12])
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the out-of-core
+(partitioned) data preparation process
+
+Code
+------
+
+"""
+import os
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import ingest as ig
+from src.data import partitioned as pt
+import pytest
+
+def in_memory_dataset(gpu_csv, check_csv, task_csv):
+    """ Builds the final dataset of raw files in memory
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        final dataset
+    """
+    gpu_df = md.clean_gpu(ig.read_gpu(gpu_csv))
+    check_task_df = md.clean_check_task(md.merge_check_task(
+            ig.read_checkpoints(check_csv), ig.read_tasks(task_csv)))
+    return(md.merge_check_task_gpu(gpu_df, check_task_df))
+
+def assert_identical(partitioned_df, expected_df):
+    """ Checks two final datasets hold exactly the same rows in the same
+    order
+    """
+    pd.testing.assert_frame_equal(partitioned_df.reset_index(drop=True),
+                                  expected_df.reset_index(drop=True),
+                                  check_exact=True, check_categorical=False)
+
+@pytest.mark.usefixtures('global_sample_files')
+class TestPartitioned(object):
+    """ Tests partitioned builds against in memory builds
+
+    """
+
+    def test_identical(self, tmp_path, global_sample_files):
+        """ Tests if small partitions and chunks give the in memory final
+        dataset, intervals spanning windows included
+
+        """
+        partitioned_df = pt.partitioned_dataset(
+                *global_sample_files, spill_dir=tmp_path, n_buckets=3,
+                window_seconds=120, chunksize=2000)
+        assert (len(partitioned_df) > 0)
+        assert_identical(partitioned_df,
+                         in_memory_dataset(*global_sample_files))
+        assert (os.listdir(str(tmp_path)) == [])
+
+    def test_unsorted_gpu(self, tmp_path, global_sample_files):
+        """ Tests if gpu rows out of time order give the in memory final
+        dataset
+
+        """
+        gpu_csv = tmp_path / 'gpu.csv'
+        pd.read_csv(str(global_sample_files[0])).sample(
+                frac=1, random_state=0).to_csv(str(gpu_csv), index=False)
+        raw_files = [str(gpu_csv)] + list(global_sample_files[1:])
+
+        partitioned_df = pt.partitioned_dataset(
+                *raw_files, spill_dir=tmp_path / 'spill', n_buckets=2,
+                window_seconds=300, chunksize=5000)
+        assert_identical(partitioned_df, in_memory_dataset(*raw_files))
+
+    def test_spill(self, tmp_path, global_sample_files):
+        """ Tests if every spilled partition holds one host bucket and time
+        window
+
+        """
+        spilled = pt.spill_gpu(global_sample_files[0], tmp_path,
+                               n_buckets=2, window_seconds=300,
+                               chunksize=3000)
+        for bucket, windows in spilled['windows'].items():
+            for window in windows:
+                samples_df = pt.load_partition(tmp_path, bucket, window)
+                assert (set(pt.host_buckets(samples_df['hostname'].values,
+                                            2)) == {bucket})
+                assert (set(samples_df['time'] // int(300e9)) == {window})
+                assert (samples_df['row'].is_monotonic_increasing)
+        assert (pt.load_partition(tmp_path, 5, 0) is None)
+
+    def test_build(self, tmp_path, global_sample_files):
+        """ Tests if a partitioned build writes the in memory final dataset
+        and refuses the modes it cannot be combined with
+
+        """
+        raw_dir = os.path.dirname(str(global_sample_files[0]))
+        args = ['--raw-dir', raw_dir, '--interim-dir',
+                str(tmp_path / 'interim')]
+        md.cli(args + ['--processed-dir', str(tmp_path / 'memory'),
+                       '--no-cache'])
+        md.cli(args + ['--processed-dir', str(tmp_path / 'partitioned'),
+                       '--partitioned'])
+        memory_df, partitioned_df = [
+                pd.read_csv(str(tmp_path / name / 'processed.csv'))
+                for name in ['memory', 'partitioned']]
+
+        pd.testing.assert_frame_equal(partitioned_df, memory_df)
+        assert (os.listdir(str(tmp_path / 'interim')) == [])
+        with pytest.raises(ValueError):
+            md.cli(args + ['--partitioned', '--streaming'])
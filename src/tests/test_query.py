@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the indexed queries
+over the final dataset
+
+Code
+------
+
+"""
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import query as qr
+from src.data import ingest as ig
+from src.data.synthetic import write_traces
+import pytest
+
+@pytest.fixture
+def global_final_df(tmp_path):
+    """Fixture used to pass a synthetic final dataset (three hosts, two
+    levels)
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        final dataset
+    """
+    gpu_csv, check_csv, task_csv = write_traces(tmp_path, hosts=3,
+                                                duration=900,
+                                                levels=(4, 12))
+    return(md.merge_check_task_gpu(
+            md.clean_gpu(ig.read_gpu(gpu_csv)),
+            md.clean_check_task(md.merge_check_task(
+                    ig.read_checkpoints(check_csv),
+                    ig.read_tasks(task_csv)))))
+
+@pytest.mark.usefixtures('global_final_df')
+class TestProcessedQuery(object):
+    """ Tests indexed queries against boolean masks
+
+    """
+
+    def test_select(self, global_final_df):
+        """ Tests if indexed filters give the masked rows
+
+        """
+        query = qr.ProcessedQuery(global_final_df)
+        df = query.df
+        host = df['hostname'][0]
+        expected_df = df[(df['eventName'] == 'Render') &
+                         (df['hostname'] == host)]
+        pd.testing.assert_frame_equal(
+                query.select(eventName='Render', hostname=host),
+                expected_df)
+
+        tile = (df['x'][0], df['y'][0])
+        assert (len(query.select(tile=tile)) ==
+                ((df['x'] == tile[0]) & (df['y'] == tile[1])).sum())
+        assert (len(query.select(level=[4, 12])) == len(df))
+        assert (len(query.select(eventName='missing')) == 0)
+
+    def test_aggregate_between(self, global_final_df):
+        """ Tests tiles at level 12 above the median temperature
+
+        """
+        query = qr.ProcessedQuery(global_final_df)
+        df = query.df
+        level_df = df[df['level'] == 12]
+        median = query.aggregate('level', ['gpuTempC'], 'median',
+                                 level=12)['gpuTempC'][12]
+        assert (median == level_df['gpuTempC'].median())
+        hot_df = query.select(columns=['x', 'y'], level=12,
+                              between={'gpuTempC': (median, None)})
+        assert (len(hot_df) == (level_df['gpuTempC'] >= median).sum())
+
+    def test_memo(self, global_final_df):
+        """ Tests if repeated queries hit the memo and old ones are evicted
+
+        """
+        query = qr.ProcessedQuery(global_final_df, cache_size=2)
+        query.select(level=12)
+        assert (query.select(level=12) is query.select(level=12))
+        pd.testing.assert_frame_equal(query.select(level=12),
+                                      query.df[query.df['level'] == 12])
+        query.select(level=4)
+        query.select(eventName='Render')
+        query.select(level=12)
+        assert (query.cache_info() ==
+                {'hits': 3, 'misses': 4, 'size': 2, 'maxsize': 2})
+
+    def test_default_path(self, tmp_path, monkeypatch, global_final_df):
+        """ Tests if a query without a dataset loads the csv final dataset
+        a default build writes
+
+        """
+        path = str(tmp_path / 'processed.csv')
+        monkeypatch.setattr(md, 'PROCESSED_FILES', {
+                'csv': path, 'parquet': str(tmp_path / 'processed.parquet'),
+                'feather': str(tmp_path / 'processed.feather')})
+        md.save_processed(global_final_df, path, 'csv')
+        assert (len(qr.ProcessedQuery().df) == len(global_final_df))
+
+    def test_not_indexed(self, global_final_df):
+        """ Tests if filters on columns without index are refused
+
+        """
+        with pytest.raises(ValueError):
+            qr.ProcessedQuery(global_final_df).select(gpuTempC=40)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the multi resolution
+gpu rollups
+
+Code
+------
+
+"""
+import numpy as np
+import pandas as pd
+from src.data import rollups as ru
+from src.data import ingest as ig
+from src.data.synthetic import write_traces
+import pytest
+
+@pytest.fixture
+def global_gpu_df(tmp_path):
+    """Fixture used to pass typed synthetic gpu samples of three hosts over
+    20 minutes
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        typed gpu dataframe
+    """
+    return(ig.read_gpu(write_traces(tmp_path, hosts=3, duration=1200)[0]))
+
+@pytest.mark.usefixtures('global_gpu_df')
+class TestRollups(object):
+    """ Tests rollups and range queries against the gpu samples
+
+    """
+
+    def test_resolutions_agree(self, global_gpu_df):
+        """ Tests if every resolution sums to the same totals
+
+        """
+        rollups_df = ru.build_rollups(global_gpu_df)
+        totals = rollups_df.groupby('resolution', observed=True)[
+                ['gpuTempC_count', 'gpuTempC_sum']].sum()
+        assert (list(totals['gpuTempC_count']) ==
+                [len(global_gpu_df)] * len(ru.RESOLUTIONS))
+        assert (np.allclose(totals['gpuTempC_sum'],
+                            global_gpu_df['gpuTempC'].astype(float).sum()))
+
+    def test_query_resolution(self, tmp_path, global_gpu_df):
+        """ Tests if the coarsest fitting rollup is chosen after a round
+        trip through parquet
+
+        """
+        ru.write_rollups(ru.build_rollups(global_gpu_df), tmp_path / 'ru')
+        rollups = ru.load_rollups(tmp_path / 'ru')
+        assert (sorted(rollups) == sorted(name for name, _ in
+                                          ru.RESOLUTIONS))
+        assert (ru.query_resolution(rollups, '2018-11-08 07:40:00',
+                                    '2018-11-08 08:00:00') == '10min')
+        assert (ru.query_resolution(rollups, '2018-11-08 07:40:00',
+                                    '2018-11-08 08:00:00', step=30) == '10s')
+        assert (ru.query_resolution(rollups, '2018-11-08 07:41:03',
+                                    '2018-11-08 08:00:00') == '1s')
+
+    def test_query_matches_samples(self, global_gpu_df):
+        """ Tests if range queries equal aggregates of the samples
+
+        """
+        rollups_df = ru.build_rollups(global_gpu_df)
+        rollups = {name: rollup_df.drop(columns='resolution').reset_index(
+                drop=True) for name, rollup_df in rollups_df.groupby(
+                        'resolution', observed=True)}
+        start = pd.Timestamp('2018-11-08 07:42:00')
+        stop = pd.Timestamp('2018-11-08 07:52:00')
+        result_df = ru.query_rollups(rollups, start, stop, step=60)
+
+        samples = global_gpu_df[(global_gpu_df['timestamp'] >= start) &
+                                (global_gpu_df['timestamp'] < stop)]
+        expected = samples.groupby(
+                [samples['hostname'].astype(str),
+                 samples['timestamp'].dt.floor('60s')])['gpuUtilPerc']
+        assert (len(result_df) == expected.ngroups)
+        assert (np.allclose(result_df['gpuUtilPerc_mean'],
+                            expected.mean().values))
+        assert (np.allclose(result_df['gpuUtilPerc_max'],
+                            expected.max().values))
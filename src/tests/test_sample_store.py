@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the memory-mapped
+gpu sample store
+
+Code
+------
+
+"""
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import sample_store as ss
+from src.data import ingest as ig
+from src.data.synthetic import write_traces
+import pytest
+
+@pytest.fixture
+def global_raw_dfs(tmp_path):
+    """Fixture used to pass cleaned synthetic gpu and checkpoints dataframes
+    (gpu samples shuffled)
+
+    Returns
+    -------
+    tuple
+        cleaned gpu and application checkpoints and tasks dataframes
+    """
+    gpu_csv, check_csv, task_csv = write_traces(tmp_path, hosts=3,
+                                                duration=600)
+    gpu_df = md.clean_gpu(ig.read_gpu(gpu_csv))
+    gpu_df = gpu_df.sample(frac=1, random_state=0).reset_index(drop=True)
+    check_task_df = md.clean_check_task(md.merge_check_task(
+            ig.read_checkpoints(check_csv), ig.read_tasks(task_csv)))
+    return(gpu_df, check_task_df)
+
+@pytest.mark.usefixtures('global_raw_dfs')
+class TestSampleStore(object):
+    """ Tests store lookups against the gpu dataframe
+
+    """
+
+    def test_range_lookup(self, tmp_path, global_raw_dfs):
+        """ Tests if a host range gives the same samples without copying
+
+        """
+        gpu_df = global_raw_dfs[0]
+        ss.write_store(gpu_df, tmp_path / 'store')
+        store = ss.SampleStore(tmp_path / 'store')
+        host = str(gpu_df['hostname'][0])
+        start = pd.Timestamp('2018-11-08 07:43:00')
+        stop = pd.Timestamp('2018-11-08 07:45:00')
+
+        expected_df = gpu_df[(gpu_df['hostname'] == host) &
+                             (gpu_df['timestamp'] >= start) &
+                             (gpu_df['timestamp'] <= stop)].sort_values(
+                                     'timestamp')
+        samples = store.samples(host, start, stop)
+        assert (isinstance(samples['gpuTempC'], np.memmap))
+        assert (list(samples['gpuTempC']) == list(expected_df['gpuTempC']))
+        assert (list(store.frame(host, start, stop)['gpuUUID']) ==
+                list(expected_df['gpuUUID'].astype(str)))
+        assert (store.bounds('missing-host', start, stop)[1] ==
+                store.bounds('missing-host', start, stop)[0])
+        assert (store.time_range() == (gpu_df['timestamp'].min(),
+                                       gpu_df['timestamp'].max()))
+
+    def test_unsorted_time_range(self, global_raw_dfs):
+        """ Tests if shuffled gpu samples keep every task in range
+
+        """
+        gpu_df, check_task_df = global_raw_dfs
+        sorted_df = gpu_df.sort_values('timestamp').reset_index(drop=True)
+        assert (len(md.task_intervals(gpu_df, check_task_df)) ==
+                len(md.task_intervals(sorted_df, check_task_df)))
+
+    def test_cached_build(self, tmp_path):
+        """ Tests if a cached build writes the store of the cleaned gpu
+        samples, again when they come from the stage cache
+
+        """
+        raw_files = write_traces(tmp_path / 'raw', hosts=2, duration=300)
+        args = ['--raw-dir', str(tmp_path / 'raw'), '--processed-dir',
+                str(tmp_path / 'processed'), '--interim-dir',
+                str(tmp_path / 'interim'), '--sample-store']
+        gpu_df = md.clean_gpu(ig.read_gpu(raw_files[0]))
+        for _ in range(2):
+            md.cli(args)
+            store = ss.SampleStore(tmp_path / 'processed' / 'gpu_store')
+            assert (len(store) == len(gpu_df))
+            assert (store.time_range() == (gpu_df['timestamp'].min(),
+                                           gpu_df['timestamp'].max()))
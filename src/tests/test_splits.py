@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the conditional
+split analysis of the final dataset
+
+Code
+------
+
+"""
+import statistics
+import numpy as np
+import pandas as pd
+from src.data import splits as sp
+from src.data.interval_join import GPU_METRICS
+import pytest
+
+@pytest.fixture
+def global_processed_df(global_sample_check_task_gpu):
+    """Fixture used to pass the miniature final dataset
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        final dataframe
+    """
+    return(global_sample_check_task_gpu.copy())
+
+def masked_durations(df, metric, low, high, event):
+    """ Gives the durations of the rows of an event with a metric reading in
+    (low, high] with boolean masks, like the data understanding notebook
+    """
+    selected_df = df[(df[metric] > low) & (df[metric] <= high) &
+                     (df['eventName'] == event)]
+    return(np.sort((selected_df['stop_time'] -
+                    selected_df['start_time']).dt.total_seconds().values))
+
+@pytest.mark.usefixtures('global_processed_df')
+class TestSplits(object):
+    """ Tests split distributions against masked frames
+
+    """
+
+    def test_cut_points(self):
+        """ Tests if partitioned cut points are numpy quantiles
+
+        """
+        values = np.random.RandomState(0).normal(size=1001)
+        quantiles = [0, 0.1, 0.5, 0.75, 1]
+        assert (np.allclose(sp.cut_points(values, quantiles),
+                            np.quantile(values, quantiles)))
+        assert (sp.cut_points(values[:10], [0.5])[0] ==
+                statistics.median(values[:10]))
+        assert (np.isnan(sp.cut_points(values[:0], [0.5])).all())
+
+    def test_median_split(self, global_processed_df):
+        """ Tests if median splits give the notebook Render distributions
+
+        """
+        durations = sp.split_durations(global_processed_df,
+                                       ['gpuTempC', 'powerDrawWatt'],
+                                       events=['Render'])
+        for metric in ['gpuTempC', 'powerDrawWatt']:
+            median = statistics.median(global_processed_df[metric])
+            below = masked_durations(global_processed_df, metric, -np.inf,
+                                     median, 'Render')
+            above = masked_durations(global_processed_df, metric, median,
+                                     np.inf, 'Render')
+            assert (np.array_equal(durations[(metric, 0, 'Render')], below))
+            assert (np.array_equal(durations[(metric, 1, 'Render')], above))
+
+    def test_describe(self, global_processed_df):
+        """ Tests if a sweep summary matches a groupby per split
+
+        """
+        quantiles = [0.25, 0.5, 0.9]
+        summary_df = sp.describe_splits(global_processed_df,
+                                        quantiles=quantiles)
+        events = global_processed_df['eventName'].nunique()
+        assert (len(summary_df) <= len(GPU_METRICS) * 4 * events)
+        assert (summary_df.groupby('metric')['count'].sum().max() ==
+                len(global_processed_df))
+
+        row = summary_df.loc[('gpuUtilPerc', 2, 'Render')]
+        expected = masked_durations(global_processed_df, 'gpuUtilPerc',
+                                    row['cut_low'], row['cut_high'],
+                                    'Render')
+        assert (row['count'] == len(expected))
+        assert (np.isclose(row['mean'], expected.mean()))
+        assert (np.isclose(row['median'], np.median(expected)))
+        assert (np.isclose(row['q3'], np.quantile(expected, 0.75)))
+        assert (row['max'] == expected.max())
+
+    def test_missing_readings(self, global_processed_df):
+        """ Tests if rows without a reading are left out of its splits
+
+        """
+        global_processed_df.loc[global_processed_df.index[:5],
+                                'gpuTempC'] = np.nan
+        summary_df = sp.describe_splits(global_processed_df, ['gpuTempC'])
+        assert (summary_df['count'].sum() == len(global_processed_df) - 5)
+        with pytest.raises(ValueError):
+            sp.describe_splits(global_processed_df, ['missing'])
+        with pytest.raises(ValueError):
+            sp.describe_splits(global_processed_df, quantiles=[1.5])
+        assert (len(sp.describe_splits(pd.DataFrame(
+                columns=global_processed_df.columns))) == 0)
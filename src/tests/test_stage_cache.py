@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the stage cache of
+the data preparation process
+
+Code
+------
+
+"""
+import os
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import stage_cache as sc
+from src.data import ingest as ig
+import pytest
+
+@pytest.fixture
+def global_raw_files(tmp_path):
+    """Fixture used to pass small raw gpu, checkpoints and tasks csv files
+    (one host, one task)
+
+    Returns
+    -------
+    list
+        gpu, checkpoints and tasks file locations
+    """
+    stamps = ['2018-11-08T07:41:{:02d}.000Z'.format(second)
+              for second in range(10)]
+    raw = [pd.DataFrame({'timestamp': stamps, 'hostname': 'host-a',
+                         'gpuSerial': 0, 'gpuUUID': 'GPU-a',
+                         'powerDrawWatt': [float(i) for i in range(10)],
+                         'gpuTempC': 40, 'gpuUtilPerc': 90,
+                         'gpuMemUtilPerc': 30}),
+           pd.DataFrame({'timestamp': [stamps[1], stamps[8]],
+                         'hostname': 'host-a', 'eventName': 'Render',
+                         'eventType': ['START', 'STOP'], 'jobId': 'job',
+                         'taskId': 'task'}),
+           pd.DataFrame({'taskId': ['task'], 'jobId': 'job', 'x': 1,
+                         'y': 2, 'level': 12})]
+    paths = [str(tmp_path / name) for name in
+             ['gpu.csv', 'application-checkpoints.csv', 'task-x-y.csv']]
+    for df, path in zip(raw, paths):
+        df.to_csv(path, index=False)
+    return(paths)
+
+@pytest.mark.usefixtures('global_raw_files')
+class TestStageCache(object):
+    """ Tests cached stage outputs against recomputed ones
+
+    """
+
+    def test_matches_uncached(self, tmp_path, global_raw_files):
+        """ Tests if cached and loaded outputs equal a plain run
+
+        """
+        gpu_csv, check_csv, task_csv = global_raw_files
+        expected_df = md.merge_check_task_gpu(
+                md.clean_gpu(ig.read_gpu(gpu_csv)),
+                md.clean_check_task(md.merge_check_task(
+                        ig.read_checkpoints(check_csv),
+                        ig.read_tasks(task_csv))))
+        cache = sc.StageCache(tmp_path / 'interim')
+        for _ in range(2):
+            pd.testing.assert_frame_equal(
+                    sc.cached_stages(*global_raw_files, cache=cache),
+                    expected_df)
+
+    def test_skips_unchanged(self, tmp_path, global_raw_files, monkeypatch):
+        """ Tests if a second run computes nothing and a changed raw file
+        recomputes the stages reading it
+
+        """
+        cache = sc.StageCache(tmp_path / 'interim')
+        sc.cached_stages(*global_raw_files, cache=cache)
+        calls = []
+        for stage in ['clean_gpu', 'merge_check_task', 'clean_check_task',
+                      'merge_check_task_gpu']:
+            func = getattr(md, stage)
+            monkeypatch.setattr(md, stage, lambda *args, func=func,
+                                stage=stage: calls.append(stage) or
+                                func(*args))
+        sc.cached_stages(*global_raw_files, cache=cache)
+        assert (calls == [])
+
+        with open(global_raw_files[0], 'a') as gpu_file:
+            gpu_file.write('2018-11-08T07:41:10.000Z,host-a,0,GPU-a,'
+                           '5.0,40,90,30\n')
+        sc.cached_stages(*global_raw_files, cache=cache)
+        assert (sorted(calls) == ['clean_gpu', 'merge_check_task_gpu'])
+
+    def test_eviction(self, tmp_path):
+        """ Tests if the least recently used outputs are evicted first
+
+        """
+        cache = sc.StageCache(tmp_path / 'interim', max_bytes=0)
+        df = pd.DataFrame({'a': range(100)})
+        cache.put('first', df)
+        cache.put('second', df)
+        assert not (os.path.exists(cache.path('first')))
+        pd.testing.assert_frame_equal(cache.get('second'), df)
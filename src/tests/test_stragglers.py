@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the straggler and
+anomaly detection stage
+
+Code
+------
+
+"""
+import os
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import stragglers as st
+from src.data.interval_join import TASK_KEYS
+from src.data.load_dataset import load_stragglers
+import pytest
+
+@pytest.fixture
+def global_processed_df(global_sample_check_task_gpu):
+    """Fixture used to pass the miniature final dataset
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        final dataframe
+    """
+    return(global_sample_check_task_gpu.copy())
+
+def durations(df):
+    """ Gives the task durations of a final dataset in seconds
+    """
+    return((df['stop_time'] - df['start_time']).dt.total_seconds())
+
+@pytest.mark.usefixtures('global_processed_df')
+class TestStragglers(object):
+    """ Tests straggler scores against groupbys
+
+    """
+
+    def test_robust_z(self, global_processed_df):
+        """ Tests if robust z-scores use the median and MAD of every peer
+        group
+
+        """
+        df = global_processed_df
+        values = df['gpuTempC'].values.astype(np.float64)
+        values[:3] = np.nan
+        codes = df.groupby(st.PEER_GROUPS, observed=True).ngroup().values
+        z = st.robust_z(values, codes)
+
+        series = pd.Series(values)
+        medians = series.groupby(codes).transform('median')
+        mads = (series - medians).abs().groupby(codes).transform('median')
+        expected = (series - medians) / (st.MAD_SCALE * mads)
+        spread = (mads > 0).values & ~np.isnan(values)
+        assert (np.isnan(z[:3]).all())
+        assert (spread[3:].any())
+        assert (np.allclose(z[spread], expected[spread]))
+
+    def test_no_spread(self):
+        """ Tests if groups with a MAD of 0 fall back on the mean absolute
+        deviation and constant groups score 0
+
+        """
+        values = np.array([5., 5., 5., 5., 9., 1., 1., 1.])
+        codes = np.array([0, 0, 0, 0, 0, 1, 1, 1])
+        z = st.robust_z(values, codes)
+        assert ((z[:4] == 0).all())
+        assert (np.isclose(z[4], 4 / (st.MEAN_AD_SCALE * 0.8)))
+        assert ((z[5:] == 0).all())
+        assert (np.isnan(st.robust_z(np.array([np.nan]),
+                                     np.array([0]))).all())
+
+    def test_host_baselines(self, global_processed_df):
+        """ Tests if host baselines are rolling means of the previous tasks
+        of a host, eventName and level
+
+        """
+        df = global_processed_df.sample(frac=1, random_state=0)
+        df = df.reset_index(drop=True)
+        keys = ['hostname'] + st.PEER_GROUPS
+        codes = df.groupby(keys, observed=True).ngroup().values
+        starts = df['start_time'].values.astype(np.int64)
+        baselines = st.host_baselines(durations(df).values, codes, starts,
+                                      window=5)
+
+        ordered_df = df.assign(duration=durations(df)).sort_values(
+                keys + ['start_time'])
+        expected = ordered_df.groupby(keys, observed=True)['duration'] \
+            .transform(lambda d: d.rolling(5, min_periods=1).mean().shift())
+        assert (np.allclose(baselines[ordered_df.index.values],
+                            expected.values, equal_nan=True))
+
+    def test_injected(self, global_processed_df):
+        """ Tests if slow, hot and underused tasks put in a run are flagged
+
+        """
+        df = global_processed_df
+        render = np.flatnonzero((df['eventName'] == 'Render').values)
+        slow, hot, underused = df.index[render[[10, 20, 30]]]
+        df.loc[slow, 'stop_time'] = (df.loc[slow, 'start_time'] +
+                                     durations(df).max() * pd.Timedelta(
+                                             '10s'))
+        df.loc[hot, 'gpuTempC'] = df['gpuTempC'].max() + 50
+        df.loc[underused, 'gpuUtilPerc'] = -100
+
+        stragglers_df = st.find_stragglers(df)
+        flagged = stragglers_df.set_index(TASK_KEYS)
+        assert (flagged.loc[tuple(df.loc[slow, TASK_KEYS]), 'slow'])
+        assert (flagged.loc[tuple(df.loc[slow, TASK_KEYS]), 'host_slow'])
+        assert (flagged.loc[tuple(df.loc[hot, TASK_KEYS]), 'hot'])
+        assert (flagged.loc[tuple(df.loc[underused, TASK_KEYS]),
+                            'underused'])
+        assert (list(stragglers_df[TASK_KEYS].iloc[0]) ==
+                list(df.loc[slow, TASK_KEYS]))
+        assert (stragglers_df[st.STRAGGLER_FLAGS].any(axis=1).all())
+        assert (len(stragglers_df) < len(df))
+
+    def test_build(self, tmp_path, global_sample_files):
+        """ Tests if a build writes the stragglers table of its final
+        dataset when asked to
+
+        """
+        raw_dir = os.path.dirname(str(global_sample_files[0]))
+        args = ['--raw-dir', raw_dir, '--interim-dir',
+                str(tmp_path / 'interim'), '--format', 'parquet']
+        md.cli(args + ['--processed-dir', str(tmp_path / 'out'),
+                       '--stragglers'])
+        md.cli(args + ['--processed-dir', str(tmp_path / 'skipped')])
+
+        processed_df = pd.read_parquet(str(tmp_path / 'out' /
+                                           'processed.parquet'))
+        stragglers_df = load_stragglers(tmp_path / 'out' /
+                                        'stragglers.parquet')
+        expected_df = st.find_stragglers(processed_df)
+        pd.testing.assert_frame_equal(
+                stragglers_df[TASK_KEYS + ['duration_z']],
+                expected_df[TASK_KEYS + ['duration_z']], check_dtype=False,
+                check_categorical=False)
+        assert (not os.path.exists(str(tmp_path / 'skipped' /
+                                       'stragglers.parquet')))
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the streaming
+(chunked) data preparation process
+
+Code
+------
+
+"""
+import pandas as pd
+import numpy as np
+from src.data import make_dataset as md
+from src.data import streaming as st
+import pytest
+
+@pytest.fixture
+def global_gpu():
+    """Fixture used to pass a small cleaned GPU dataframe (three hosts, one
+    sample every second, in time order)
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        GPU dataframe
+    """
+    rng = np.random.RandomState(0)
+    times = pd.date_range('2018-11-08 07:41:00', periods=120, freq='s')
+    hosts = ['host-a', 'host-b', 'host-c']
+    gpu_df = pd.DataFrame({
+        'timestamp': np.repeat(times, len(hosts)),
+        'hostname': hosts * len(times),
+        'gpuUUID': [host.replace('host', 'GPU') for host in hosts] *
+                   len(times),
+        'powerDrawWatt': rng.uniform(25, 200, len(times) * len(hosts)),
+        'gpuTempC': rng.randint(30, 50, len(times) * len(hosts)),
+        'gpuUtilPerc': rng.randint(0, 100, len(times) * len(hosts)),
+        'gpuMemUtilPerc': rng.randint(0, 60, len(times) * len(hosts))})
+    return(gpu_df)
+
+@pytest.fixture
+def global_check_task_df():
+    """Fixture used to pass a small cleaned checkpoints and tasks dataframe
+    with back to back tasks on every host
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        application checkpoints and tasks cleaned dataframe
+    """
+    base = pd.Timestamp('2018-11-08 07:41:00')
+    rows = []
+    for host_id, host in enumerate(['host-a', 'host-b', 'host-c']):
+        for task in range(10):
+            start = 2 + task * 12 + host_id * 0.5
+            for name, begin, end in [('TotalRender', 0, 11),
+                                     ('Render', 0.2, 9),
+                                     ('Uploading', 9, 10.8)]:
+                rows.append((host, name, 'START', start + begin, task))
+                rows.append((host, name, 'STOP', start + end, task))
+    return(pd.DataFrame({
+        'timestamp': [base + pd.Timedelta(seconds=row[3]) for row in rows],
+        'hostname': [row[0] for row in rows],
+        'eventName': [row[1] for row in rows],
+        'eventType': [row[2] for row in rows],
+        'x': [row[4] for row in rows],
+        'y': [row[4] * 2 for row in rows],
+        'level': 12}))
+
+def chunks(df, size):
+    """ Splits a dataframe into row chunks
+
+    Parameters
+    ----------
+    df
+        dataframe to split
+    size
+        rows per chunk
+
+    Returns
+    -------
+    list
+        dataframe chunks
+    """
+    return([df.iloc[i:i + size] for i in range(0, len(df), size)])
+
+@pytest.mark.usefixtures('global_gpu', 'global_check_task_df')
+class TestStreamingMerge(object):
+    """ Tests the streaming merge against the in memory merge
+
+    """
+
+    def test_matches_batch(self, global_gpu, global_check_task_df):
+        """ Tests if streaming chunks gives the same task averages
+
+        """
+        batch_df = md.merge_check_task_gpu(global_gpu.copy(),
+                                           global_check_task_df.copy())
+        stream_df = pd.concat(st.stream_merge_check_task_gpu(
+                chunks(global_gpu, 50), global_check_task_df.copy()))
+        keys = ['hostname', 'eventName', 'x', 'y', 'level']
+        pd.testing.assert_frame_equal(
+                stream_df.sort_values(keys).reset_index(drop=True),
+                batch_df.sort_values(keys).reset_index(drop=True))
+
+    def test_emits_early(self, global_gpu, global_check_task_df):
+        """ Tests if finished tasks come out before the last chunk
+
+        """
+        batches = st.stream_merge_check_task_gpu(
+                chunks(global_gpu, 60), global_check_task_df)
+        assert (len(next(batches)) > 0)
+
+    def test_out_of_order(self, global_gpu, global_check_task_df):
+        """ Tests if chunks going back in time are rejected
+
+        """
+        gpu_chunks = chunks(global_gpu, 60)[::-1]
+        with pytest.raises(ValueError):
+            list(st.stream_merge_check_task_gpu(gpu_chunks,
+                                                global_check_task_df))
+
+    def test_open_window(self, monkeypatch, global_gpu,
+                         global_check_task_df):
+        """ Tests if only the intervals reached and not yet emitted are
+        accumulated
+
+        """
+        sizes = []
+
+        class RecordedIntervals(st.OpenIntervals):
+            def accumulate(self, *args):
+                sizes.append(len(self))
+                super(RecordedIntervals, self).accumulate(*args)
+
+        monkeypatch.setattr(st, 'OpenIntervals', RecordedIntervals)
+        list(st.stream_merge_check_task_gpu(chunks(global_gpu, 30),
+                                            global_check_task_df))
+        n_intervals = len(md.pair_check_task(global_check_task_df))
+        assert (len(sizes) > 5)
+        assert (0 < max(sizes) < n_intervals / 3)
+
+    def test_close(self):
+        """ Tests if closing a range gives dense accumulators and only
+        keeps the later intervals open
+
+        """
+        open_intervals = st.OpenIntervals()
+        open_intervals.open(np.array([4, 2, 7]))
+        open_intervals.sums[:] = 1
+        open_intervals.first[:] = [10, 11, 12]
+        sums, counts, first, uuids = open_intervals.close(2, 6)
+        assert (list(first) == [11, -1, 10, -1])
+        assert (list(sums[:, 0]) == [1, 0, 1, 0])
+        assert (list(open_intervals.positions) == [7])
+        assert (open_intervals.first[0] == 12)
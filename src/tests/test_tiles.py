@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Introduction
+--------------
+
+This python file contains the source code used to test the tile grid
+(spatial) index of the final dataset
+
+Code
+------
+
+"""
+import numpy as np
+import pandas as pd
+from src.data import make_dataset as md
+from src.data import tiles as tl
+import pytest
+
+@pytest.fixture
+def global_processed_df(global_sample_check_task_gpu):
+    """Fixture used to pass the miniature final dataset, typed
+
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        typed final dataframe
+    """
+    return(md.typed_processed(global_sample_check_task_gpu))
+
+def grouped_means(df, level, factor=1):
+    """ Averages task durations per tile with a groupby
+
+    Parameters
+    ----------
+    df
+        final dataset
+    level
+        tile level of the rows used
+    factor
+        tiles a side merged
+
+    Returns
+    -------
+    pandas.core.series.Series
+        mean duration per (y, x) tile
+    """
+    level_df = df[(df['eventName'] == 'TotalRender') & (df['level'] == level)]
+    durations = (level_df['stop_time'] -
+                 level_df['start_time']).dt.total_seconds()
+    return(durations.groupby([level_df['y'] // factor,
+                              level_df['x'] // factor]).mean())
+
+def heatmap_values(heatmap, means):
+    """ Gives the heatmap values of the tiles of a groupby result
+    """
+    ys, xs = zip(*means.index)
+    return(heatmap[np.array(ys), np.array(xs)])
+
+@pytest.mark.usefixtures('global_processed_df')
+class TestTileGrid(object):
+    """ Tests tile grids against groupbys of the final dataset
+
+    """
+
+    def test_heatmap(self, global_processed_df):
+        """ Tests if every level heatmap holds the per tile averages
+
+        """
+        grid = tl.TileGrid(global_processed_df)
+        for level in grid.levels:
+            heatmap = grid.heatmap(level)
+            means = grouped_means(global_processed_df, level)
+            assert (heatmap.shape == (tl.level_side(level),) * 2)
+            assert (np.allclose(heatmap_values(heatmap, means), means))
+            assert (np.isnan(heatmap).sum() == heatmap.size - len(means))
+
+    def test_rollup(self, global_processed_df):
+        """ Tests if a rolled up level averages the finer tiles inside its
+        tiles and levels without rows are rolled up from the finest one
+
+        """
+        grid = tl.TileGrid(global_processed_df)
+        fine = max(grid.levels)
+        coarse = max(fine - 4, tl.ROOT_LEVEL)
+        factor = 2 ** (fine - coarse)
+        heatmap = grid.heatmap(coarse, source=fine)
+        means = grouped_means(global_processed_df, fine, factor)
+        assert (np.allclose(heatmap_values(heatmap, means), means))
+        assert (grid.heatmap(coarse, 'duration', 'count', fine).sum() ==
+                grid.heatmap(fine, 'duration', 'count').sum())
+        level_df = global_processed_df[
+                (global_processed_df['eventName'] == 'TotalRender') &
+                (global_processed_df['level'] == fine)]
+        maxima = level_df['gpuTempC'].groupby(
+                [level_df['y'] // factor, level_df['x'] // factor]).max()
+        assert (np.allclose(heatmap_values(grid.heatmap(
+                coarse, 'gpuTempC', 'max', fine), maxima), maxima))
+
+        missing = fine - 1
+        assert (missing not in grid.levels)
+        assert (grid.heatmap(missing).shape == (tl.level_side(missing),) * 2)
+        with pytest.raises(ValueError):
+            grid.heatmap(fine, source=coarse)
+
+    def test_queries(self, global_processed_df):
+        """ Tests neighbourhood, sub-tile, host and tile queries
+
+        """
+        grid = tl.TileGrid(global_processed_df)
+        fine = max(grid.levels)
+        coarse = max(fine - 4, tl.ROOT_LEVEL)
+        factor = 2 ** (fine - coarse)
+        heatmap = grid.heatmap(fine)
+
+        assert (np.array_equal(grid.window(fine, 0, 0, radius=2),
+                               heatmap[:3, :3], equal_nan=True))
+        assert (grid.window(fine, 5, 5, radius=2).shape == (5, 5))
+        assert (np.array_equal(grid.children(coarse, 0, 0, fine),
+                               heatmap[:factor, :factor], equal_nan=True))
+
+        row = global_processed_df[
+                (global_processed_df['eventName'] == 'TotalRender') &
+                (global_processed_df['level'] == fine)].iloc[0]
+        stats = grid.tile(fine, row['x'], row['y'])
+        assert (stats['hostname'] == row['hostname'])
+        assert (np.isclose(stats['powerDrawWatt'], row['powerDrawWatt']))
+        block_hosts = set(grid.hosts(fine)[:factor, :factor].ravel())
+        block_hosts.discard(tl.HOST_EMPTY)
+        expected = (tl.HOST_EMPTY if not block_hosts else
+                    block_hosts.pop() if len(block_hosts) == 1 else
+                    tl.HOST_MIXED)
+        assert (grid.hosts(coarse, fine)[0, 0] == expected)
+        with pytest.raises(ValueError):
+            grid.heatmap(fine, 'hostname')
+
+    def test_out_of_grid(self):
+        """ Tests if tiles outside their level are refused
+
+        """
+        df = pd.DataFrame({'hostname': ['a'], 'eventName': ['TotalRender'],
+                           'x': [2], 'y': [0], 'level': [5],
+                           'start_time': [pd.Timestamp('2018-11-08')],
+                           'stop_time': [pd.Timestamp('2018-11-08')]})
+        for metric in tl.GPU_METRICS:
+            df[metric] = 1.0
+        with pytest.raises(ValueError):
+            tl.TileGrid(df)
+
+    def test_default_path(self, tmp_path, monkeypatch, global_processed_df):
+        """ Tests if a grid without a dataset loads the csv final dataset a
+        default build writes
+
+        """
+        path = str(tmp_path / 'processed.csv')
+        monkeypatch.setattr(md, 'PROCESSED_FILES', {
+                'csv': path, 'parquet': str(tmp_path / 'processed.parquet'),
+                'feather': str(tmp_path / 'processed.feather')})
+        md.save_processed(global_processed_df, path, 'csv')
+        assert (tl.TileGrid().levels == tl.TileGrid(
+                global_processed_df).levels)
+
+    def test_untyped(self, global_processed_df):
+        """ Tests if an untyped final dataset (text times, object columns)
+        builds the grids of the typed one
+
+        """
+        untyped_df = global_processed_df.astype(
+                {column: str for column in md.CATEGORICAL_COLUMNS +
+                 md.TIME_COLUMNS})
+        typed, untyped = [tl.TileGrid(df)
+                          for df in [global_processed_df, untyped_df]]
+        assert (typed.levels == untyped.levels)
+        for level in typed.levels:
+            for name, grid in typed.grid(level).items():
+                np.testing.assert_array_equal(untyped.grid(level)[name],
+                                              grid)